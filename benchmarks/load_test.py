@@ -0,0 +1,186 @@
+# Load test for the REST API: concurrent clients request a mix of endpoints and the latency percentiles
+# and the throughput are reported per concurrency level.
+#
+# Usage (from the project root):
+#   python benchmarks/load_test.py                              # starts the app on a free port
+#   python benchmarks/load_test.py --url http://localhost:8000  # tests a running app
+#   python benchmarks/load_test.py --concurrency 1 16 64 --requests 2000
+#   python benchmarks/load_test.py --background-batch 5000   # readers compete with a client writing large batches
+#   python benchmarks/load_test.py --workers 4               # the app in its multi-worker mode with shared state
+#   python benchmarks/load_test.py --output results/load_test.json  # write the results for benchmarks/report.py
+
+# argparse is used to provide the command line interface
+import argparse
+# asyncio and httpx are used to run many concurrent clients from one process
+import asyncio
+import httpx
+# os, socket, subprocess and sys are used to start the app in a separate process
+import os
+import socket
+import subprocess
+import sys
+# The time module is used to measure latencies
+import time
+# defaultdict is used to collect the latencies per path
+from collections import defaultdict
+
+# Project root, the app is started from here
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entity written by the background batch client, it is deleted again after the test
+BATCH_ENTITY = "Load Test Entity"
+
+# Default mix of requested paths: the entity dropdown, statistics across all years and for year ranges,
+# the stats API for one and for all entities, the trend and the export of one entity
+DEFAULT_PATHS = [
+    "/",
+    "/data/World/all/stats",
+    "/data/Germany/1750/2020/stats",
+    "/data/Europe/1900/2000/stats",
+    "/api/stats/Germany?start_year=1990&end_year=2020",
+    "/api/stats?sort=ammonia.mean&limit=10",
+    "/api/trend/France?window=10&step=5",
+    "/api/export?entity=Italy&format=csv",
+]
+
+
+def free_port():
+    # Ask the operating system for a free TCP port
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(port, extra_args=(), workers=1):
+    # Start the app with uvicorn in a separate process, like it is run in production. Several workers are started
+    # by main.py, which builds the state shared by the workers first.
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, "src"), os.path.join(ROOT, "src", "app")]))
+    if workers > 1:
+        command = [sys.executable, os.path.join(ROOT, "src", "app", "main.py"), "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(command + list(extra_args), cwd=ROOT, env=env)
+
+    # Wait until the app answers
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            httpx.get(url + "/", timeout=1.0)
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("The app did not start within 30 seconds")
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of a list of values
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+
+async def batch_writer(url, size, stop):
+    # Upsert batches of the given size until the readers are done, a slow request competing with the fast ones
+    batch = [{"entity": BATCH_ENTITY, "year": year, "nitrogen_oxide": 1.0, "sulphur_dioxide": 1.0, "carbon_monoxide": 1.0,
+              "organic_carbon": 1.0, "nmvoc": 1.0, "black_carbon": 1.0, "ammonia": float(year)} for year in range(size)]
+    batches = 0
+    async with httpx.AsyncClient(timeout=600.0) as http:
+        while not stop.is_set():
+            await http.post(url + "/data/batch", json=batch)
+            batches += 1
+        await http.post(url + "/data/batch/delete", json=[{"entity": BATCH_ENTITY, "year": year} for year in range(size)])
+    return batches
+
+
+async def run_level(url, paths, concurrency, requests, background_batch=0):
+    # Send the given number of requests with the given number of concurrent clients
+    latencies = defaultdict(list)
+    errors = 0
+    counter = iter(range(requests))
+
+    async def client(http):
+        nonlocal errors
+        for i in counter:
+            path = paths[i % len(paths)]
+            start = time.perf_counter()
+            response = await http.get(url + path)
+            latencies[path].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60.0) as http:
+        # Warm up every path once, so first-request costs (e.g. building indexes) are not measured
+        for path in paths:
+            await http.get(url + path)
+
+        # Optionally start the background client writing batches
+        stop = asyncio.Event()
+        writer = asyncio.create_task(batch_writer(url, background_batch, stop)) if background_batch else None
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client(http) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+        if writer:
+            stop.set()
+            await writer
+
+    return elapsed, latencies, errors
+
+
+def summarize(concurrency, elapsed, latencies, errors):
+    # Throughput and latency percentiles (in milliseconds) of one concurrency level, overall and per path
+    all_latencies = [latency for values in latencies.values() for latency in values]
+
+    def stats(values):
+        return {f"p{p}": round(percentile(values, p) * 1000, 2) for p in (50, 95, 99)}
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(all_latencies),
+        "errors": errors,
+        "throughput": round(len(all_latencies) / elapsed, 1),
+        **stats(all_latencies),
+        "paths": {path: stats(values) for path, values in latencies.items()},
+    }
+
+
+def print_summary(result):
+    print(f"concurrency {result['concurrency']:>4}: {result['throughput']:>8.1f} req/s, "
+          f"p50 {result['p50']:>8.2f} ms, p95 {result['p95']:>8.2f} ms, p99 {result['p99']:>8.2f} ms, {result['errors']} errors")
+    for path, stats in result["paths"].items():
+        print(f"    {path:<40} p50 {stats['p50']:>8.2f} ms, p95 {stats['p95']:>8.2f} ms, p99 {stats['p99']:>8.2f} ms")
+
+
+def main():
+    # Define the command line interface
+    parser = argparse.ArgumentParser(description="Load test the air pollution REST API.")
+    parser.add_argument("--url", help="URL of a running app (default: start the app on a free port)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="numbers of concurrent clients (default: 1 8 32)")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per concurrency level (default: 1000)")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS, help="paths requested in turn")
+    parser.add_argument("--background-batch", type=int, default=0, help="size of the batches a background client keeps writing (default: no background writes)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of the started app (default: 1)")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    results = []
+    process, url = (None, args.url) if args.url else start_app(free_port(), workers=args.workers)
+    try:
+        for concurrency in args.concurrency:
+            results.append(summarize(concurrency, *asyncio.run(run_level(url, args.paths, concurrency, args.requests, args.background_batch))))
+            print_summary(results[-1])
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        from report import write_results
+        parameters = {"url": args.url, "requests": args.requests, "paths": args.paths, "background_batch": args.background_batch, "workers": args.workers}
+        write_results(args.output, "load_test", parameters, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# Microbenchmarks of the statistics engine, the columnar store, the HTML rendering and the CSV ingest of load_data at several data scales,
+# and of the logging overhead of a request (independent of the scale).
+# The data is synthetic but has the shape of data/air-pollution_cleaned.csv: every synthetic entity copies the years and
+# the value series of a real entity, scaled by a random factor and with some noise on every value.
+# Scale 1 has as many entities (and rows) as the real dataset, scale 10 ten times as many.
+#
+# Usage (from the project root):
+#   python benchmarks/microbench.py                                  # scales 0.1, 1 and 10
+#   python benchmarks/microbench.py --scales 1 --repeat 20
+#   python benchmarks/microbench.py --output results/microbench.json # write the results for benchmarks/report.py
+
+# argparse is used to provide the command line interface
+import argparse
+# contextlib and io are used to silence the progress output of load_data
+import contextlib
+import io
+# os, sys and tempfile are used to find the app and to create the databases of the benchmark
+import os
+import sys
+import tempfile
+# The time module is used to measure the durations
+import time
+# statistics is used to report the median duration
+import statistics
+
+# NumPy and pandas generate the synthetic datasets
+import numpy as np
+import pandas as pd
+
+# Project root and the directories of the app, the benchmark imports the modules like they are run without docker
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "src", "app")
+sys.path[:0] = [os.path.join(ROOT, "src"), APP_DIR, os.path.join(APP_DIR, "setup_database")]
+
+# The real dataset, the template of the synthetic ones
+CSV_PATH = os.path.join(ROOT, "data", "air-pollution_cleaned.csv")
+
+
+def synthetic_dataset(scale, seed=0):
+    # Generate round(230 * scale) entities from the real ones, in the CSV format load_data reads
+    template = pd.read_csv(CSV_PATH)
+    template.columns = template.columns.str.strip()
+    groups = [group for _, group in template.groupby("Entity")]
+    rng = np.random.default_rng(seed)
+
+    frames = []
+    for i in range(max(1, round(len(groups) * scale))):
+        frame = groups[i % len(groups)].copy()
+        # Copies of an entity get a number, the first one keeps its name
+        if i >= len(groups):
+            frame["Entity"] = frame["Entity"] + f" {i // len(groups)}"
+        values = frame.iloc[:, 3:].to_numpy()
+        frame.iloc[:, 3:] = values * np.exp(rng.normal(0, 0.5)) * np.exp(rng.normal(0, 0.05, values.shape))
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def measure(function, repeat):
+    # Call the function repeat times and return the fastest and the median duration in milliseconds
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {"repeat": repeat, "min_ms": round(min(durations) * 1000, 3), "median_ms": round(statistics.median(durations) * 1000, 3)}
+
+
+def run_scale(scale, repeat, directory):
+    # Run all microbenchmarks on a synthetic dataset of the given scale and return one result per benchmark
+    from sqlalchemy.orm import sessionmaker
+    from setup_database.database import create_db_engine
+    import columnar
+    import load_data
+    import main
+    import stats
+    import summary
+
+    dataset = synthetic_dataset(scale)
+    csv_path = os.path.join(directory, f"synthetic-{scale}.csv")
+    dataset.to_csv(csv_path, index=False)
+    entities = dataset["Entity"].nunique()
+    # Per-entity benchmarks use an entity with the full range of years
+    entity = dataset.groupby("Entity").size().idxmax()
+
+    engine = create_db_engine(f"sqlite:///{os.path.join(directory, f'synthetic-{scale}.db')}")
+    main.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    results = []
+
+    def add(name, timing, **extra):
+        result = {"name": name, "scale": scale, "rows": len(dataset), "entities": entities, **timing, **extra}
+        results.append(result)
+        print(f"{name:<32} scale {scale:<6} median {result['median_ms']:>10.3f} ms, min {result['min_ms']:>10.3f} ms")
+
+    # Ingest: the whole CSV file in one transaction, including the quantile sketches
+    def ingest():
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_data.load_data(csv_path, "replace", bind=engine)
+    timing = measure(ingest, 1)
+    add("load_data.ingest", timing, rows_per_s=round(len(dataset) / timing["median_ms"] * 1000))
+
+    with Session() as db:
+        summary.ensure_summary(db)
+
+        # Statistics engine: one entity and all entities, with the query and on prefetched values only
+        values = stats.fetch_values(db, entity)
+        names, starts, grouped_values = stats.fetch_grouped_values(db)
+        index = main.range_index.get(db, entity)
+        add("stats.get_entity_stats", measure(lambda: stats.get_entity_stats(db, entity), repeat))
+        add("stats.compute_stats", measure(lambda: stats.compute_stats(values), repeat))
+        add("stats.get_grouped_stats", measure(lambda: stats.get_grouped_stats(db), repeat))
+        add("stats.compute_grouped_stats", measure(lambda: stats.compute_grouped_stats(starts, grouped_values), repeat))
+        add("stats.rolling_stats", measure(lambda: stats.rolling_stats(index.years, index.values, 10), repeat))
+        add("summary.get_summary_stats", measure(lambda: summary.get_summary_stats(db, entity), repeat))
+        add("summary.get_sketch_quantiles", measure(lambda: summary.get_sketch_quantiles(db), repeat))
+
+        # Year-range index: building the index of an entity and answering a range from it
+        def cold_range():
+            main.range_index.clear()
+            main.range_index.stats(db, entity, 1900, 2000)
+        add("range_index.stats.cold", measure(cold_range, repeat))
+        add("range_index.stats.warm", measure(lambda: main.range_index.stats(db, entity, 1900, 2000), repeat))
+
+        # Columnar store: building it from the database, mapping its snapshot and answering from slices of it
+        store = columnar.ColumnarStore(os.path.join(directory, f"columns-{scale}.bin"))
+        add("columnar.build", measure(lambda: store.save(columnar.Columns(*columnar.fetch_columns(db), columnar.fingerprint(db))), repeat))
+        add("columnar.load_snapshot", measure(lambda: columnar.ColumnarStore(store.path).load(db), repeat))
+        add("columnar.stats", measure(lambda: store.stats(db, entity), repeat))
+        add("columnar.stats.range", measure(lambda: store.stats(db, entity, 1900, 2000), repeat))
+        add("columnar.grouped_stats", measure(lambda: store.grouped_stats(db), repeat))
+
+        # HTML rendering of the pages, without the response cache
+        add("render.main_page", measure(lambda: main.render_main_page(db), repeat))
+        add("render.all_stats", measure(lambda: main.render_all_stats(db, entity), repeat))
+        add("render.range_stats", measure(lambda: main.render_range_stats(db, entity, 1900, 2000), repeat))
+        main.range_index.clear()
+
+    engine.dispose()
+    return results
+
+
+def run_logging(repeat, directory, records=1000):
+    # Time logging a batch of records with the payload of a data point, written directly to the log file
+    # like before and through the queue of the app, where the caller only formats and enqueues the records
+    import logging
+    from logging_setup import file_handler, queue_logging
+
+    payload = "entity='Germany' year=2000 " + " ".join(f"{param}=123456.789" for param in
+                                                        ("nitrogen_oxide", "sulphur_dioxide", "carbon_monoxide", "organic_carbon", "nmvoc", "black_carbon", "ammonia"))
+    results = []
+
+    def log_records(logger):
+        for _ in range(records):
+            logger.info(f"Received data: {payload}")
+
+    # Direct writes with the former 2000 byte rotation, direct writes and queued writes with the rotation of the app
+    for name, max_bytes in (("logging.file.rotate_2kb", 2000), ("logging.file", None), ("logging.queued", None)):
+        logger = logging.getLogger(f"microbench.{name}")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = file_handler(os.path.join(directory, f"{name}.log"), **({"max_bytes": max_bytes} if max_bytes else {}))
+        if name == "logging.queued":
+            listener = queue_logging(logger, handler)
+            timing = measure(lambda: log_records(logger), repeat)
+            listener.stop()
+        else:
+            logger.addHandler(handler)
+            timing = measure(lambda: log_records(logger), repeat)
+        handler.close()
+        result = {"name": name, "scale": None, "records": records, **timing, "us_per_record": round(timing["median_ms"] * 1000 / records, 3)}
+        results.append(result)
+        print(f"{name:<32} {records} records  median {result['median_ms']:>10.3f} ms, {result['us_per_record']:.2f} us per record")
+    return results
+
+
+def main():
+    # Define the command line interface
+    parser = argparse.ArgumentParser(description="Microbenchmarks of statistics, rendering and ingest on synthetic data.")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.1, 1, 10], help="dataset sizes relative to the real dataset (default: 0.1 1 10)")
+    parser.add_argument("--repeat", type=int, default=10, help="calls per benchmark, the ingest runs once (default: 10)")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app creates its default engines on import, point them to an empty database instead of the real one
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'app.db')}"
+        results = [result for scale in args.scales for result in run_scale(scale, args.repeat, directory)]
+        results += run_logging(args.repeat, directory)
+
+    if args.output:
+        from report import write_results
+        write_results(args.output, "microbench", {"scales": args.scales, "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Machine-readable benchmark results: both benchmarks write their results as JSON together with the commit and the
+# machine they ran on, and two result files can be compared to find regressions between commits.
+#
+# Usage (from the project root):
+#   python benchmarks/report.py results/before.json results/after.json                  # compare two runs
+#   python benchmarks/report.py results/before.json results/after.json --threshold 1.2  # fail on regressions above 20%
+
+# argparse is used to provide the command line interface
+import argparse
+# json is used to read and write the result files
+import json
+# os, platform, subprocess and sys describe the run: commit, Python version and machine
+import os
+import platform
+import subprocess
+import sys
+# datetime is used to timestamp the run
+from datetime import datetime, timezone
+
+# Project root, the commit is read from its git repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metrics compared between runs, for the first ones lower values are better, for the others higher ones
+LOWER_IS_BETTER = ("median_ms", "p50", "p95", "p99")
+HIGHER_IS_BETTER = ("throughput", "rows_per_s")
+
+
+def git(*args):
+    # Output of a git command in the project root, None outside of a git repository
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata():
+    # Description of the run, so results of different commits and machines can be told apart
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(path, benchmark, parameters, results):
+    # Write the results of a benchmark run with its parameters and the description of the run
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump({"benchmark": benchmark, "metadata": metadata(), "parameters": parameters, "results": results}, file, indent=2)
+    print(f"Results written to {path}")
+
+
+def flatten(results):
+    # Map every measured case to its metrics: microbenchmarks by name and scale, load tests by concurrency and path
+    cases = {}
+    for result in results:
+        if "concurrency" in result:
+            name = f"concurrency {result['concurrency']}"
+            cases[name] = result
+            for path, stats in result.get("paths", {}).items():
+                cases[f"{name} {path}"] = stats
+        else:
+            cases[f"{result['name']} @ {result['scale']}"] = result
+    return cases
+
+
+def compare(before, after, threshold=1.1):
+    # Print the ratio after/before of every metric and return the cases which got slower by more than the threshold
+    old, new = flatten(before["results"]), flatten(after["results"])
+    regressions = []
+    for case in [case for case in new if case in old]:
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if not old[case].get(metric) or metric not in new[case]:
+                continue
+            ratio = new[case][metric] / old[case][metric]
+            slower = ratio if metric in LOWER_IS_BETTER else 1 / ratio if ratio else float("inf")
+            flag = "  REGRESSION" if slower > threshold else ""
+            print(f"{case:<60} {metric:<10} {old[case][metric]:>12.3f} -> {new[case][metric]:>12.3f}  x{ratio:.2f}{flag}")
+            if flag:
+                regressions.append((case, metric, ratio))
+    return regressions
+
+
+def main():
+    # Define the command line interface
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before", help="result file of the baseline run")
+    parser.add_argument("after", help="result file of the new run")
+    parser.add_argument("--threshold", type=float, default=1.1, help="slowdown counted as regression (default: 1.1, i.e. 10%%)")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    print(f"{before['metadata']['commit']} -> {after['metadata']['commit']}")
+    regressions = compare(before, after, args.threshold)
+    print(f"{len(regressions)} regressions")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
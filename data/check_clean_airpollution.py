@@ -1,50 +1,226 @@
+# Cleaning pipeline of the raw air pollution CSV files (https://www.kaggle.com/datasets/rejeph/air-pollution):
+# the files are read in chunks (several files in parallel processes), missing country codes are filled from one
+# mapping, types and ranges are validated, and the cleaned rows are written straight into the database, into a
+# Parquet file or into a CSV file like data/air-pollution_cleaned.csv.
+#
+# Usage (from the project root):
+#   python data/check_clean_airpollution.py                                          # air-pollution.csv -> air-pollution_cleaned.csv
+#   python data/check_clean_airpollution.py raw.csv --output data/cleaned.parquet    # typed Parquet file, load_data.py reads it
+#   python data/check_clean_airpollution.py raw-*.csv --database --workers 4         # several files straight into the database
 import os
+import sys
+
+# argparse is used to provide the command line interface
+import argparse
+# collections.Counter counts the rows read, dropped and changed, deque holds the files being cleaned in parallel
+from collections import Counter, deque
+# concurrent.futures cleans several input files in parallel processes
+from concurrent.futures import ProcessPoolExecutor
+# datetime gives the current year, the latest valid year
+from datetime import date
+# islice takes the first files to clean in parallel
+from itertools import islice
+# pickle writes the cleaned chunks of a worker into a part file, tempfile creates the part files and their directory
+import pickle
+import tempfile
+
+import numpy as np
 import pandas as pd
 
+# Directory of this script, the default input and output files are here
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The column names are shared with load_data.py, which loads the cleaned data into the database
+sys.path[:0] = [os.path.join(DATA_DIR, "..", "src", "app", "setup_database"), os.path.join(DATA_DIR, "..", "src", "app")]
+from load_data import COLUMNS, PARAMETERS
+
+# Default input and output files
+RAW_PATH = os.path.join(DATA_DIR, "air-pollution.csv")
+CLEANED_PATH = os.path.join(DATA_DIR, "air-pollution_cleaned.csv")
+
+# Codes of the entities which have none in the raw data (regions and income groups), filled in with one lookup
+MISSING_CODES = {
+    "Africa": "AFRICA",
+    "Asia": "ASIA",
+    "World": "WORLD",
+    "Europe": "EUROPE",
+    "High-income countries": "HIC",
+    "Low-income countries": "LIC",
+    "Lower-middle-income countries": "LMIC",
+    "North America": "NAM",
+    "Oceania": "OCEANINA",
+    "South America": "SAM",
+    "Timor": "TIM",
+    "Upper-middle-income countries": "UMIC",
+}
+
+# Range of valid years, the dataset starts in 1750
+MIN_YEAR = 1750
+MAX_YEAR = date.today().year
+
+
+def clean_chunk(chunk, report):
+    # Clean one chunk of a raw file and count what was changed or dropped in report.
+    # Returns a frame with the column names of the table: entity and code as strings, year as integer and the
+    # parameters as floats, invalid or missing values are NaN.
+    chunk.columns = chunk.columns.str.strip()
+    missing = [column for column in COLUMNS if column not in chunk.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    # Only the known columns are kept, this also removes the empty last column of the raw data
+    chunk = chunk[list(COLUMNS)].rename(columns=COLUMNS)
+    report["rows_read"] += len(chunk)
+
+    entity = chunk["entity"].astype("string").str.strip()
+    code = chunk["code"].astype("string").str.strip().replace("", pd.NA)
+
+    # Fill the codes of the entities in MISSING_CODES with one lookup for the whole chunk
+    mapped = entity.map(MISSING_CODES).astype("string")
+    report["codes_filled"] += int((mapped.notna() & code.isna()).sum())
+    code = mapped.fillna(code)
+
+    # Years must be whole numbers in the valid range
+    year = pd.to_numeric(chunk["year"], errors="coerce")
+    valid_year = year.between(MIN_YEAR, MAX_YEAR) & (year % 1 == 0)
+
+    # Parameter values must be non-negative finite numbers, other values (e.g. text) become missing
+    values = chunk[PARAMETERS].apply(pd.to_numeric, errors="coerce").astype(float)
+    invalid = (values.isna() & chunk[PARAMETERS].notna()) | ~np.isfinite(values.fillna(0.0)) | (values < 0)
+    report["invalid_values"] += int(invalid.to_numpy().sum())
+    values = values.mask(invalid)
+
+    # Drop rows without entity, code or valid year
+    has_entity = entity.notna() & (entity != "")
+    report["dropped_no_entity"] += int((~has_entity).sum())
+    report["dropped_invalid_year"] += int((has_entity & ~valid_year).sum())
+    report["dropped_no_code"] += int((has_entity & valid_year & code.isna()).sum())
+    keep = (has_entity & valid_year & code.notna()).to_numpy()
 
-# Set the working directory to the 'data/' directory within the FastAPI project
-os.chdir(os.path.dirname(__file__))
+    cleaned = pd.DataFrame({"entity": entity[keep], "code": code[keep], "year": year[keep].astype("int64")})
+    return pd.concat([cleaned, values[keep]], axis=1).reset_index(drop=True)
 
-def clean_airpollution():
-    # Reading data
-    air = pd.read_csv("air-pollution.csv")
-    print(air.head())
 
-    # Removing empty column
-    air = air.iloc[:, :-1]
+def clean_chunks(path, chunksize=50000, report=None):
+    # Read a raw file in chunks and yield the cleaned chunks, memory stays bounded by the chunk size
+    report = report if report is not None else Counter()
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        yield clean_chunk(chunk, report)
 
-    # Summary of the data
-    print(air.describe())
 
-    # Check for missing data
-    print(air.isna().sum())
+def clean_file(path, chunksize=50000, directory=None):
+    # Clean a raw file in a worker process. The cleaned chunks are written one by one into a part file in directory,
+    # only the name of the part file and the report of the file are sent back, no process holds a whole file.
+    report = Counter()
+    handle, part = tempfile.mkstemp(suffix=".part", dir=directory)
+    with os.fdopen(handle, "wb") as file:
+        for frame in clean_chunks(path, chunksize, report):
+            pickle.dump(frame, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return part, report
 
-    # check which entries do not have a code
-    air_codes_na = air[air['Code'].isna()]
-    print(air_codes_na.groupby('Entity').size().reset_index(name='count'))
 
-    # Adding missing codes to the air dataframe
-    air.loc[air['Entity'] == "Africa", 'Code'] = "AFRICA"
-    air.loc[air['Entity'] == "Asia", 'Code'] = "ASIA"
-    air.loc[air['Entity'] == "World", 'Code'] = "WORLD"
-    air.loc[air['Entity'] == "Europe", 'Code'] = "EUROPE"
-    air.loc[air['Entity'] == "High-income countries", 'Code'] = "HIC"
-    air.loc[air['Entity'] == "Low-income countries", 'Code'] = "LIC"
-    air.loc[air['Entity'] == "Lower-middle-income countries", 'Code'] = "LMIC"
-    air.loc[air['Entity'] == "North America", 'Code'] = "NAM"
-    air.loc[air['Entity'] == "Oceania", 'Code'] = "OCEANINA"
-    air.loc[air['Entity'] == "South America", 'Code'] = "SAM"
-    air.loc[air['Entity'] == "Timor", 'Code'] = "TIM"
-    air.loc[air['Entity'] == "Upper-middle-income countries", 'Code'] = "UMIC"
+def read_part(part):
+    # Yield the cleaned chunks of a part file written by clean_file, the file is removed afterwards
+    try:
+        with open(part, "rb") as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+    finally:
+        os.remove(part)
 
-    # Remove rows where Code is NaN
-    air = air.dropna(subset=['Code'])
 
-    # Writing files
-    air.to_csv("air-pollution_cleaned.csv", index=False, quotechar='"')
+def drop_duplicates(frame, seen, report):
+    # Drop the rows of (entity, year) pairs already seen in this frame, in earlier chunks or in earlier files,
+    # only the first one is kept. seen holds the pairs of all rows kept so far.
+    keys = pd.MultiIndex.from_arrays([frame["entity"], frame["year"]])
+    duplicate = keys.duplicated() | keys.isin(seen)
+    report["duplicates"] += int(duplicate.sum())
+    seen.update(keys[~duplicate])
+    return frame[~duplicate]
+
+
+def clean(paths, chunksize=50000, workers=1, report=None):
+    # Yield the cleaned chunks of all raw files in order. With several files and workers, the files are cleaned
+    # in parallel processes, at most `workers` files at a time are cleaned or waiting to be consumed. Their chunks
+    # are passed on through part files, so memory stays bounded by the chunk size here as well.
+    report = report if report is not None else Counter()
+    seen = set()
+
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            for frame in clean_chunks(path, chunksize, report):
+                yield drop_duplicates(frame, seen, report)
+        return
+
+    with tempfile.TemporaryDirectory() as directory, ProcessPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(paths)
+        pending = deque(executor.submit(clean_file, path, chunksize, directory) for path in islice(remaining, workers))
+        while pending:
+            part, file_report = pending.popleft().result()
+            path = next(remaining, None)
+            if path is not None:
+                pending.append(executor.submit(clean_file, path, chunksize, directory))
+            report.update(file_report)
+            for frame in read_part(part):
+                yield drop_duplicates(frame, seen, report)
+
+
+def write_parquet(frames, path):
+    # Write the cleaned chunks into one typed Parquet file, one row group per chunk.
+    # pyarrow is imported on first use, it is only needed for Parquet output.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("entity", pa.string()), ("code", pa.string()), ("year", pa.int64())]
+                       + [(param, pa.float64()) for param in PARAMETERS])
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for frame in frames:
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            rows += len(frame)
+    return rows
+
+
+def write_csv(frames, path):
+    # Write the cleaned chunks into a CSV file with the column names of the raw data, like air-pollution_cleaned.csv
+    names = {column: name for name, column in COLUMNS.items()}
+    rows = 0
+    for i, frame in enumerate(frames):
+        frame.rename(columns=names).to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False, quotechar='"')
+        rows += len(frame)
+    return rows
+
+
+def clean_airpollution(paths=(RAW_PATH,), output=CLEANED_PATH, database=False, mode="replace", chunksize=50000, workers=1):
+    # Clean the raw files and write the result into the database, a Parquet file or a CSV file
+    report = Counter()
+    frames = clean(list(paths), chunksize, workers, report)
+    if database:
+        from load_data import load_frames
+        rows = load_frames(frames, mode)
+    elif output.endswith(".parquet"):
+        rows = write_parquet(frames, output)
+    else:
+        rows = write_csv(frames, output)
+
+    # Report what was changed or dropped
+    for name in ("rows_read", "codes_filled", "invalid_values", "dropped_no_entity", "dropped_invalid_year", "dropped_no_code", "duplicates"):
+        print(f"{name}: {report[name]}")
+    print(f"cleaning done, {rows} rows written to {'the database' if database else output}")
+    return report
 
-    # Return finish message
-    print("cleaning done")
 
 if __name__ == "__main__":
-    clean_airpollution()
\ No newline at end of file
+    # Define the command line interface
+    parser = argparse.ArgumentParser(description="Clean raw air pollution CSV files.")
+    parser.add_argument("paths", nargs="*", default=[RAW_PATH], help="raw CSV files (default: data/air-pollution.csv)")
+    parser.add_argument("--output", default=CLEANED_PATH, help="cleaned .csv or .parquet file (default: data/air-pollution_cleaned.csv)")
+    parser.add_argument("--database", action="store_true", help="load the cleaned data into the database (DATABASE_URL) instead of a file")
+    parser.add_argument("--mode", choices=["replace", "append"], default="replace", help="with --database: replace the existing data or append to it")
+    parser.add_argument("--chunksize", type=int, default=50000, help="rows read at once (default: 50000)")
+    parser.add_argument("--workers", type=int, default=1, help="processes cleaning several files in parallel (default: 1)")
+    args = parser.parse_args()
+
+    clean_airpollution(args.paths, args.output, args.database, args.mode, args.chunksize, args.workers)
@@ -0,0 +1,105 @@
+# The hashlib module is used to compute the ETag of a response from its content.
+import hashlib
+
+# The threading module is used to protect the cache against concurrent requests.
+import threading
+
+# The time module is used for the expiry of the entries.
+import time
+
+# OrderedDict keeps the entries in order of their last use, for the LRU eviction.
+from collections import OrderedDict
+
+# The email.utils module formats and parses the HTTP dates of Last-Modified and If-Modified-Since.
+from email.utils import formatdate, parsedate_to_datetime
+
+
+class CacheEntry:
+    # Rendered content (text or bytes) of a response together with its validators
+    def __init__(self, content, last_modified: float, expires: float):
+        self.content = content
+        self.etag = '"' + hashlib.sha1(content if isinstance(content, bytes) else content.encode("utf-8")).hexdigest() + '"'
+        self.last_modified = last_modified
+        self.expires = expires
+
+    def headers(self):
+        # Validators sent with the response, so clients and proxies can revalidate instead of refetching
+        return {"ETag": self.etag, "Last-Modified": formatdate(self.last_modified, usegmt=True)}
+
+    def not_modified(self, if_none_match: str = None, if_modified_since: str = None):
+        # Check the conditional request headers, If-None-Match takes precedence over If-Modified-Since
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or self.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if if_modified_since is not None:
+            try:
+                return int(self.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class ResponseCache:
+    # Bounded in-process cache of rendered responses with LRU eviction and a time to live.
+    # Keys start with the entity the response belongs to (None for pages listing all entities, like the dropdown),
+    # so writes can invalidate all entries of the changed entity.
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._modified = {}
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # Return the entry of the key and a token identifying the state of its entity, to be passed to set()
+        with self._lock:
+            token = (self._epoch, self._generations.get(key[0], 0))
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, token
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None, token
+
+    def set(self, key, content, token):
+        # Store rendered content, unless a write invalidated the entity while the content was rendered
+        with self._lock:
+            entry = CacheEntry(content, self._modified.get(key[0], self._started), time.monotonic() + self.ttl)
+            if (self._epoch, self._generations.get(key[0], 0)) != token or self.maxsize <= 0:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            # Evict the least recently used entries
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return entry
+
+    def invalidate(self, entity: str):
+        # Drop the entries of the entity and of the pages listing all entities after the data of the entity changed
+        with self._lock:
+            now = time.time()
+            for owner in (entity, None):
+                self._generations[owner] = self._generations.get(owner, 0) + 1
+                self._modified[owner] = now
+            for key in [key for key in self._entries if key[0] in (entity, None)]:
+                del self._entries[key]
+
+    def __len__(self):
+        # Number of cached entries, including expired ones which were not requested again yet
+        return len(self._entries)
+
+    def clear(self):
+        # Drop all entries, e.g. after the whole data changed
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._started = time.time()
+            self._modified.clear()
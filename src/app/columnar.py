@@ -0,0 +1,229 @@
+# OS module is used to handle the snapshot file and to read the environment variable telling us whether we run within docker.
+import os
+
+# Check if app is running within docker or directly, some imports need to be adressed differently
+SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
+
+# The json module is used to store the entity names and offsets in the header of the snapshot.
+import json
+
+# The threading module is used to protect the store against concurrent refreshes.
+import threading
+
+# bisect finds the position of a new entity in the sorted entity names.
+import bisect
+
+# NumPy stores the columns and computes the statistics of their slices.
+import numpy as np
+
+# SQLAlchemy core is used to build the select statements fetching the data points.
+from sqlalchemy import select, func
+
+# SQLAlchemy ORM session is used as type hint for the database session.
+from sqlalchemy.orm import Session
+
+# Importing the database model and the statistics engine.
+if SECRET_KEY:
+    from app.setup_database.models import AirPollutionData, DataVersion
+    from app.stats import PARAMETERS, compute_stats, compute_grouped_stats, grouped_results
+else:
+    from setup_database.models import AirPollutionData, DataVersion #when executing the file directly, without docker
+    from stats import PARAMETERS, compute_stats, compute_grouped_stats, grouped_results
+
+# First line of a snapshot file, followed by the length of the JSON header (8 bytes), the header and the columns
+SNAPSHOT_MAGIC = b"AIRPOLLUTION-COLUMNS-1\n"
+
+# The columns of a snapshot start at a multiple of this many bytes
+SNAPSHOT_ALIGNMENT = 64
+
+
+class Columns:
+    # The whole dataset as columns sorted by (entity, year): the years, one row per parameter with its values
+    # (NaN for missing values) and the offsets of the entities, the rows of entity i are offsets[i]:offsets[i + 1].
+    # Columns are never changed after they were created, a refresh creates new ones.
+    def __init__(self, entities, offsets, years, values, fingerprint):
+        self.entities = list(entities)
+        self.offsets = offsets
+        self.years = years
+        self.values = values
+        self.fingerprint = fingerprint
+        self.positions = {entity: i for i, entity in enumerate(self.entities)}
+
+    def slice(self, entity: str):
+        # Years and (rows x parameters) values of an entity, views of the columns without copying
+        i = self.positions.get(entity)
+        if i is None:
+            return self.years[:0], self.values[:, :0].T
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.years[start:end], self.values[:, start:end].T
+
+
+def fetch_columns(db: Session, entities=None):
+    # Fetch the data points (of some entities, all if None) with one query ordered by entity and year, as columns
+    query = select(AirPollutionData.entity, AirPollutionData.year, *[getattr(AirPollutionData, param) for param in PARAMETERS])
+    if entities is not None:
+        query = query.where(AirPollutionData.entity.in_(list(entities)))
+    rows = db.execute(query.order_by(AirPollutionData.entity, AirPollutionData.year)).fetchall()
+
+    names = np.array([row[0] for row in rows], dtype=object)
+    years = np.array([row[1] for row in rows], dtype=np.int64)
+    values = np.array([row[2:] for row in rows], dtype=float).reshape(len(rows), len(PARAMETERS)).T.copy()
+
+    # Every entity starts where the entity name changes
+    starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+    return list(names[starts]), np.r_[starts, len(rows)].astype(np.int64), years, values
+
+
+def fingerprint(db: Session):
+    # Data version, number of data points and highest id, tells whether a snapshot still matches the database after
+    # a restart or a write of another process. Every write bumps the version, also updates which keep count and id.
+    count, highest = db.execute(select(func.count(AirPollutionData.id), func.max(AirPollutionData.id))).one()
+    return [db.execute(select(DataVersion.version)).scalar(), count, highest]
+
+
+class ColumnarStore:
+    # In-memory columnar copy of the data points which answers the statistics from slices of its columns, without
+    # a query. It is loaded from the snapshot file at `path`, which is memory-mapped, or built from the database with
+    # one query (and saved as snapshot) if the snapshot is missing or does not match the database. Writes mark their
+    # entity as changed; the next read fetches the rows of the changed entities and splices them into new columns.
+    def __init__(self, path: str):
+        self.path = path
+        self._columns = None
+        self._changed = set()
+        self._reload = False
+        self._lock = threading.Lock()
+
+    def columns(self, db: Session) -> Columns:
+        # Current columns, loaded or refreshed first if needed
+        if self._columns is None or self._changed or self._reload:
+            with self._lock:
+                if self._columns is None or self._reload:
+                    self._changed.clear()
+                    self._reload = False
+                    self._columns = self.load(db)
+                elif self._changed:
+                    changed, self._changed = self._changed, set()
+                    self._columns = self.splice(db, self._columns, changed)
+        return self._columns
+
+    def changed(self, entity: str):
+        # Mark the data of an entity as changed, it is fetched again by the next read
+        with self._lock:
+            self._changed.add(entity)
+
+    def reload(self):
+        # Fetch all data again with the next read, e.g. after another process changed the database
+        with self._lock:
+            self._reload = True
+
+    def load(self, db: Session) -> Columns:
+        # Map the snapshot if it matches the database, otherwise build the columns and write the snapshot. The
+        # fingerprint is taken before the data is fetched, a write in between makes the snapshot outdated, not wrong.
+        current = fingerprint(db)
+        columns = self.read_snapshot()
+        if columns is None or columns.fingerprint != current:
+            columns = Columns(*fetch_columns(db), current)
+            self.save(columns)
+        return columns
+
+    def splice(self, db: Session, columns: Columns, entities) -> Columns:
+        # New columns with the rows of the given entities fetched again, entities without rows are removed.
+        # They have no fingerprint: other processes may have changed other entities meanwhile.
+        names, offsets, years, values = fetch_columns(db, entities)
+        fetched = {name: (offsets[i], offsets[i + 1]) for i, name in enumerate(names)}
+        kept = [entity for entity in columns.entities if entity not in entities]
+        merged = sorted(kept + names)
+
+        # Copy the slices of all entities in their new order, unchanged ones from the old columns
+        pieces = []
+        for entity in merged:
+            if entity in fetched:
+                start, end = fetched[entity]
+                pieces.append((years[start:end], values[:, start:end]))
+            else:
+                i = columns.positions[entity]
+                start, end = columns.offsets[i], columns.offsets[i + 1]
+                pieces.append((columns.years[start:end], columns.values[:, start:end]))
+        sizes = [len(piece[0]) for piece in pieces]
+        return Columns(
+            merged,
+            np.r_[0, np.cumsum(sizes)].astype(np.int64),
+            np.concatenate([piece[0] for piece in pieces]) if pieces else np.empty(0, dtype=np.int64),
+            np.concatenate([piece[1] for piece in pieces], axis=1) if pieces else np.empty((len(PARAMETERS), 0)),
+            None
+        )
+
+    def save(self, columns: Columns):
+        # Write the snapshot: magic line, header length, JSON header (entities, offsets, fingerprint), padding,
+        # the years and the value columns. It is written to a temporary file first and replaces the old one at once.
+        header = json.dumps({"entities": columns.entities, "offsets": columns.offsets.tolist(),
+                             "parameters": PARAMETERS, "fingerprint": columns.fingerprint}).encode("utf-8")
+        used = len(SNAPSHOT_MAGIC) + 8 + len(header)
+        temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(SNAPSHOT_MAGIC)
+            file.write(len(header).to_bytes(8, "little"))
+            file.write(header)
+            file.write(b"\0" * (-used % SNAPSHOT_ALIGNMENT))
+            file.write(np.ascontiguousarray(columns.years, dtype="<i8").tobytes())
+            file.write(np.ascontiguousarray(columns.values, dtype="<f8").tobytes())
+        os.replace(temporary, self.path)
+
+    def read_snapshot(self):
+        # Map the columns of the snapshot read-only, None if there is no valid snapshot
+        try:
+            with open(self.path, "rb") as file:
+                if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                    return None
+                length = int.from_bytes(file.read(8), "little")
+                header = json.loads(file.read(length))
+        except (OSError, ValueError):
+            return None
+        if header.get("parameters") != PARAMETERS:
+            return None
+
+        rows = header["offsets"][-1]
+        start = len(SNAPSHOT_MAGIC) + 8 + length
+        start += -start % SNAPSHOT_ALIGNMENT
+        if rows:
+            years = np.memmap(self.path, dtype="<i8", mode="r", offset=start, shape=(rows,))
+            values = np.memmap(self.path, dtype="<f8", mode="r", offset=start + 8 * rows, shape=(len(PARAMETERS), rows))
+        else:
+            years, values = np.empty(0, dtype=np.int64), np.empty((len(PARAMETERS), 0))
+        return Columns(header["entities"], np.array(header["offsets"], dtype=np.int64), years, values, header["fingerprint"])
+
+    def entities(self, db: Session):
+        # Names of all entities with data, sorted
+        return self.columns(db).entities
+
+    def slice(self, db: Session, entity: str):
+        # Years and (rows x parameters) values of an entity
+        return self.columns(db).slice(entity)
+
+    def stats(self, db: Session, entity: str, start_year: int = None, end_year: int = None):
+        # Number of rows in the year range (including both years) and the statistics of all parameters
+        years, values = self.slice(db, entity)
+        start = 0 if start_year is None else np.searchsorted(years, start_year, side="left")
+        end = len(years) if end_year is None else np.searchsorted(years, end_year, side="right")
+        rows = max(int(end - start), 0)
+        return rows, compute_stats(values[start:start + rows])
+
+    def grouped_stats(self, db: Session, entities=None, start_year: int = None, end_year: int = None):
+        # Statistics of many entities (all entities if None) as {entity: stats}, entities without data in the
+        # year range are left out
+        columns = self.columns(db)
+        owners = np.repeat(np.arange(len(columns.entities)), np.diff(columns.offsets))
+        selected = np.ones(len(columns.years), dtype=bool)
+        if entities is not None:
+            wanted = [columns.positions[entity] for entity in set(entities) if entity in columns.positions]
+            selected &= np.isin(owners, wanted)
+        if start_year is not None:
+            selected &= columns.years >= start_year
+        if end_year is not None:
+            selected &= columns.years <= end_year
+
+        # The selected rows are still ordered by entity, every group starts where the entity changes
+        owners = owners[selected]
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]]) if len(owners) else np.empty(0, dtype=np.int64)
+        names = [columns.entities[owner] for owner in owners[starts]]
+        return grouped_results(names, *compute_grouped_stats(starts, columns.values[:, selected].T))
@@ -0,0 +1,107 @@
+# OS module is used to read the environment variable telling us whether we run within docker.
+import os
+
+# Check if app is running within docker or directly, some imports need to be adressed differently
+SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
+
+# The csv and io modules are used to write the CSV lines of a chunk of rows.
+import csv
+import io
+
+# The json module is used to write the NDJSON lines.
+import json
+
+# The math module is used to write NaN values as empty fields or null.
+import math
+
+# The zlib module is used to gzip the exported data on the fly.
+import zlib
+
+# SQLAlchemy core is used to build the select statement of the export.
+from sqlalchemy import select
+
+# SQLAlchemy ORM session is used to read the rows in its own session, independent of the request.
+from sqlalchemy.orm import Session
+
+# Importing the database model and the list of parameters.
+if SECRET_KEY:
+    from app.setup_database.models import AirPollutionData
+    from app.stats import PARAMETERS
+else:
+    from setup_database.models import AirPollutionData #when executing the file directly, without docker
+    from stats import PARAMETERS
+
+# Exported columns, in the order of the cleaned CSV file
+COLUMNS = ["entity", "code", "year", *PARAMETERS]
+
+# Media types of the export formats
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Number of rows fetched from the database cursor and written per chunk
+CHUNK_SIZE = 5000
+
+
+def export_query(entities=None, codes=None, start_year: int = None, end_year: int = None):
+    # Select the exported columns, optionally filtered by entities, codes and a year range (including both years).
+    # Ordered by entity and year, which the composite (entity, year) index provides without sorting.
+    query = select(*[getattr(AirPollutionData, column) for column in COLUMNS])
+    if entities:
+        query = query.where(AirPollutionData.entity.in_(entities))
+    if codes:
+        query = query.where(AirPollutionData.code.in_(codes))
+    if start_year is not None:
+        query = query.where(AirPollutionData.year >= start_year)
+    if end_year is not None:
+        query = query.where(AirPollutionData.year <= end_year)
+    return query.order_by(AirPollutionData.entity, AirPollutionData.year)
+
+
+def iter_chunks(bind, query, chunk_size: int = CHUNK_SIZE):
+    # Yield the rows of the query in chunks, read from the database cursor as they are needed, so only one chunk is in memory.
+    # The rows are read in a session of their own, the session of the request is closed before the response is streamed.
+    with Session(bind) as session:
+        result = session.execute(query.execution_options(yield_per=chunk_size))
+        for rows in result.partitions():
+            yield rows
+
+
+def _clean(value):
+    # Missing values are written as empty CSV fields and as null in NDJSON
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def csv_lines(chunks, header: bool = True):
+    # Write every chunk of rows as a block of CSV lines, the first block starts with the header
+    if header:
+        yield ",".join(COLUMNS) + "\r\n"
+    for rows in chunks:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([[_clean(value) for value in row] for row in rows])
+        yield buffer.getvalue()
+
+
+def ndjson_lines(chunks):
+    # Write every chunk of rows as a block of JSON lines, one object per row
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, [_clean(value) for value in row])), separators=(",", ":")) + "\n" for row in rows
+        )
+
+
+def gzip_blocks(blocks, level: int = 6):
+    # Compress the text blocks into one gzip stream while they are produced
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    # Check whether the client accepts gzip encoded responses (and did not disable it with q=0)
+    for token in (accept_encoding or "").split(","):
+        coding, _, params = token.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
@@ -0,0 +1,85 @@
+# The io module is used to collect the bytes of the Arrow and Parquet outputs in memory.
+import io
+
+# The json module is used to serialize the statistics as compact JSON.
+import json
+
+# The math module is used to find the undefined (NaN) values of the arrays.
+import math
+
+# OS module is used to read the environment variable telling us whether we run within docker.
+import os
+
+# Check if app is running within docker or directly, some imports need to be adressed differently
+SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
+
+# Importing the list of parameters the statistics are calculated for.
+if SECRET_KEY:
+    from app.stats import PARAMETERS
+else:
+    from stats import PARAMETERS #when executing the file directly, without docker
+
+# Names of the statistics calculated per parameter.
+STATISTICS = ["mean", "median", "stddev"]
+
+# Media types of the output formats of the stats API. Arrow IPC and Parquet need the optional pyarrow package.
+MEDIA_TYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def round_value(value, digits: int = None):
+    # Round a value to the given number of significant digits, None keeps the full precision
+    return value if value is None or digits is None else float(f"{value:.{digits}g}")
+
+
+def round_stats(stats, digits: int = None):
+    # Round the statistics of one entity to the given number of significant digits
+    if stats is None or digits is None:
+        return stats
+    return {param: {name: round_value(value, digits) for name, value in values.items()} for param, values in stats.items()}
+
+
+def array_values(column, digits: int = None):
+    # Convert a NumPy column into a JSON array, NaN becomes null
+    return [None if math.isnan(value) else round_value(value, digits) for value in column.tolist()]
+
+
+def to_json(content) -> bytes:
+    # Serialize without whitespace, missing statistics are null
+    return json.dumps(content, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+
+def stats_table(results, statistics=STATISTICS):
+    # Arrow table with one row per entity and parameter and one column per statistic.
+    # pyarrow is imported on first use, so the app runs without it as long as only JSON and HTML are requested.
+    import pyarrow as pa
+
+    rows = [(entity, param, stats[param] if stats else {}) for entity, stats in results.items() for param in PARAMETERS]
+    return pa.table({
+        "entity": pa.array([entity for entity, _, _ in rows], type=pa.string()),
+        "parameter": pa.array([param for _, param, _ in rows], type=pa.string()),
+        **{name: pa.array([values.get(name) for _, _, values in rows], type=pa.float64()) for name in statistics},
+    })
+
+
+def to_arrow(results, statistics=STATISTICS) -> bytes:
+    # Serialize the statistics of many entities as Arrow IPC stream
+    import pyarrow as pa
+
+    table = stats_table(results, statistics)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def to_parquet(results, statistics=STATISTICS) -> bytes:
+    # Serialize the statistics of many entities as Parquet file
+    import pyarrow.parquet as pq
+
+    sink = io.BytesIO()
+    pq.write_table(stats_table(results, statistics), sink)
+    return sink.getvalue()
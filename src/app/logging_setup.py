@@ -0,0 +1,52 @@
+# The logging module and its handlers: records are put into a queue by the request threads and written to the
+# rotating log file by a background listener thread, so a request never waits for the disk or for a rotation.
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# OS module is used to read the configuration from environment variables.
+import os
+
+# The queue module provides the unbounded queue between the request threads and the listener thread.
+import queue
+
+# The random module decides which payloads are logged.
+import random
+
+# Size of a log file before it is rotated and number of rotated files kept, 10 MiB and 5 files by default
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+
+# Share of the data points whose full payload is logged by the write endpoints, from 0 (none) to 1 (all)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+
+# Format of the log lines
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def file_handler(log_file: str, max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT):
+    # Handler writing the formatted records to a log file, rotated when it reaches max_bytes.
+    # The file is opened with the first record, not when the handler is created.
+    handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+
+def queue_logging(logger: logging.Logger, *handlers):
+    # Attach a queue handler to the logger and start a listener thread passing the records to the handlers.
+    # Logging a record only formats its message and puts it into the queue; the listener has to be stopped
+    # at exit, which writes the records still in the queue.
+    records = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(records))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class PayloadSampler:
+    # Decides for every data point whether its full payload is logged, for the given share of the data points
+    def __init__(self, rate: float = LOG_PAYLOAD_SAMPLE_RATE, rng: random.Random = None):
+        self.rate = rate
+        self._rng = rng or random.Random()
+
+    def __call__(self) -> bool:
+        return self.rate >= 1 or (self.rate > 0 and self._rng.random() < self.rate)
@@ -5,91 +5,227 @@ import os
 SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
 
 # FastAPI is used to create the web application and handle HTTP requests.
-from fastapi import FastAPI, Form, Depends, HTTPException
+from fastapi import FastAPI, Form, Depends, HTTPException, Request, Query
 
-# HTMLResponse and RedirectResponse are used to return HTML content and handle redirects.
-from fastapi.responses import HTMLResponse, RedirectResponse
+# HTMLResponse and RedirectResponse are used to return HTML content and handle redirects, StreamingResponse to stream exports.
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
 
 # SQLAlchemy ORM is used to interact with the database in an object-oriented way.
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 
-# SQLAlchemy core is used to create the database engine and perform SQL queries.
-from sqlalchemy import create_engine, select, func, text
+# SQLAlchemy core is used to perform SQL queries.
+from sqlalchemy import select, and_, or_
+
+# IntegrityError is raised when a write violates the unique (entity, year) index.
+from sqlalchemy.exc import IntegrityError
+
+# The Engine class is instrumented to time the SQL queries of all engines.
+from sqlalchemy.engine import Engine
 
 # Importing the database models and session configuration.
 if SECRET_KEY:
-    from app.setup_database.models import AirPollutionData, SessionLocal, Base
+    from app.setup_database.models import AirPollutionData, Base
+    from app.setup_database.database import engine, SessionLocal, ReadSessionLocal
+    from app.setup_database.schema import missing_tables
+else:
+    from setup_database.models import AirPollutionData, Base #when executing the file directly, without docker
+    from setup_database.database import engine, SessionLocal, ReadSessionLocal
+    from setup_database.schema import missing_tables
+
+# Importing the list of parameters, the grouped statistics of many entities and the rolling statistics.
+if SECRET_KEY:
+    from app.stats import PARAMETERS, get_grouped_stats, sort_stats, rolling_stats
+else:
+    from stats import PARAMETERS, get_grouped_stats, sort_stats, rolling_stats #when executing the file directly, without docker
+
+# Importing the functions maintaining the precomputed per-entity statistics.
+if SECRET_KEY:
+    from app.summary import row_values, add_values, remove_values, update_summary, get_summary_stats, get_sketch_quantiles, ensure_summary
+else:
+    from summary import row_values, add_values, remove_values, update_summary, get_summary_stats, get_sketch_quantiles, ensure_summary #when executing the file directly, without docker
+
+# Importing the names of the approximate quantiles and the rank error bound of their sketches.
+if SECRET_KEY:
+    from app.sketch import QUANTILES, RANK_ERROR
+else:
+    from sketch import QUANTILES, RANK_ERROR #when executing the file directly, without docker
+
+# Importing the in-memory index answering year-range statistics from cumulative sums.
+if SECRET_KEY:
+    from app.range_index import RangeIndex
 else:
-    from setup_database.models import AirPollutionData, SessionLocal, Base #when executing the file directly, without docker
+    from range_index import RangeIndex #when executing the file directly, without docker
 
-# Pandas is used for data manipulation and analysis.
-import pandas as pd
+# Importing the response cache for the rendered pages.
+if SECRET_KEY:
+    from app.cache import ResponseCache
+else:
+    from cache import ResponseCache #when executing the file directly, without docker
+
+# Importing the serializers of the stats API.
+if SECRET_KEY:
+    from app.formats import MEDIA_TYPES, STATISTICS, round_stats, array_values, to_json, to_arrow, to_parquet
+else:
+    from formats import MEDIA_TYPES, STATISTICS, round_stats, array_values, to_json, to_arrow, to_parquet #when executing the file directly, without docker
+
+# Importing the streaming export of the raw data points.
+if SECRET_KEY:
+    from app.export import MEDIA_TYPES as EXPORT_MEDIA_TYPES, export_query, iter_chunks, csv_lines, ndjson_lines, gzip_blocks, accepts_gzip
+else:
+    from export import MEDIA_TYPES as EXPORT_MEDIA_TYPES, export_query, iter_chunks, csv_lines, ndjson_lines, gzip_blocks, accepts_gzip #when executing the file directly, without docker
+
+# Importing the in-memory columnar store of the data points.
+if SECRET_KEY:
+    from app.columnar import ColumnarStore
+else:
+    from columnar import ColumnarStore #when executing the file directly, without docker
+
+# Importing the request metrics and their Prometheus exposition.
+if SECRET_KEY:
+    from app.metrics import Metrics, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+else:
+    from metrics import Metrics, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE #when executing the file directly, without docker
 
 # Pydantic is used for data validation and settings management using Python type annotations.
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
+
+# The threading module is used to serialize the writes of concurrent requests.
+import threading
+
+# run_in_threadpool is used to run the database work of the async batch endpoints in the worker threadpool.
+from starlette.concurrency import run_in_threadpool
+
+# The json module is used to parse the bodies of the batch endpoints.
+import json
+
+# defaultdict is used to group the changes of a batch by entity.
+from collections import defaultdict
 
 # The logging module is used to log messages for tracking events that happen when the software runs.
 import logging
 
-# RotatingFileHandler is used to manage log files, allowing them to rotate when they reach a certain size.
-from logging.handlers import RotatingFileHandler
-
 # The atexit module is used to register functions to be called upon normal program termination.
 import atexit
 
+# asynccontextmanager is used to define the startup and shutdown of the app (lifespan).
+from contextlib import asynccontextmanager
+
 # The datetime module supplies classes for manipulating dates and times.
 from datetime import datetime
 
+# Importing the queued logging: the log file is written by a background thread, and the sampling of logged payloads.
+if SECRET_KEY:
+    from app.logging_setup import file_handler, queue_logging, PayloadSampler
+else:
+    from logging_setup import file_handler, queue_logging, PayloadSampler #when executing the file directly, without docker
+
 # Create a logger
 logger = logging.getLogger("my_logger")
 logger.setLevel(logging.INFO)
 
-# Create a file handler that logs messages to a file
+# Create a file handler that logs messages to a file, rotated at LOG_MAX_BYTES (default 10 MiB)
 if SECRET_KEY:
     log_file = "/app/src/app/logs/app.log"
 else:
     log_file = os.path.join(os.path.dirname(__file__), '../..', 'logs/app.log') #when executing the file directly, without docker
 
-file_handler = RotatingFileHandler(log_file, maxBytes=2000, backupCount=5)
-file_handler.setLevel(logging.INFO)
-
-# Create a formatter and set it for the handler
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-
-# Add the handler to the logger
-logger.addHandler(file_handler)
-
-# Initialize the FastAPI application.
-app = FastAPI()
-
-# Log application start
-logger.info(f"Application started at {datetime.now()}")
-
-# Register a function to log application end
-def log_app_end():
+# The logger only puts the records into a queue, the listener thread writes and rotates the file,
+# so request handlers never wait for the disk. Stopping the listener at exit writes the remaining records.
+log_listener = queue_logging(logger, file_handler(log_file))
+atexit.register(log_listener.stop)
+
+# Decides whether the full payload of a data point is logged, for LOG_PAYLOAD_SAMPLE_RATE of the data points
+log_payload = PayloadSampler()
+
+# Startup and shutdown of the app. Importing this module does no database work, which keeps worker spawns, cold starts
+# and test runs fast; the tables are created explicitly with setup_database/schema.py (or by load_data.py).
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Log application start
+    logger.info(f"Application started at {datetime.now()}")
+
+    # Refuse to start without the tables, instead of failing on the first request
+    missing = missing_tables(engine)
+    if missing:
+        logger.error(f"Missing tables: {', '.join(missing)}")
+        raise RuntimeError(f"The database has no tables {', '.join(missing)}, create them with: python src/app/setup_database/schema.py")
+
+    # Build the precomputed per-entity statistics once, if the database has been populated without them.
+    # With shared state the first worker builds them together with the snapshot, the others map the snapshot.
+    if shared_state is not None:
+        shared_state.open(SessionLocal)
+    else:
+        with SessionLocal() as db:
+            ensure_summary(db)
+
+    # Map (or build) the columnar store, so the first requests do not wait for it
+    if columnar_store is not None:
+        with SessionLocal() as db:
+            columnar_store.columns(db)
+
+    yield
+
+    # Log application end
     logger.info(f"Application ended at {datetime.now()}")
-atexit.register(log_app_end)
-
-# Define the path to the database, construct the database URL using the file path.
-db_path = os.path.join(os.path.dirname(__file__), 'airpollution.db')
-
-# Define the database URL for SQLAlchemy.
-DATABASE_URL = f"sqlite:///{db_path}"
-
-# Create the database engine with SQLite.
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 
-# Configure the session class for database interactions.
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Create the database tables based on the models.
-Base.metadata.create_all(bind=engine)
+# Initialize the FastAPI application.
+app = FastAPI(lifespan=lifespan)
+
+# The engines of the writer and the readers and their session classes come from the shared database layer
+# (setup_database/database.py), which configures the SQLite pragmas and the connection pools.
+# Engines connect on first use, so creating them on import does not open the database.
+
+# Create the in-memory year-range index, entities are indexed on their first request and dropped again on writes.
+range_index = RangeIndex()
+
+# Create the cache of rendered pages, bounded to STATS_CACHE_SIZE entries which expire after STATS_CACHE_TTL seconds.
+response_cache = ResponseCache(
+    maxsize=int(os.environ.get("STATS_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("STATS_CACHE_TTL", "300"))
+)
+
+# Create the performance metrics: latency per route, SQL queries per request and the hit rates of both caches.
+# Requests slower than SLOW_REQUEST_MS milliseconds are logged with their SQL queries (not set: no slow-request log).
+metrics = Metrics(
+    slow_request_ms=float(os.environ["SLOW_REQUEST_MS"]) if os.environ.get("SLOW_REQUEST_MS") else None,
+    logger=logger
+)
+metrics.instrument(Engine)
+metrics.register_cache("response", response_cache)
+metrics.register_cache("range_index", range_index)
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+def create_shared_state(directory: str):
+    # State shared by the workers of a multi-process deployment. It is only imported with several workers: it locks
+    # its files with fcntl, which is POSIX only, and a single process (e.g. on Windows) does not need it.
+    if SECRET_KEY:
+        from app.shared_state import SharedState
+    else:
+        from shared_state import SharedState #when executing the file directly, without docker
+    return SharedState(directory)
+
+
+# State shared with the other workers in SHARED_STATE_DIR (set by the multi-worker mode of __main__ below), not set
+# for a single process. The files are mapped by the lifespan.
+shared_state = create_shared_state(os.environ["SHARED_STATE_DIR"]) if os.environ.get("SHARED_STATE_DIR") else None
+
+# With COLUMNAR_SNAPSHOT set (the path of its snapshot file) the statistics are computed from the in-memory columnar
+# store instead of the database and the range index; not set, the store is not used.
+columnar_store = ColumnarStore(os.environ["COLUMNAR_SNAPSHOT"]) if os.environ.get("COLUMNAR_SNAPSHOT") else None
+
+# Endpoints are plain functions, which FastAPI runs in its worker threadpool, so database queries and statistics
+# never block the event loop. Writes are serialized by this lock, SQLite only allows one writer at a time.
+write_lock = threading.Lock()
+
+# Range of valid years of the data points, the dataset starts in 1750. Statistics over years (e.g. the trend) are
+# computed per year of an entity's range, a data point far outside it would make every such request expensive.
+MIN_YEAR = 1750
+MAX_YEAR = datetime.now().year
 
 # Define a Pydantic model for input validation.
 class AirPollutionDataCreate(BaseModel):
     entity: str
-    year: int
+    year: int = Field(ge=MIN_YEAR, le=MAX_YEAR)
     nitrogen_oxide: float
     sulphur_dioxide: float
     carbon_monoxide: float
@@ -98,8 +234,16 @@ class AirPollutionDataCreate(BaseModel):
     black_carbon: float
     ammonia: float
 
+# Define a Pydantic model identifying a data point, used by the batch delete endpoint.
+class AirPollutionDataKey(BaseModel):
+    entity: str
+    year: int
+
+# Number of (entity, year) pairs looked up per query, keeps the number of SQL variables below SQLite's limit.
+BATCH_LOOKUP_SIZE = 500
+
 def get_db():
-    # Create a new database session.
+    # Create a new database session of the writer.
     db = SessionLocal()
 
     try:
@@ -107,43 +251,170 @@ def get_db():
     finally:
         db.close()  # Ensure the session is closed after use.
 
+def get_read_db():
+    # Create a new read-only database session, read endpoints use the pool of the readers and never wait for the writer.
+    db = ReadSessionLocal()
 
-# Endpoint to display the main form.
-@app.get("/", response_class=HTMLResponse)
-async def main(db: Session = Depends(get_db)):
     try:
-        # Query distinct entities from the database.
+        yield db  # Yield the session for dependency injection.
+    finally:
+        db.close()  # Ensure the session is closed after use.
+
+
+def render_main_page(db: Session):
+    # Query distinct entities from the database, or take them from the columnar store.
+    if columnar_store is not None:
+        entities = [(entity,) for entity in columnar_store.entities(db)]
+    else:
         entities = db.execute(select(AirPollutionData.entity).distinct()).fetchall()
 
-        # Generate HTML options for the entities.
-        entity_options = "".join([f'<option value="{entity[0]}">{entity[0]}</option>' for entity in entities])
-
-        # Generate the HTML content for the form.
-        content = f"""
-        <body>  
-            <header>  
-                <h1>Welcome to Air Pollution Data Viewer</h1>   
-                <p>Select an entity and optionally a year range to view the summary statistics</p>  
-            </header> 
-            <form action="/get_stats/" method="post">  
-                <label for="entity">Select an entity:</label>  
-                <select name="entity" id="entity">   
-                    {entity_options}   
-                </select>  
-                <br><br>  
-                <label for="start_year">Select start year (optional). Statistics is calculated including provided year. Minimum is 1750:</label> 
-                <input type="number" name="start_year" id="start_year" min="1750" max="2022">   
-                <br><br>   
-                <label for="end_year">Select end year (optional). Statistics is calculated including provided year. Maximum is 2022:</label> 
-                <input type="number" name="end_year" id="end_year" min="1750" max="2022"> 
-                <br><br>   
-                <input type="submit" value="Show Statistics">   
-            </form>   
-        </body>  
-        """
-
-        # Return the HTML content as a response.
-        return HTMLResponse(content=content)
+    # Generate HTML options for the entities.
+    entity_options = "".join([f'<option value="{entity[0]}">{entity[0]}</option>' for entity in entities])
+
+    # Generate the HTML content for the form.
+    content = f"""
+    <body>  
+        <header>  
+            <h1>Welcome to Air Pollution Data Viewer</h1>   
+            <p>Select an entity and optionally a year range to view the summary statistics</p>  
+        </header> 
+        <form action="/get_stats/" method="post">  
+            <label for="entity">Select an entity:</label>  
+            <select name="entity" id="entity">   
+                {entity_options}   
+            </select>  
+            <br><br>  
+            <label for="start_year">Select start year (optional). Statistics is calculated including provided year. Minimum is 1750:</label> 
+            <input type="number" name="start_year" id="start_year" min="1750" max="2022">   
+            <br><br>   
+            <label for="end_year">Select end year (optional). Statistics is calculated including provided year. Maximum is 2022:</label> 
+            <input type="number" name="end_year" id="end_year" min="1750" max="2022"> 
+            <br><br>   
+            <input type="submit" value="Show Statistics">   
+        </form>   
+    </body>  
+    """
+
+    return content
+
+
+def entity_stats(db: Session, entity: str, start_year: int = None, end_year: int = None):
+    # Calculate mean, median and sd for all parameters of an entity, the result is shared by the HTML pages and the stats API.
+    # Statistics across all years are read from the precomputed summary, those of a year range from the cumulative sums
+    # of the year range index. Returns None if the entity has no data (in the year range).
+    # The columnar store answers both from a slice of its columns.
+    if columnar_store is not None:
+        rows, stats = columnar_store.stats(db, entity, start_year, end_year)
+        return stats if rows else None
+    if start_year is None and end_year is None:
+        if shared_state is not None and shared_state.current(entity):
+            stats = shared_state.stats(entity)
+        else:
+            stats = get_summary_stats(db, entity)
+        return stats if stats is not None and any(values["mean"] is not None for values in stats.values()) else None
+    rows, stats = range_index.stats(db, entity, start_year, end_year)
+    return stats if rows else None
+
+
+def render_range_stats(db: Session, entity: str, start_year: int, end_year: int):
+    # Calculate mean, median and sd for all parameters from the cumulative sums of the year range index
+    stats = entity_stats(db, entity, start_year, end_year)
+    if stats is None:
+        return "<p>Data not found</p>"
+
+    # List of parameters to calculate statistics for
+    parameters = PARAMETERS
+
+    # Generate the HTML content for the statistics
+    stats_html = "".join([
+        f"""
+        <h3>{'Non-methane Volatile Organic Compounds (NMVOC)' if param == 'nmvoc'
+        else 'Nitrogen Oxide (NOx)' if param == 'nitrogen_oxide'
+        else 'Carbon monoxide (CO)' if param == 'carbon_monoxide'
+        else 'Sulphur dioxide (SO₂)' if param == 'sulphur_dioxide'
+        else 'Ammonia (NH₃)' if param == 'ammonia'
+        else param.replace('_', ' ').title()}</h3>
+        <ul> 
+            <li>Mean: {stats[param]['mean']}</li> 
+            <li>Median: {stats[param]['median']}</li>
+            <li>Standard Deviation: {stats[param]['stddev']}</li> 
+        </ul>   
+        """ for param in parameters
+    ])
+
+    # Return the statistics as HTML content.
+    return f"""
+    <p>Statistics for all parameters for {entity} from {start_year} to {end_year}:</p> 
+    {stats_html}   
+    """
+
+
+def render_all_stats(db: Session, entity: str):
+    # List of parameters to calculate statistics for
+    parameters = PARAMETERS
+
+    # Read the precomputed statistics of the entity, which are kept up to date by the write endpoints,
+    # so no scan of the data table is needed. The page of an entity without data lists empty statistics.
+    stats = entity_stats(db, entity) or {param: {"mean": None, "median": None, "stddev": None} for param in parameters}
+
+    # Generate the HTML content for the statistics
+    stats_html = "".join([
+        f"""
+        <h3>{'Non-methane Volatile Organic Compounds (NMVOC)' if param == 'nmvoc'
+        else 'Nitrogen Oxide (NOx)' if param == 'nitrogen_oxide'
+        else 'Carbon monoxide (CO)' if param == 'carbon_monoxide'
+        else 'Sulphur dioxide (SO₂)' if param == 'sulphur_dioxide'
+        else 'Ammonia (NH₃)' if param == 'ammonia' else param.replace('_', ' ').title()}</h3>
+        <ul>
+            <li>Mean: {stats[param]['mean']}</li>
+            <li>Median: {stats[param]['median']}</li>
+            <li>Standard Deviation: {stats[param]['stddev']}</li>
+        </ul>
+        """ for param in parameters
+    ])
+
+    # Return the statistics as HTML content.
+    return f"""
+    <p>Statistics for all parameters for {entity} for all years:</p>
+    {stats_html}
+    """
+
+
+def cached_response(request: Request, key, render, media_type: str = "text/html"):
+    # Serve a response from the response cache, or render and cache it. The key starts with the entity of the response.
+    sync_workers()
+    entry, token = response_cache.get(key)
+    if entry is None:
+        entry = response_cache.set(key, render(), token)
+
+    # Answer conditional requests of clients and proxies which already have the current response with 304 Not Modified
+    if entry.not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=entry.headers())
+    return Response(content=entry.content, media_type=media_type, headers=entry.headers())
+
+def data_changed(entity: str):
+    # Drop the outdated year-range index and cached pages of an entity after its data changed
+    range_index.invalidate(entity)
+    response_cache.invalidate(entity)
+    if columnar_store is not None:
+        columnar_store.changed(entity)
+    if shared_state is not None:
+        shared_state.changed(entity)
+
+def sync_workers():
+    # Drop the in-process caches after another worker changed data, they may hold any of its entities
+    if shared_state is not None and shared_state.changed_elsewhere():
+        range_index.clear()
+        response_cache.clear()
+        if columnar_store is not None:
+            columnar_store.reload()
+
+# Endpoint to display the main form.
+@app.get("/", response_class=HTMLResponse)
+def main(request: Request, db: Session = Depends(get_read_db)):
+    try:
+        # The dropdown lists all entities, it is cached without entity
+        return cached_response(request, (None, "main"), lambda: render_main_page(db))
 
     except Exception as e:
         logger.error("Error in main endpoint", exc_info=True)
@@ -167,58 +438,9 @@ async def get_stats(entity: str = Form(...), start_year: int = Form(None), end_y
 
 # Endpoint to get statistics for a specific entity and year range
 @app.get("/data/{entity}/{start_year}/{end_year}/stats", response_class=HTMLResponse)
-async def get_stats(entity: str, start_year: int, end_year: int, db: Session = Depends(get_db)):
+def get_stats(request: Request, entity: str, start_year: int, end_year: int, db: Session = Depends(get_read_db)):
     try:
-        data = db.query(AirPollutionData).filter(
-            AirPollutionData.entity == entity,
-            AirPollutionData.year >= start_year,
-            AirPollutionData.year <= end_year
-        ).all()
-        if not data:
-            return HTMLResponse(content="<p>Data not found</p>")
-        # In contrast to the calculation across all years, here, we take the approach of calculating median/sd by pandas directly.
-        # This shall demonstrate another option and work well with small datasets, in contrast to the extended selection, assuming a large database in the real use case
-        df = pd.DataFrame([d.__dict__ for d in data])
-
-        # List of parameters to calculate statistics for
-        parameters = [
-            "nitrogen_oxide", "sulphur_dioxide", "carbon_monoxide",
-            "organic_carbon", "nmvoc", "black_carbon", "ammonia"
-        ]
-
-        # Initialize a dictionary to store the statistics
-        stats = {param: {"mean": None, "median": None, "stddev": None} for param in parameters}
-
-        for parameter in parameters:
-            mean = df[parameter].mean()
-            median = df[parameter].median()
-            stddev = df[parameter].std()
-            stats[parameter]["mean"] = mean
-            stats[parameter]["median"] = median
-            stats[parameter]["stddev"] = stddev
-
-        # Generate the HTML content for the statistics
-        stats_html = "".join([
-            f"""
-            <h3>{'Non-methane Volatile Organic Compounds (NMVOC)' if param == 'nmvoc'
-            else 'Nitrogen Oxide (NOx)' if param == 'nitrogen_oxide'
-            else 'Carbon monoxide (CO)' if param == 'carbon_monoxide'
-            else 'Sulphur dioxide (SO₂)' if param == 'sulphur_dioxide'
-            else 'Ammonia (NH₃)' if param == 'ammonia'
-            else param.replace('_', ' ').title()}</h3>
-            <ul> 
-                <li>Mean: {stats[param]['mean']}</li> 
-                <li>Median: {stats[param]['median']}</li>
-                <li>Standard Deviation: {stats[param]['stddev']}</li> 
-            </ul>   
-            """ for param in parameters
-        ])
-
-        # Return the statistics as an HTML response.
-        return HTMLResponse(content=f"""
-        <p>Statistics for all parameters for {entity} from {start_year} to {end_year}:</p> 
-        {stats_html}   
-        """)
+        return cached_response(request, (entity, start_year, end_year), lambda: render_range_stats(db, entity, start_year, end_year))
 
     except Exception as e:
         logger.error("Error in get_stats endpoint", exc_info=True)
@@ -226,101 +448,229 @@ async def get_stats(entity: str, start_year: int, end_year: int, db: Session = D
 
 # Endpoint to get statistics for a specific entity for all years
 @app.get("/data/{entity}/all/stats", response_class=HTMLResponse)
-async def get_stats_all(entity: str, db: Session = Depends(get_db)):
+def get_stats_all(request: Request, entity: str, db: Session = Depends(get_read_db)):
     try:
-        # List of parameters to calculate statistics for
-        parameters = [
-            "nitrogen_oxide", "sulphur_dioxide", "carbon_monoxide",
-            "organic_carbon", "nmvoc", "black_carbon", "ammonia"
-        ]
-
-        # Initialize a dictionary to store the statistics
-        stats = {param: {"mean": None, "median": None, "stddev": None} for param in parameters}
-
-        for parameter in parameters:
-            # Calculate the mean for the parameter directly in the database, function avg available
-            mean = db.query(func.avg(getattr(AirPollutionData, parameter))).filter(
-                AirPollutionData.entity == entity).scalar()
-
-            # Custom SQL query to calculate the median
-            median_query = text(f"""
-            WITH ranked_data AS (
-                SELECT {parameter}, 
-                        ROW_NUMBER() OVER (ORDER BY {parameter}) AS row_num,
-                        COUNT(*) OVER () AS total_rows
-                FROM air_pollution_data 
-                WHERE entity = :entity 
-            )   
-            SELECT AVG({parameter}) AS median_value
-            FROM ranked_data   
-            WHERE row_num IN ( 
-                (total_rows + 1) / 2,
-                (total_rows + 2) / 2
-            )
-            """)
-
-            median_result = db.execute(median_query, {"entity": entity}).fetchone()
-            median = median_result[0] if median_result else None
-
-            # Custom SQL query to calculate the standard deviation
-            stddev_query = text(f"""
-            WITH avg_data AS (
-                SELECT avg({parameter}) as avg_{parameter}
-                FROM air_pollution_data
-                WHERE entity = :entity
-            )
-            SELECT sqrt(sum(power(t.{parameter} - avg_data.avg_{parameter}, 2)) / nullif(count(*) - 1, 0)) as stddev
-            FROM air_pollution_data t
-            JOIN avg_data ON 1=1
-            WHERE t.entity = :entity 
-            """)
-
-            stddev_result = db.execute(stddev_query, {"entity": entity}).fetchone()
-            stddev = stddev_result[0] if stddev_result else None
-
-            # Store the calculated statistics in the dictionary
-            stats[parameter]["mean"] = mean
-            stats[parameter]["median"] = median
-            stats[parameter]["stddev"] = stddev
-
-        # Generate the HTML content for the statistics
-        stats_html = "".join([
-            f"""
-            <h3>{'Non-methane Volatile Organic Compounds (NMVOC)' if param == 'nmvoc'
-            else 'Nitrogen Oxide (NOx)' if param == 'nitrogen_oxide'
-            else 'Carbon monoxide (CO)' if param == 'carbon_monoxide'
-            else 'Sulphur dioxide (SO₂)' if param == 'sulphur_dioxide'
-            else 'Ammonia (NH₃)' if param == 'ammonia' else param.replace('_', ' ').title()}</h3>
-            <ul>
-                <li>Mean: {stats[param]['mean']}</li>
-                <li>Median: {stats[param]['median']}</li>
-                <li>Standard Deviation: {stats[param]['stddev']}</li>
-            </ul>
-            """ for param in parameters
-        ])
-
-        # Return the statistics as an HTML response.
-        return HTMLResponse(content=f"""
-        <p>Statistics for all parameters for {entity} for all years:</p>
-        {stats_html}
-        """)
+        return cached_response(request, (entity, None, None), lambda: render_all_stats(db, entity))
 
     except Exception as e:
         logger.error("Error in get_stats_all endpoint", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+def serialize_stats(content, results, output: str, statistics=STATISTICS):
+    # Serialize the statistics of the stats API in the requested format: compact JSON, or the statistics
+    # of all requested entities as one columnar Arrow IPC stream or Parquet file for analytics clients
+    try:
+        if output == "json":
+            return to_json(content)
+        return to_arrow(results, statistics) if output == "arrow" else to_parquet(results, statistics)
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"The {output} format requires the pyarrow package")
+
+def check_format(output: str):
+    # Reject unknown output formats of the stats API
+    if output not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown format, use one of: {', '.join(MEDIA_TYPES)}")
+
+def check_quantiles(quantiles: str, start_year: int, end_year: int):
+    # The sketches summarize all years of an entity, approximate quantiles of a year range are not available
+    if quantiles is not None and (start_year is not None or end_year is not None):
+        raise HTTPException(status_code=400, detail="quantiles=approx is only available for all years, without start_year and end_year")
+    return STATISTICS + list(QUANTILES) if quantiles is not None else STATISTICS
+
+def add_quantiles(db: Session, results, entities=None):
+    # Add the approximate quantiles of the sketches (p50, p90, p99) to the exact statistics of every entity
+    quantiles = get_sketch_quantiles(db, entities)
+    empty = dict.fromkeys(QUANTILES)
+    return {name: {param: {**values, **quantiles.get(name, {}).get(param, empty)} for param, values in stats.items()} if stats else stats
+            for name, stats in results.items()}
+
+# API endpoint to get the statistics of one entity, for all years or a year range, as JSON, Arrow or Parquet
+@app.get("/api/stats/{entity}")
+def get_stats_api(request: Request, entity: str, start_year: int = None, end_year: int = None,
+                  digits: int = Query(None, ge=1, le=17), output: str = Query("json", alias="format"),
+                  quantiles: str = Query(None, pattern="^approx$"), db: Session = Depends(get_read_db)):
+    try:
+        check_format(output)
+        statistics = check_quantiles(quantiles, start_year, end_year)
+
+        def render():
+            stats = entity_stats(db, entity, start_year, end_year)
+            if stats is None:
+                raise HTTPException(status_code=404, detail="Data not found")
+            # With quantiles=approx the p50, p90 and p99 of the sketch are added to the exact statistics
+            if quantiles is not None:
+                stats = add_quantiles(db, {entity: stats}, [entity])[entity]
+            content = {"entity": entity, "start_year": start_year, "end_year": end_year, "stats": round_stats(stats, digits)}
+            if quantiles is not None:
+                content["rank_error"] = RANK_ERROR
+            return serialize_stats(content, {entity: stats}, output, statistics)
+
+        # The response is cached like the HTML pages of the entity and dropped when its data changes
+        key = (entity, "api", start_year, end_year, digits, output, quantiles)
+        return cached_response(request, key, render, MEDIA_TYPES[output])
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error("Error in get_stats_api endpoint", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# API endpoint to get the statistics of many entities, or of all entities if none is given, in one response.
+# All entities are computed from one grouped query and can be ranked by one statistic of one parameter.
+@app.get("/api/stats")
+def get_many_stats_api(request: Request, entity: list[str] = Query(None), start_year: int = None, end_year: int = None,
+                       sort: str = None, order: str = Query("desc", pattern="^(asc|desc)$"), limit: int = Query(None, ge=1),
+                       digits: int = Query(None, ge=1, le=17), output: str = Query("json", alias="format"),
+                       quantiles: str = Query(None, pattern="^approx$"), db: Session = Depends(get_read_db)):
+    try:
+        check_format(output)
+        statistics = check_quantiles(quantiles, start_year, end_year)
+
+        # The sort key names a parameter and a statistic, e.g. ammonia.mean, or ammonia.p90 with quantiles=approx
+        if sort is not None:
+            param, _, statistic = sort.partition(".")
+            if param not in PARAMETERS or statistic not in statistics:
+                raise HTTPException(status_code=400, detail="sort must be <parameter>.<statistic>, e.g. ammonia.mean")
+
+        def render():
+            # Compute the statistics of all requested entities with one query and one vectorized pass, those across
+            # all years are read from the snapshot shared by the workers if it is current
+            results = None
+            if columnar_store is not None:
+                results = columnar_store.grouped_stats(db, entity, start_year, end_year)
+            elif shared_state is not None and start_year is None and end_year is None:
+                results = shared_state.all_stats(entity)
+            if results is None:
+                results = get_grouped_stats(db, entity, start_year, end_year)
+
+            # Requested entities without data (in the year range) are null
+            if entity is not None:
+                results = {name: results.get(name) for name in entity}
+            # With quantiles=approx the p50, p90 and p99 of the sketches are added, read with one more query
+            if quantiles is not None:
+                results = add_quantiles(db, results, entity)
+            if sort is not None:
+                results = sort_stats(results, param, statistic, descending=order == "desc")
+            if limit is not None:
+                results = dict(list(results.items())[:limit])
+
+            content = {"start_year": start_year, "end_year": end_year,
+                       "entities": {name: round_stats(stats, digits) for name, stats in results.items()}}
+            if quantiles is not None:
+                content["rank_error"] = RANK_ERROR
+            return serialize_stats(content, results, output, statistics)
+
+        # The response covers many entities, it is cached without entity and dropped after every write
+        key = (None, "api", tuple(entity) if entity else None, start_year, end_year, sort, order, limit, digits, output, quantiles)
+        return cached_response(request, key, render, MEDIA_TYPES[output])
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error("Error in get_many_stats_api endpoint", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# API endpoint to get the trend of an entity: mean, median, sd and the change of the mean against the previous window
+# for every window of `window` consecutive years, the windows start every `step` years. All windows are computed at once
+# from the year-sorted values of the year range index and returned as one JSON array per parameter and statistic.
+@app.get("/api/trend/{entity}")
+def get_trend_api(request: Request, entity: str, window: int = Query(10, ge=1, le=1000), step: int = Query(1, ge=1),
+                  start_year: int = None, end_year: int = None, digits: int = Query(None, ge=1, le=17),
+                  db: Session = Depends(get_read_db)):
+    try:
+        def render():
+            # The year-sorted values of the entity, a slice of the columnar store or from the year range index
+            if columnar_store is not None:
+                years, values = columnar_store.slice(db, entity)
+            else:
+                index = range_index.get(db, entity)
+                years, values = index.years, index.values
+            if not len(years):
+                raise HTTPException(status_code=404, detail="Data not found")
+            starts, means, medians, stddevs, deltas = rolling_stats(years, values, window, step, start_year, end_year)
+            return to_json({
+                "entity": entity,
+                "window": window,
+                "step": step,
+                "start_year": starts.tolist(),
+                "end_year": (starts + window - 1).tolist(),
+                "stats": {param: {
+                    "mean": array_values(means[:, i], digits),
+                    "median": array_values(medians[:, i], digits),
+                    "stddev": array_values(stddevs[:, i], digits),
+                    "delta": array_values(deltas[:, i], digits),
+                } for i, param in enumerate(PARAMETERS)},
+            })
+
+        # The trend is cached like the pages of the entity and dropped when its data changes
+        key = (entity, "trend", window, step, start_year, end_year, digits)
+        return cached_response(request, key, render, "application/json")
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error("Error in get_trend_api endpoint", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# Endpoint exposing the metrics in the Prometheus text format
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+# Endpoint to export the raw data points as CSV or NDJSON, optionally filtered by entities, codes and a year range.
+# The rows are streamed in chunks from the database cursor, so memory use does not grow with the size of the export.
+@app.get("/api/export")
+def export_data(request: Request, entity: list[str] = Query(None), code: list[str] = Query(None), start_year: int = None,
+                end_year: int = None, output: str = Query("csv", alias="format"), db: Session = Depends(get_read_db)):
+    try:
+        if output not in EXPORT_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unknown format, use one of: {', '.join(EXPORT_MEDIA_TYPES)}")
+
+        # The chunks are read in a session of their own on the same database, while the response is streamed
+        chunks = iter_chunks(db.get_bind(), export_query(entity, code, start_year, end_year))
+        blocks = csv_lines(chunks) if output == "csv" else ndjson_lines(chunks)
+        headers = {"Content-Disposition": f'attachment; filename="airpollution.{output}"', "Vary": "Accept-Encoding"}
+
+        # Compress the stream if the client accepts gzip
+        if accepts_gzip(request.headers.get("accept-encoding")):
+            blocks = gzip_blocks(blocks)
+            headers["Content-Encoding"] = "gzip"
+
+        logger.info(f"Export as {output}: entity={entity}, code={code}, start_year={start_year}, end_year={end_year}")
+        return StreamingResponse(blocks, media_type=EXPORT_MEDIA_TYPES[output], headers=headers)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error("Error in export_data endpoint", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
 # Endpoint to add new air pollution data.
 @app.post("/data")
-async def create_data(data: AirPollutionDataCreate, db: Session = Depends(get_db)):
+def create_data(data: AirPollutionDataCreate, db: Session = Depends(get_db)):
     try:
-        logger.info(f"Received data: {data}")
-        # Create a new AirPollutionData instance from the input data.
-        db_data = AirPollutionData(**data.dict())
-        db.add(db_data)  # Add the new data to the session.
-        db.commit()  # Commit the transaction to save the data.
-        db.refresh(db_data)  # Refresh the instance to get the updated data.
-        logger.info(f"Data added to DB: {data}")
-        return db_data  # Return the newly created data.
+        # SQLite allows only one writer at a time, writes of concurrent requests are applied one after another
+        with write_lock:
+            if log_payload():
+                logger.info(f"Received data: {data}")
+            # Create a new AirPollutionData instance from the input data.
+            db_data = AirPollutionData(**data.dict())
+            db.add(db_data)  # Add the new data to the session.
+            add_values(db, db_data.entity, row_values(db_data))  # Add the new values to the precomputed statistics.
+            db.commit()  # Commit the transaction to save the data.
+            data_changed(db_data.entity)  # Drop the outdated year-range index and cached pages of the entity.
+            db.refresh(db_data)  # Refresh the instance to get the updated data.
+            logger.info(f"Data added to DB for entity: {data.entity}, year: {data.year}")
+            return db_data  # Return the newly created data.
+
+    except IntegrityError:
+        db.rollback()
+        logger.warning(f"Data point already exists for entity: {data.entity}, year: {data.year}")
+        raise HTTPException(status_code=409, detail="Data point already exists, use PUT to update it")
 
     except Exception as e:
         logger.error("Error in create_data endpoint", exc_info=True)
@@ -328,23 +678,41 @@ async def create_data(data: AirPollutionDataCreate, db: Session = Depends(get_db
 
 # Endpoint to update existing air pollution data.
 @app.put("/data/{entity}/{year}")
-async def update_data(entity: str, year: int, data: AirPollutionDataCreate, db: Session = Depends(get_db)):
+def update_data(entity: str, year: int, data: AirPollutionDataCreate, db: Session = Depends(get_db)):
     try:
-        # Query the existing data by entity and year.
-        db_data = db.query(AirPollutionData).filter(
-            AirPollutionData.entity == entity,
-            AirPollutionData.year == year
-        ).first()
-        if not db_data:
-            raise HTTPException(status_code=404, detail="Data not found")
-
-        # Update the data with the new values.
-        for key, value in data.dict().items():
-            setattr(db_data, key, value)
-
-        db.commit()  # Commit the transaction to save the changes.
-        db.refresh(db_data)  # Refresh the instance to get the updated data.
-        return db_data  # Return the updated data.
+        # SQLite allows only one writer at a time, writes of concurrent requests are applied one after another
+        with write_lock:
+            # Query the existing data by entity and year.
+            db_data = db.query(AirPollutionData).filter(
+                AirPollutionData.entity == entity,
+                AirPollutionData.year == year
+            ).first()
+            if not db_data:
+                raise HTTPException(status_code=404, detail="Data not found")
+
+            # Remove the old values from the precomputed statistics, the entity itself may change with the update.
+            remove_values(db, db_data.entity, row_values(db_data))
+
+            # Update the data with the new values.
+            for key, value in data.dict().items():
+                setattr(db_data, key, value)
+
+            # Add the new values to the precomputed statistics.
+            add_values(db, db_data.entity, row_values(db_data))
+
+            db.commit()  # Commit the transaction to save the changes.
+            data_changed(entity)  # Drop the outdated year-range indexes and cached pages of the old and the new entity.
+            data_changed(db_data.entity)
+            db.refresh(db_data)  # Refresh the instance to get the updated data.
+            return db_data  # Return the updated data.
+
+    except HTTPException:
+        raise
+
+    except IntegrityError:
+        db.rollback()
+        logger.warning(f"Data point already exists for entity: {data.entity}, year: {data.year}")
+        raise HTTPException(status_code=409, detail="Data point already exists for the new entity and year")
 
     except Exception as e:
         logger.error("Error in update_data endpoint", exc_info=True)
@@ -352,27 +720,31 @@ async def update_data(entity: str, year: int, data: AirPollutionDataCreate, db:
 
 # Endpoint to delete existing air pollution data.
 @app.delete("/data/{entity}/{year}", response_class=HTMLResponse)
-async def delete_data(entity: str, year: int, db: Session = Depends(get_db)):
+def delete_data(entity: str, year: int, db: Session = Depends(get_db)):
     try:
-        logger.info(f"Attempting to delete data for entity: {entity}, year: {year}")
-        # Query the database for the specific data point
-        data_point = db.query(AirPollutionData).filter(
-            AirPollutionData.entity == entity,
-            AirPollutionData.year == year
-        ).first()
-
-        # If the data point is not found, raise a 404 error
-        if not data_point:
-            logger.warning(f"Data point not found for entity: {entity}, year: {year}")
-            raise HTTPException(status_code=404, detail="Data point not found")
-
-        # Delete the data point from the database
-        db.delete(data_point)
-        db.commit()
-        logger.info(f"Data point for entity: {entity}, year: {year} deleted successfully")
-
-        # Return a success message
-        return HTMLResponse(content=f"<p>Data point for {entity} in {year} has been deleted successfully.</p>")
+        # SQLite allows only one writer at a time, writes of concurrent requests are applied one after another
+        with write_lock:
+            logger.info(f"Attempting to delete data for entity: {entity}, year: {year}")
+            # Query the database for the specific data point
+            data_point = db.query(AirPollutionData).filter(
+                AirPollutionData.entity == entity,
+                AirPollutionData.year == year
+            ).first()
+
+            # If the data point is not found, raise a 404 error
+            if not data_point:
+                logger.warning(f"Data point not found for entity: {entity}, year: {year}")
+                raise HTTPException(status_code=404, detail="Data point not found")
+
+            # Delete the data point from the database and its values from the precomputed statistics
+            remove_values(db, data_point.entity, row_values(data_point))
+            db.delete(data_point)
+            db.commit()
+            data_changed(entity)
+            logger.info(f"Data point for entity: {entity}, year: {year} deleted successfully")
+
+            # Return a success message
+            return HTMLResponse(content=f"<p>Data point for {entity} in {year} has been deleted successfully.</p>")
 
     except HTTPException as http_exc:
         logger.error(f"HTTPException: {http_exc.detail}", exc_info=True)
@@ -382,9 +754,195 @@ async def delete_data(entity: str, year: int, db: Session = Depends(get_db)):
         logger.error("An unexpected error occurred", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+async def read_batch_items(request: Request):
+    # Yield the raw items of a batch request, sent either as JSON array or as streamed NDJSON (one JSON object per line)
+    if request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/ndjson")):
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+    else:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        for item in items:
+            yield item
+
+async def validate_batch_items(request: Request, model):
+    # Validate every item of a batch request, invalid items are reported in the results instead of failing the batch
+    items, results = [], []
+    async for raw in read_batch_items(request):
+        try:
+            # NDJSON lines arrive as bytes, items of a JSON array already parsed
+            item = model.model_validate_json(raw) if isinstance(raw, bytes) else model.model_validate(raw)
+            items.append((len(results), item))
+            results.append({"index": len(results), "entity": item.entity, "year": item.year, "status": None})
+        except ValidationError as e:
+            errors = [f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors()]
+            results.append({"index": len(results), "status": "invalid", "detail": errors})
+    return items, results
+
+def find_existing_data(db: Session, keys):
+    # Query the existing data points of many (entity, year) pairs, a few hundred pairs per query
+    keys = list(keys)
+    existing = {}
+    for i in range(0, len(keys), BATCH_LOOKUP_SIZE):
+        # An OR of (entity, year) pairs lets SQLite search the composite index once per pair,
+        # a row-value IN list would be executed as a full table scan
+        for db_data in db.query(AirPollutionData).filter(or_(*[
+            and_(AirPollutionData.entity == entity, AirPollutionData.year == year)
+            for entity, year in keys[i:i + BATCH_LOOKUP_SIZE]
+        ])):
+            existing.setdefault((db_data.entity, db_data.year), db_data)
+    return existing
+
+def batch_response(results):
+    # Summarize the per-item outcomes of a batch
+    counts = defaultdict(int)
+    for result in results:
+        counts[result["status"]] += 1
+    return {"total": len(results), **counts, "results": results}
+
+def apply_upsert_batch(db: Session, items, results):
+    # Apply validated upsert items in one transaction, runs in the worker threadpool
+    with write_lock:
+        # Query the data points of the batch which already exist, with their values before the batch
+        existing = find_existing_data(db, {(item.entity, item.year) for _, item in items})
+        original_values = {key: row_values(db_data) for key, db_data in existing.items()}
+
+        # Apply the items in order, an (entity, year) which exists or was created earlier in the batch is updated,
+        # otherwise a new data point is created, so the reported counts match the rows in the database
+        for index, item in items:
+            key = (item.entity, item.year)
+            db_data = existing.get(key)
+            if db_data is None:
+                db_data = existing[key] = AirPollutionData(**item.model_dump())
+                db.add(db_data)
+                results[index]["status"] = "created"
+            else:
+                for field, value in item.model_dump().items():
+                    setattr(db_data, field, value)
+                results[index]["status"] = "updated"
+
+        # Update the precomputed statistics once per entity with the net change of the batch
+        added, removed = defaultdict(list), defaultdict(list)
+        for key, db_data in existing.items():
+            if key in original_values:
+                removed[key[0]].append(original_values[key])
+            added[key[0]].append(row_values(db_data))
+        for entity in added:
+            update_summary(db, entity, added=added[entity], removed=removed[entity])
+
+        # Commit the whole batch at once and drop the outdated year-range indexes and cached pages
+        db.commit()
+        for entity in added:
+            data_changed(entity)
+
+def apply_delete_batch(db: Session, items, results):
+    # Apply validated delete items in one transaction, runs in the worker threadpool
+    with write_lock:
+        # Query the data points to delete and delete the ones found
+        existing = find_existing_data(db, {(item.entity, item.year) for _, item in items})
+        removed = defaultdict(list)
+        for index, item in items:
+            db_data = existing.pop((item.entity, item.year), None)
+            if db_data is None:
+                results[index]["status"] = "not_found"
+                continue
+            removed[db_data.entity].append(row_values(db_data))
+            db.delete(db_data)
+            results[index]["status"] = "deleted"
+
+        # Remove the deleted values from the precomputed statistics once per entity
+        for entity in removed:
+            update_summary(db, entity, removed=removed[entity])
+
+        # Commit the whole batch at once and drop the outdated year-range indexes and cached pages
+        db.commit()
+        for entity in removed:
+            data_changed(entity)
+
+# Endpoint to add or update many data points in one transaction.
+@app.post("/data/batch")
+async def upsert_data_batch(request: Request, db: Session = Depends(get_db)):
+    try:
+        # The body is read asynchronously, the database work runs in the worker threadpool
+        items, results = await validate_batch_items(request, AirPollutionDataCreate)
+        await run_in_threadpool(apply_upsert_batch, db, items, results)
+
+        response = batch_response(results)
+        logger.info(f"Batch of {response['total']} data points applied: {response.get('created', 0)} created, "
+                    f"{response.get('updated', 0)} updated, {response.get('invalid', 0)} invalid")
+        return response
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        db.rollback()
+        logger.error("Error in upsert_data_batch endpoint", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# Endpoint to delete many data points in one transaction.
+@app.post("/data/batch/delete")
+async def delete_data_batch(request: Request, db: Session = Depends(get_db)):
+    try:
+        # The body is read asynchronously, the database work runs in the worker threadpool
+        items, results = await validate_batch_items(request, AirPollutionDataKey)
+        await run_in_threadpool(apply_delete_batch, db, items, results)
+
+        response = batch_response(results)
+        logger.info(f"Batch of {response['total']} deletions applied: {response.get('deleted', 0)} deleted, "
+                    f"{response.get('not_found', 0)} not found, {response.get('invalid', 0)} invalid")
+        return response
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        db.rollback()
+        logger.error("Error in delete_data_batch endpoint", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
 if __name__ == "__main__":
-    # Uvicorn is used to run the FastAPI application.
+    # Uvicorn is used to run the FastAPI application, argparse to provide the command line interface.
+    import argparse
+    import shutil
+    import tempfile
     import uvicorn
 
-    # Run the FastAPI application on host 0.0.0.0 and port 8000.
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Define the command line interface, the number of worker processes defaults to WEB_CONCURRENCY (like uvicorn) or 1
+    parser = argparse.ArgumentParser(description="Run the air pollution app.")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on (default: 8000)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")),
+                        help="number of worker processes (default: WEB_CONCURRENCY or 1)")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # Every worker is a process with its own copy of the app. The statistics snapshot is built here once, before
+        # the workers start, and the workers map it from SHARED_STATE_DIR (a new temporary directory if not set).
+        temporary = not os.environ.get("SHARED_STATE_DIR")
+        directory = os.environ["SHARED_STATE_DIR"] = os.environ.get("SHARED_STATE_DIR") or tempfile.mkdtemp(prefix="airpollution-")
+        missing = missing_tables(engine)
+        if missing:
+            raise SystemExit(f"The database has no tables {', '.join(missing)}, create them with: python src/app/setup_database/schema.py")
+        create_shared_state(directory).open(SessionLocal, rebuild=True)
+        engine.dispose()
+        try:
+            # The workers import the app themselves, so it is passed by its import string
+            uvicorn.run("app.main:app" if SECRET_KEY else "main:app", host=args.host, port=args.port, workers=args.workers)
+        finally:
+            if temporary:
+                shutil.rmtree(directory, ignore_errors=True)
+    else:
+        # Run the FastAPI application in this process
+        uvicorn.run(app, host=args.host, port=args.port)
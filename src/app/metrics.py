@@ -0,0 +1,202 @@
+# The bisect module finds the histogram bucket of an observed value.
+import bisect
+
+# contextvars is used to collect the SQL queries of the request being handled. The context is copied into the worker
+# threads running the endpoints, so queries executed there are counted for the request.
+import contextvars
+
+# The re module is used to shorten SQL statements for the slow-request log.
+import re
+
+# The threading module is used to protect the metrics against concurrent requests.
+import threading
+
+# The time module is used to measure the durations.
+import time
+
+# SQLAlchemy events report the start and the end of every SQL statement.
+from sqlalchemy import event
+
+# Match tells whether a route matches a request, used with Starlette versions not putting the route into the scope.
+from starlette.routing import Match
+
+# Media type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (in seconds) of the buckets of the request and query duration histograms
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the buckets of the histogram of SQL queries per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Number of statements listed in the slow-request log
+SLOW_QUERY_STATEMENTS = 10
+
+# State of the request being handled: its ASGI scope, route and SQL queries
+_request = contextvars.ContextVar("request_metrics", default=None)
+
+
+def _escape(value) -> str:
+    # Escape a label value for the text format
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    # Format the labels of a sample, e.g. {method="GET",route="/"}
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + ([extra] if extra else [])
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    # Prometheus histogram: cumulative bucket counts, sum and count per combination of label values
+    def __init__(self, name: str, documentation: str, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value: float):
+        # Count the value in its bucket, values above the last bound are only counted in +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        # Lines of the histogram in the text format
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {values[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    # Performance metrics of the app: request latency per route, SQL queries per request and their duration,
+    # and the hit rates of the caches, rendered in the Prometheus text format.
+    # Requests slower than slow_request_ms (None disables it) are logged with the breakdown of their SQL queries.
+    def __init__(self, slow_request_ms: float = None, logger=None):
+        self.slow_request_ms = slow_request_ms
+        self.logger = logger
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Duration of HTTP requests, until the response is sent completely.",
+            ("method", "route", "status"), DURATION_BUCKETS)
+        self.request_queries = Histogram(
+            "http_request_sql_queries", "Number of SQL queries executed per HTTP request.", ("method", "route"), QUERY_COUNT_BUCKETS)
+        self.query_duration = Histogram(
+            "sql_query_duration_seconds", "Duration of SQL queries by the route of the request executing them.", ("route",), DURATION_BUCKETS)
+        self._caches = {}
+
+    def register_cache(self, name: str, cache):
+        # Report the hits and misses of a cache, it needs hits and misses attributes and a length
+        self._caches[name] = cache
+
+    def instrument(self, target):
+        # Time the SQL statements of an engine, or of all engines if the Engine class is given
+        event.listen(target, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(target, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_start"].pop()
+        state = _request.get()
+        self.query_duration.observe((route_of(state) if state else "none",), duration)
+        if state is not None:
+            state["queries"].append((statement, duration))
+
+    def observe_request(self, state, status: int, duration: float):
+        # Record a finished request and log it if it was slow
+        method, route = state["scope"]["method"], route_of(state)
+        self.request_duration.observe((method, route, str(status)), duration)
+        self.request_queries.observe((method, route), len(state["queries"]))
+        if self.slow_request_ms is not None and duration * 1000 >= self.slow_request_ms and self.logger is not None:
+            self.logger.warning(slow_request_message(state, status, duration))
+
+    def render(self) -> str:
+        # All metrics in the Prometheus text format
+        lines = self.request_duration.samples() + self.request_queries.samples() + self.query_duration.samples()
+        caches = sorted(self._caches.items())
+        for name, kind, documentation, value in [
+            ("cache_hits_total", "counter", "Lookups answered from the cache.", lambda cache: cache.hits),
+            ("cache_misses_total", "counter", "Lookups not answered from the cache.", lambda cache: cache.misses),
+            ("cache_hit_ratio", "gauge", "Share of the lookups answered from the cache.",
+             lambda cache: cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else 0.0),
+            ("cache_entries", "gauge", "Number of entries in the cache.", len),
+        ]:
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+            lines += [f'{name}{{cache="{_escape(cache_name)}"}} {value(cache)}' for cache_name, cache in caches]
+        return "\n".join(lines) + "\n"
+
+
+def route_of(state) -> str:
+    # Path template of the route handling the request (e.g. /data/{entity}/all/stats), unmatched requests share one label
+    if state.get("route") is None:
+        scope = state["scope"]
+        route = scope.get("route")
+        if route is None and "app" in scope:
+            route = next((route for route in scope["app"].router.routes if route.matches(scope)[0] == Match.FULL), None)
+        if route is None:
+            return "unmatched"
+        state["route"] = route.path
+    return state["route"]
+
+
+def slow_request_message(state, status: int, duration: float) -> str:
+    # Describe a slow request with its SQL queries, grouped by statement and ordered by their total duration
+    scope, queries = state["scope"], state["queries"]
+    statements = {}
+    for statement, query_duration in queries:
+        # The column lists of the ORM queries are long, the tables and conditions tell the queries apart
+        statement = re.sub(r"^SELECT .+? FROM ", "SELECT ... FROM ", re.sub(r"\s+", " ", statement).strip())[:200]
+        count, total = statements.get(statement, (0, 0.0))
+        statements[statement] = (count + 1, total + query_duration)
+    breakdown = "".join(
+        f"\n    {count}x {total * 1000:.2f} ms: {statement}"
+        for statement, (count, total) in sorted(statements.items(), key=lambda item: -item[1][1])[:SLOW_QUERY_STATEMENTS]
+    )
+    query = "?" + scope["query_string"].decode("latin-1") if scope.get("query_string") else ""
+    return (f"Slow request {scope['method']} {scope['path']}{query} ({route_of(state)}): status {status} in {duration * 1000:.1f} ms, "
+            f"{len(queries)} SQL queries in {sum(query_duration for _, query_duration in queries) * 1000:.1f} ms{breakdown}")
+
+
+class MetricsMiddleware:
+    # ASGI middleware timing every HTTP request until its response is sent, streamed responses included
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        state = {"scope": scope, "route": None, "queries": []}
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = _request.set(state)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            _request.reset(token)
+            self.metrics.observe_request(state, status, duration)
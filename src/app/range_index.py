@@ -0,0 +1,151 @@
+# OS module is used to read the environment variable telling us whether we run within docker.
+import os
+
+# Check if app is running within docker or directly, some imports need to be adressed differently
+SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
+
+# The threading module is used to protect the index against concurrent builds and invalidations.
+import threading
+
+# The math module is used for NaN checks and the square root.
+import math
+
+# itertools.accumulate is used to build the cumulative sums.
+from itertools import accumulate
+
+# The warnings module is used to silence NumPy warnings about empty or single-value ranges.
+import warnings
+
+# NumPy is used to store the year-ordered values and to look up year ranges.
+import numpy as np
+
+# SQLAlchemy core is used to build the select statement fetching the values of an entity.
+from sqlalchemy import select
+
+# SQLAlchemy ORM session is used as type hint for the database session.
+from sqlalchemy.orm import Session
+
+# Importing the database model and the list of parameters.
+if SECRET_KEY:
+    from app.setup_database.models import AirPollutionData
+    from app.stats import PARAMETERS
+else:
+    from setup_database.models import AirPollutionData #when executing the file directly, without docker
+    from stats import PARAMETERS
+
+
+class EntityIndex:
+    # Year-ordered values of one entity together with cumulative counts, sums and sums of squares per parameter.
+    # The sums are kept as exact integers (values scaled by a common power of two), so a difference of two cumulative
+    # sums does not lose precision, however long the series before the year range is.
+    def __init__(self, years, values):
+        # Sort the rows by year, the values matrix has one column per parameter
+        order = np.argsort(years, kind="stable")
+        self.years = np.asarray(years, dtype=np.int64)[order]
+        self.values = np.asfortranarray(np.asarray(values, dtype=float).reshape(len(order), len(PARAMETERS))[order])
+
+        # Cumulative counts, sums and sums of squares per parameter, each with a leading zero,
+        # the sum over rows i..j-1 is then prefix[j] - prefix[i]
+        self.scales = []
+        self.counts = []
+        self.sums = []
+        self.squares = []
+        for column in self.values.T:
+            valid = [value for value in column.tolist() if not math.isnan(value)]
+
+            # Every float is an integer multiple of a power of two, scale all values of the parameter to integers
+            ratios = [value.as_integer_ratio() for value in valid]
+            scale = max((denominator for _, denominator in ratios), default=1)
+            integers = iter([numerator * (scale // denominator) for numerator, denominator in ratios])
+            scaled = [0 if math.isnan(value) else next(integers) for value in column.tolist()]
+
+            self.scales.append(scale)
+            self.counts.append(list(accumulate((0 if math.isnan(value) else 1 for value in column.tolist()), initial=0)))
+            self.sums.append(list(accumulate(scaled, initial=0)))
+            self.squares.append(list(accumulate((value * value for value in scaled), initial=0)))
+
+    def positions(self, start_year: int = None, end_year: int = None):
+        # Translate the year range (including both years) into the row positions i..j-1 by binary search
+        i = 0 if start_year is None else int(np.searchsorted(self.years, start_year, side="left"))
+        j = len(self.years) if end_year is None else int(np.searchsorted(self.years, end_year, side="right"))
+        return i, max(i, j)
+
+    def stats(self, start_year: int = None, end_year: int = None):
+        # Initialize a dictionary to store the statistics
+        stats = {param: {"mean": None, "median": None, "stddev": None} for param in PARAMETERS}
+        i, j = self.positions(start_year, end_year)
+
+        # Median by selection on the contiguous year slice, np.partition runs in linear time of the slice
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            medians = np.nanmedian(self.values[i:j], axis=0) if j > i else np.full(len(PARAMETERS), np.nan)
+
+        for k, param in enumerate(PARAMETERS):
+            # Count, sum and sum of squares of the range from differences of the cumulative sums, in constant time
+            n = self.counts[k][j] - self.counts[k][i]
+            s1 = self.sums[k][j] - self.sums[k][i]
+            s2 = self.squares[k][j] - self.squares[k][i]
+            scale = self.scales[k]
+
+            # Mean and sample variance (n - 1) are computed exactly and rounded once by the integer division
+            if n > 0:
+                stats[param]["mean"] = s1 / (scale * n)
+                stats[param]["median"] = float(medians[k])
+            if n > 1:
+                stats[param]["stddev"] = math.sqrt((n * s2 - s1 * s1) / (scale * scale * n * (n - 1)))
+
+        return j - i, stats
+
+
+class RangeIndex:
+    # In-memory index of all entities, built lazily from the database and invalidated by writes
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entities = {}
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _build(self, db: Session, entity: str):
+        # Fetch year and parameter values of the entity with a single query
+        query = select(AirPollutionData.year, *[getattr(AirPollutionData, param) for param in PARAMETERS]).where(AirPollutionData.entity == entity)
+        rows = np.array(db.execute(query).fetchall(), dtype=float).reshape(-1, len(PARAMETERS) + 1)
+        return EntityIndex(rows[:, 0], rows[:, 1:])
+
+    def get(self, db: Session, entity: str):
+        # Return the index of the entity, building it on first use or after an invalidation
+        with self._lock:
+            index = self._entities.get(entity)
+            generation = (self._epoch, self._generations.get(entity, 0))
+            if index is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if index is None:
+            index = self._build(db, entity)
+            with self._lock:
+                # Only keep the index if no write invalidated the entity while it was built
+                if (self._epoch, self._generations.get(entity, 0)) == generation:
+                    self._entities[entity] = index
+        return index
+
+    def invalidate(self, entity: str):
+        # Drop the index of an entity after its data changed, the next request rebuilds it
+        with self._lock:
+            self._entities.pop(entity, None)
+            self._generations[entity] = self._generations.get(entity, 0) + 1
+
+    def clear(self):
+        # Drop the index of all entities, e.g. after a bulk load
+        with self._lock:
+            self._epoch += 1
+            self._entities.clear()
+
+    def __len__(self):
+        # Number of indexed entities
+        return len(self._entities)
+
+    def stats(self, db: Session, entity: str, start_year: int = None, end_year: int = None):
+        # Return the number of rows in the year range and the statistics of all parameters
+        return self.get(db, entity).stats(start_year, end_year)
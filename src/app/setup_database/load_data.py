@@ -1,47 +1,135 @@
-# Importing pandas for data manipulation and analysis
+# Importing pandas to read the CSV file in chunks
 import pandas as pd
-# Importing Session for database session management
+# Importing insert, delete and select to build the bulk statements
+from sqlalchemy import insert, delete, select
+# Importing Session to rebuild the summary on the connection of the load
 from sqlalchemy.orm import Session
-# Importing the AirPollutionData model and SessionLocal session factory
-from models import AirPollutionData, SessionLocal
+# Importing the models and the engine of the database
+from models import AirPollutionData, EntitySketch, engine
+# Importing the schema creation, the tables are created before the first load
+from schema import create_schema
 
+# argparse is used to provide the command line interface
+import argparse
+# The time module is used to measure the loading speed
+import time
 import os
-def load_data():
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv('../../../data/air-pollution_cleaned.csv')
-
-    # Remove any leading/trailing whitespace from column names
-    df.columns = df.columns.str.strip()
-
-    # Create a new database session
-    db: Session = SessionLocal()
-
-    # Iterate over each row in the DataFrame
-    for _, row in df.iterrows():
-        # Create a new AirPollutionData object for each row
-        db_item = AirPollutionData(
-            entity=row['Entity'],
-            code=row['Code'],
-            year=row['Year'],
-            nitrogen_oxide=row['Nitrogen oxide (NOx)'],
-            sulphur_dioxide=row['Sulphur dioxide (SO₂) emissions'],
-            carbon_monoxide=row['Carbon monoxide (CO) emissions'],
-            organic_carbon=row['Organic carbon (OC) emissions'],
-            nmvoc=row['Non-methane volatile organic compounds (NMVOC) emissions'],
-            black_carbon=row['Black carbon (BC) emissions'],
-            ammonia=row['Ammonia (NH₃) emissions']
-        )
-
-        # Add the new object to the session
-        db.add(db_item)
-
-        # Commit the session to save the objects to the database
-    db.commit()
-
-    # Close the session
-    db.close()
+import sys
+
+# Importing the quantile sketches, which are built while the data is loaded, and the summary, which is rebuilt afterwards
+try:
+    from app.sketch import QuantileSketch
+    from app.summary import rebuild_summary
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from sketch import QuantileSketch #when executing the script directly, without the app package installed
+    from summary import rebuild_summary
+
+# Mapping of the CSV column names to the columns of the AirPollutionData table
+COLUMNS = {
+    'Entity': 'entity',
+    'Code': 'code',
+    'Year': 'year',
+    'Nitrogen oxide (NOx)': 'nitrogen_oxide',
+    'Sulphur dioxide (SO₂) emissions': 'sulphur_dioxide',
+    'Carbon monoxide (CO) emissions': 'carbon_monoxide',
+    'Organic carbon (OC) emissions': 'organic_carbon',
+    'Non-methane volatile organic compounds (NMVOC) emissions': 'nmvoc',
+    'Black carbon (BC) emissions': 'black_carbon',
+    'Ammonia (NH₃) emissions': 'ammonia'
+}
+
+# Parameter columns, every one gets a quantile sketch per entity
+PARAMETERS = list(COLUMNS.values())[3:]
+
+# Default CSV file, the cleaned dataset of the project
+CSV_PATH = os.path.join(os.path.dirname(__file__), '../../../data/air-pollution_cleaned.csv')
+
+
+def read_chunks(path=CSV_PATH, chunksize=50000):
+    # Read a cleaned CSV file (or a Parquet file written by data/check_clean_airpollution.py) in chunks,
+    # so memory stays bounded for large files. The chunks have the column names of the table.
+    if path.endswith(".parquet"):
+        # pyarrow is only needed for Parquet files, it reads them batch by batch
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=list(COLUMNS.values())):
+            yield batch.to_pandas()
+        return
+
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        # Remove any leading/trailing whitespace from column names and rename them to the table columns
+        chunk.columns = chunk.columns.str.strip()
+        yield chunk[list(COLUMNS)].rename(columns=COLUMNS)
+
+
+def load_data(csv_path=CSV_PATH, mode="replace", chunksize=50000, bind=engine):
+    # Load a cleaned CSV or Parquet file into the database
+    return load_frames(read_chunks(csv_path, chunksize), mode, bind)
+
+
+def load_frames(frames, mode="replace", bind=engine):
+    # Load data frames with the columns of the table into the database, e.g. the chunks of read_chunks
+    # or the cleaned chunks of data/check_clean_airpollution.py
+    start = time.perf_counter()
+    total = 0
+    sketches = {}
+    create_schema(bind)
+
+    # Load everything in a single transaction: there is only one commit (and fsync) per load,
+    # and in replace mode readers keep seeing the old data until the new data is complete
+    with bind.begin() as connection:
+        # In replace mode, the existing data is removed first
+        if mode == "replace":
+            connection.execute(delete(AirPollutionData))
+
+        # Insert the frames one by one, so memory stays bounded for large files
+        for chunk in frames:
+            # Missing values are stored as NULL
+            rows = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+
+            # Insert the whole chunk with one executemany call
+            connection.execute(insert(AirPollutionData), rows)
+
+            # Add the values of the chunk to the quantile sketches of their entities, memory stays constant per entity
+            for entity, group in chunk.groupby("entity"):
+                for param in PARAMETERS:
+                    sketches.setdefault((entity, param), QuantileSketch()).update(group[param].dropna().tolist())
+
+            # Report the progress
+            total += len(rows)
+            elapsed = time.perf_counter() - start
+            print(f"{total} rows loaded in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)")
+
+        # Rebuild the precomputed statistics from the loaded data in the same transaction, so a running app switches
+        # to the new data and its statistics at once. The session joins the transaction, its commit does not end it.
+        with Session(bind=connection) as db:
+            print(f"Summary rebuilt for {rebuild_summary(db)} entities")
+
+        # In append mode the sketches of the loaded data are merged into the existing ones, sketches are mergeable
+        if mode == "append":
+            for row in connection.execute(select(EntitySketch)):
+                existing = QuantileSketch.from_json(row.sketch)
+                if (row.entity, row.parameter) in sketches:
+                    existing.merge(sketches[(row.entity, row.parameter)])
+                sketches[(row.entity, row.parameter)] = existing
+
+        # Store the sketches
+        connection.execute(delete(EntitySketch))
+        if sketches:
+            connection.execute(insert(EntitySketch), [
+                {"entity": entity, "parameter": param, "sketch": sketch.to_json()} for (entity, param), sketch in sketches.items()
+            ])
+
+    return total
 
 
 if __name__ == "__main__":
+    # Define the command line interface
+    parser = argparse.ArgumentParser(description="Load the cleaned air pollution CSV (or Parquet) file into the database.")
+    parser.add_argument("csv_path", nargs="?", default=CSV_PATH, help="CSV or Parquet file to load (default: the cleaned dataset)")
+    parser.add_argument("--mode", choices=["replace", "append"], default="replace", help="replace the existing data or append to it (default: replace)")
+    parser.add_argument("--chunksize", type=int, default=50000, help="number of rows read and inserted at once (default: 50000)")
+    args = parser.parse_args()
+
     # Call the load_data function when the script is executed
-    load_data()
\ No newline at end of file
+    load_data(args.csv_path, args.mode, args.chunksize)
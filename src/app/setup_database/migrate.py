@@ -0,0 +1,67 @@
+# Importing text to execute the SQL statements of the migration and inspect to find the tables of the database
+from sqlalchemy import inspect, text
+# Importing the engine of the database
+try:
+    from .models import engine
+except ImportError:
+    from models import engine #when executing the scripts in setup_database directly
+
+# argparse is used to provide the command line interface
+import argparse
+import sys
+
+
+def find_duplicates(connection):
+    # Query every (entity, year) which occurs more than once, with the ids of its rows
+    return connection.execute(text("""
+        SELECT entity, year, COUNT(*) AS rows, GROUP_CONCAT(id) AS ids
+        FROM air_pollution_data
+        GROUP BY entity, year
+        HAVING COUNT(*) > 1
+        ORDER BY entity, year
+    """)).fetchall()
+
+
+def migrate(dedupe=False, bind=engine):
+    with bind.begin() as connection:
+        # Detect and report duplicate data points, they would skew the statistics and block the unique index
+        duplicates = find_duplicates(connection)
+        for entity, year, rows, ids in duplicates:
+            print(f"Duplicate: {entity} {year} occurs {rows} times (ids {ids})")
+
+        if duplicates and not dedupe:
+            print(f"{len(duplicates)} duplicate (entity, year) pairs found, nothing migrated. "
+                  f"Clean them up or run again with --dedupe to keep the latest row of each pair.")
+            return False
+
+        # Keep only the latest row (highest id) of every duplicate pair
+        if duplicates:
+            deleted = connection.execute(text("""
+                DELETE FROM air_pollution_data
+                WHERE id NOT IN (SELECT MAX(id) FROM air_pollution_data GROUP BY entity, year)
+            """)).rowcount
+            print(f"{deleted} duplicate rows deleted")
+
+            # The precomputed statistics and sketches no longer match the data, the app rebuilds them on its next
+            # start. Databases created before these tables existed do not have them yet.
+            existing = set(inspect(connection).get_table_names())
+            for table in ("entity_statistics", "entity_sketches"):
+                if table in existing:
+                    connection.execute(text(f"DELETE FROM {table}"))
+
+        # Add the unique composite index and drop the single column index it replaces
+        connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_air_pollution_data_entity_year ON air_pollution_data (entity, year)"))
+        connection.execute(text("DROP INDEX IF EXISTS ix_air_pollution_data_entity"))
+
+    print("Unique index on (entity, year) is in place")
+    return True
+
+
+if __name__ == "__main__":
+    # Define the command line interface
+    parser = argparse.ArgumentParser(description="Add the unique (entity, year) index to an existing database.")
+    parser.add_argument("--dedupe", action="store_true", help="delete duplicate data points, keeping the latest row of each (entity, year)")
+    args = parser.parse_args()
+
+    # Call the migrate function when the script is executed, fail if duplicates block the migration
+    sys.exit(0 if migrate(args.dedupe) else 1)
@@ -1,7 +1,13 @@
 # Importing necessary SQLAlchemy components for defining models and creating the engine
-from sqlalchemy import Column, Integer, String, Float, create_engine
-# Importing sessionmaker for session creation and declarative_base for model base class
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import Column, Integer, String, Double, Text, Index, Sequence, DDL, event
+# Importing declarative_base for model base class
+from sqlalchemy.orm import declarative_base
+# Importing the engine and session classes of the shared database layer. No tables are created on import,
+# the schema is created explicitly with setup_database/schema.py
+try:
+    from .database import engine, read_engine, SessionLocal, ReadSessionLocal
+except ImportError:
+    from database import engine, read_engine, SessionLocal, ReadSessionLocal #when executing the scripts in setup_database directly
 
 # Create a base class for declarative class definitions
 Base = declarative_base()
@@ -10,29 +16,59 @@ Base = declarative_base()
 # Define the AirPollutionData model
 class AirPollutionData(Base):
     __tablename__ = 'air_pollution_data'  # Name of the table in the database
+    __table_args__ = (
+        # Unique composite index, there is only one data point per entity and year. It serves all lookups by
+        # entity and year as well as by entity alone. Existing databases get it with setup_database/migrate.py
+        Index('ix_air_pollution_data_entity_year', 'entity', 'year', unique=True),
+    )
 
     # Define columns in the table
-    id = Column(Integer, primary_key=True, index=True)  # Primary key column
-    entity = Column(String, index=True)  # Entity column with an index
+    id = Column(Integer, Sequence('air_pollution_data_id_seq'), primary_key=True, index=True)  # Primary key column, numbered by a sequence on backends without autoincrement (DuckDB)
+    entity = Column(String)  # Entity column, indexed by the composite index
     code = Column(String)  # Code column
     year = Column(Integer)  # Year column
-    nitrogen_oxide = Column(Float)  # Nitrogen oxide emissions column
-    sulphur_dioxide = Column(Float)  # Sulphur dioxide emissions column
-    carbon_monoxide = Column(Float)  # Carbon monoxide emissions column
-    organic_carbon = Column(Float)  # Organic carbon emissions column
-    nmvoc = Column(Float)  # Non-methane volatile organic compounds emissions column
-    black_carbon = Column(Float)  # Black carbon emissions column
-    ammonia = Column(Float)  # Ammonia emissions column
+    # The emissions are 64-bit floats on every backend, a plain Float column would only have 32 bits on DuckDB
+    nitrogen_oxide = Column(Double)  # Nitrogen oxide emissions column
+    sulphur_dioxide = Column(Double)  # Sulphur dioxide emissions column
+    carbon_monoxide = Column(Double)  # Carbon monoxide emissions column
+    organic_carbon = Column(Double)  # Organic carbon emissions column
+    nmvoc = Column(Double)  # Non-methane volatile organic compounds emissions column
+    black_carbon = Column(Double)  # Black carbon emissions column
+    ammonia = Column(Double)  # Ammonia emissions column
 
 
-# Database URL for SQLite database
-DATABASE_URL = "sqlite:///./../airpollution.db"
+# Define the EntityStatistics model, a precomputed summary of the AirPollutionData rows per entity and parameter
+class EntityStatistics(Base):
+    __tablename__ = 'entity_statistics'  # Name of the table in the database
 
-# Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+    # Define columns in the table
+    entity = Column(String, primary_key=True)  # Entity the summary belongs to
+    parameter = Column(String, primary_key=True)  # Name of the summarized parameter column, e.g. nitrogen_oxide
+    count = Column(Integer, default=0)  # Number of non-missing values
+    # JSON list of the values in ascending order, mean, median and sd are computed from it. Tables created before
+    # also have the columns total and total_squares, they are no longer written.
+    sorted_values = Column(Text, default="[]")
+
+
+# Define the EntitySketch model, a quantile sketch (app/sketch.py) of the AirPollutionData values per entity and parameter
+class EntitySketch(Base):
+    __tablename__ = 'entity_sketches'  # Name of the table in the database
+
+    # Define columns in the table
+    entity = Column(String, primary_key=True)  # Entity the sketch belongs to
+    parameter = Column(String, primary_key=True)  # Name of the sketched parameter column, e.g. nitrogen_oxide
+    sketch = Column(Text)  # The sketch as JSON, of constant size however many values it summarizes
+
+
+# Define the DataVersion model, a single row counting the changes of the AirPollutionData rows. Every write bumps it in
+# its transaction, copies of the data outside the database (the columnar snapshot) compare it to tell if they are outdated.
+class DataVersion(Base):
+    __tablename__ = 'data_version'  # Name of the table in the database
+
+    # Define columns in the table
+    id = Column(Integer, primary_key=True, autoincrement=False)  # Always 1, the table has a single row
+    version = Column(Integer, default=0)  # Bumped by every change of the data points
 
-# Create a configured "Session" class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# Create all tables in the database
-Base.metadata.create_all(bind=engine)
+# The single row of DataVersion is created with its table
+event.listen(DataVersion.__table__, "after_create", DDL("INSERT INTO data_version (id, version) VALUES (1, 0)"))
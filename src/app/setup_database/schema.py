@@ -0,0 +1,38 @@
+# Importing inspect to find the tables of the database
+from sqlalchemy import inspect
+# Importing the models and the engine of the database
+try:
+    from .models import Base, engine
+except ImportError:
+    from models import Base, engine #when executing the scripts in setup_database directly
+
+# argparse is used to provide the command line interface
+import argparse
+import sys
+
+
+def create_schema(bind=engine):
+    # Create the missing tables and indexes of all models, existing tables are left as they are
+    Base.metadata.create_all(bind=bind)
+
+
+def missing_tables(bind=engine):
+    # Names of the tables of the models which do not exist in the database
+    existing = set(inspect(bind).get_table_names())
+    return [table for table in Base.metadata.tables if table not in existing]
+
+
+if __name__ == "__main__":
+    # Define the command line interface
+    parser = argparse.ArgumentParser(description="Create the tables of the air pollution database.")
+    parser.add_argument("--check", action="store_true", help="only check for missing tables, exit with status 1 if there are any")
+    args = parser.parse_args()
+
+    if args.check:
+        missing = missing_tables()
+        print(f"Missing tables: {', '.join(missing)}" if missing else "All tables exist")
+        sys.exit(1 if missing else 0)
+
+    # The app does not create tables on startup, this script is run once per database and after model changes
+    create_schema()
+    print("All tables exist")
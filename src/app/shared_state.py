@@ -0,0 +1,191 @@
+# OS module is used to handle the files of the shared state and to read the environment variable telling us whether we run within docker.
+import os
+
+# Check if app is running within docker or directly, some imports need to be adressed differently
+SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
+
+# fcntl locks the files of the shared state, so only one process builds the snapshot or counts a write at a time (POSIX only,
+# main.py imports this module only when several workers are configured).
+import fcntl
+
+# The json module is used to store the entity names of the snapshot.
+import json
+
+# The mmap module maps the write counters into the memory of every worker.
+import mmap
+
+# zlib.crc32 maps an entity to its write counter, unlike hash() it is the same in every process.
+import zlib
+
+# contextlib is used to define the file lock as context manager.
+from contextlib import contextmanager
+
+# NumPy stores the snapshot of the statistics and gives an array view of the write counters.
+import numpy as np
+
+# SQLAlchemy ORM session is used as type hint for the database session.
+from sqlalchemy.orm import Session
+
+# Importing the precomputed statistics and the list of parameters.
+if SECRET_KEY:
+    from app.summary import ensure_summary, get_all_summary_stats
+    from app.stats import PARAMETERS
+else:
+    from summary import ensure_summary, get_all_summary_stats #when executing the file directly, without docker
+    from stats import PARAMETERS
+
+# Number of write counters: slot 0 counts all writes, slot 1 the writes changing pages which list all entities and
+# the other slots the writes of the entities mapped to them. Entities sharing a slot only cause extra cache misses.
+GENERATION_SLOTS = 4096
+
+# Statistics stored per parameter in the snapshot, in this order
+SNAPSHOT_STATISTICS = ("mean", "median", "stddev")
+
+
+@contextmanager
+def file_lock(path: str):
+    # Exclusive lock on a file, held by one process at a time
+    with open(path, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def entity_slot(entity: str) -> int:
+    # Write counter of an entity, None stands for the pages listing all entities
+    if entity is None:
+        return 1
+    return 2 + zlib.crc32(entity.encode("utf-8")) % (GENERATION_SLOTS - 2)
+
+
+class SharedGenerations:
+    # Write counters shared by all worker processes through a memory-mapped file. A worker counts its writes here,
+    # the other workers compare the counters with the ones they have seen and drop their outdated caches.
+    def __init__(self, path: str):
+        self.path = path
+        with file_lock(path + ".lock"):
+            if not os.path.exists(path) or os.path.getsize(path) != GENERATION_SLOTS * 8:
+                with open(path, "wb") as file:
+                    file.write(b"\0" * (GENERATION_SLOTS * 8))
+        with open(path, "r+b") as file:
+            self._mmap = mmap.mmap(file.fileno(), GENERATION_SLOTS * 8)
+        self.counters = np.ndarray((GENERATION_SLOTS,), dtype=np.int64, buffer=self._mmap)
+
+    def bump(self, entity: str):
+        # Count a write of an entity, it also changes the pages listing all entities. Returns the new total.
+        with file_lock(self.path + ".lock"):
+            self.counters[entity_slot(entity)] += 1
+            self.counters[1] += 1
+            self.counters[0] += 1
+            return int(self.counters[0])
+
+    def generation(self, entity: str) -> int:
+        # Number of writes of an entity (and of the entities sharing its slot)
+        return int(self.counters[entity_slot(entity)])
+
+    def total(self) -> int:
+        # Number of writes of all workers
+        return int(self.counters[0])
+
+    def close(self):
+        del self.counters
+        self._mmap.close()
+
+
+class SharedState:
+    # State shared by the workers of a multi-process deployment, kept as files in one directory:
+    # - a read-only snapshot of the statistics of every entity across all years, built once from the summary table
+    #   and memory-mapped by every worker, so workers start warm and share one copy of it,
+    # - the write counters of SharedGenerations, which tell the workers about writes made by the other workers.
+    # The snapshot is not used for entities written to since it was built, their statistics are read from the
+    # summary table like without shared state.
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.stats_path = os.path.join(directory, "stats.npy")
+        self.entities_path = os.path.join(directory, "entities.json")
+        self.generations = None
+        self._stats = None
+        self._rows = {}
+        self._built = []
+        self._seen = 0
+
+    def open(self, session_factory, rebuild: bool = False):
+        # Map the write counters and the snapshot, the first process (or every one with rebuild) builds them.
+        # The build runs under a file lock, workers starting at the same time wait for it instead of building it too.
+        os.makedirs(self.directory, exist_ok=True)
+        self.generations = SharedGenerations(os.path.join(self.directory, "generations.bin"))
+        with file_lock(os.path.join(self.directory, "snapshot.lock")):
+            if rebuild or not os.path.exists(self.entities_path):
+                with session_factory() as db:
+                    ensure_summary(db)
+                    self.build(db)
+        self.load()
+        self._seen = self.generations.total()
+
+    def build(self, db: Session):
+        # Write the snapshot: an (entities, parameters, statistics) float array with NaN for missing values, the entity
+        # names and the write counters it was built at. The counters are read before the statistics, so a concurrent
+        # write makes the snapshot look outdated rather than current.
+        built = self.generations.counters.tolist()
+        results = get_all_summary_stats(db)
+        entities = sorted(results)
+        stats = np.full((len(entities), len(PARAMETERS), len(SNAPSHOT_STATISTICS)), np.nan)
+        for row, entity in enumerate(entities):
+            for column, param in enumerate(PARAMETERS):
+                stats[row, column] = [np.nan if results[entity][param][statistic] is None else results[entity][param][statistic]
+                                      for statistic in SNAPSHOT_STATISTICS]
+
+        # Replace the files atomically, processes which already mapped the old snapshot keep using it
+        np.save(self.stats_path + ".tmp.npy", stats)
+        os.replace(self.stats_path + ".tmp.npy", self.stats_path)
+        with open(self.entities_path + ".tmp", "w") as file:
+            json.dump({"entities": entities, "generations": built}, file)
+        os.replace(self.entities_path + ".tmp", self.entities_path)
+
+    def load(self):
+        # Map the snapshot read-only, its pages are shared by all workers through the page cache
+        with open(self.entities_path) as file:
+            meta = json.load(file)
+        self._stats = np.load(self.stats_path, mmap_mode="r")
+        self._rows = {entity: row for row, entity in enumerate(meta["entities"])}
+        self._built = meta["generations"]
+
+    def current(self, entity: str) -> bool:
+        # Whether the snapshot is current for an entity, i.e. no worker wrote to it (or to None: to any entity) since the build
+        slot = entity_slot(entity)
+        return int(self.generations.counters[slot]) == self._built[slot]
+
+    def stats(self, entity: str):
+        # Statistics of an entity across all years from the snapshot, None if the entity has no data.
+        # Only valid if the snapshot is current for the entity.
+        row = self._rows.get(entity)
+        if row is None:
+            return None
+        values = self._stats[row].tolist()
+        return {param: {statistic: None if value != value else value for statistic, value in zip(SNAPSHOT_STATISTICS, values[column])}
+                for column, param in enumerate(PARAMETERS)}
+
+    def all_stats(self, entities=None):
+        # Statistics across all years of the given entities (all entities if None) which have data, keyed by entity,
+        # or None if the snapshot is not current for any of them
+        if not all(self.current(name) for name in (entities if entities is not None else [None])):
+            return None
+        names = entities if entities is not None else self._rows
+        return {name: self.stats(name) for name in names if name in self._rows}
+
+    def changed(self, entity: str):
+        # Count a write of this worker, which has already dropped its own outdated cache entries
+        seen = self._seen
+        total = self.generations.bump(entity)
+        if total == seen + 1:
+            self._seen = total
+
+    def changed_elsewhere(self) -> bool:
+        # Whether other workers wrote since the last call, the caller drops its caches then
+        total = self.generations.total()
+        if total == self._seen:
+            return False
+        self._seen = total
+        return True
@@ -0,0 +1,226 @@
+# OS module is used to read the environment variable telling us whether we run within docker.
+import os
+
+# Check if app is running within docker or directly, some imports need to be adressed differently
+SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
+
+# The warnings module is used to silence NumPy warnings about empty or single-value columns.
+import warnings
+
+# NumPy is used to compute the statistics for all parameters in one vectorized pass.
+import numpy as np
+
+# SQLAlchemy core is used to build the select statements fetching the raw values or the aggregates.
+from sqlalchemy import select, func
+
+# SQLAlchemy ORM session is used as type hint for the database session.
+from sqlalchemy.orm import Session
+
+# Importing the database model.
+if SECRET_KEY:
+    from app.setup_database.models import AirPollutionData
+else:
+    from setup_database.models import AirPollutionData #when executing the file directly, without docker
+
+# List of parameters to calculate statistics for
+PARAMETERS = [
+    "nitrogen_oxide", "sulphur_dioxide", "carbon_monoxide",
+    "organic_carbon", "nmvoc", "black_carbon", "ammonia"
+]
+
+# Backends which compute the statistics in SQL: they have the sample standard deviation and the median as
+# ordered-set aggregate (percentile_cont). SQLite has neither, there the raw values are reduced with NumPy.
+SQL_STATS_BACKENDS = ("postgresql", "duckdb")
+
+
+def fetch_values(db: Session, entity: str, start_year: int = None, end_year: int = None):
+    # Select only the parameter columns of the entity, optionally restricted to a year range (including both years)
+    query = select(*[getattr(AirPollutionData, param) for param in PARAMETERS]).where(AirPollutionData.entity == entity)
+    if start_year is not None:
+        query = query.where(AirPollutionData.year >= start_year)
+    if end_year is not None:
+        query = query.where(AirPollutionData.year <= end_year)
+
+    # Fetch all rows with one round-trip and convert them into a (rows x parameters) matrix, NULL becomes NaN
+    # The matrix is stored column-major, so every parameter is reduced over contiguous memory like a pandas column
+    rows = db.execute(query).fetchall()
+    return np.asfortranarray(np.array(rows, dtype=float).reshape(len(rows), len(PARAMETERS)))
+
+
+def compute_stats(values):
+    # Initialize a dictionary to store the statistics
+    stats = {param: {"mean": None, "median": None, "stddev": None} for param in PARAMETERS}
+
+    # Compute mean, median and sample standard deviation (n - 1) column-wise for all parameters at once.
+    # Missing values are ignored like SQL aggregates do, undefined results (e.g. no rows) become NaN without warning.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        means = np.nanmean(values, axis=0)
+        medians = np.nanmedian(values, axis=0)
+        stddevs = np.nanstd(values, axis=0, ddof=1)
+
+    # Store the calculated statistics in the dictionary, undefined values (e.g. sd of a single value) stay None
+    for i, param in enumerate(PARAMETERS):
+        stats[param]["mean"] = None if np.isnan(means[i]) else float(means[i])
+        stats[param]["median"] = None if np.isnan(medians[i]) else float(medians[i])
+        stats[param]["stddev"] = None if np.isnan(stddevs[i]) else float(stddevs[i])
+
+    return stats
+
+
+def get_entity_stats(db: Session, entity: str, start_year: int = None, end_year: int = None):
+    # Let the database aggregate if it can, otherwise fetch the rows once and compute the statistics for all parameters from the same matrix
+    if db.get_bind().dialect.name in SQL_STATS_BACKENDS:
+        return sql_grouped_stats(db, [entity], start_year, end_year).get(entity) or compute_stats(np.empty((0, len(PARAMETERS))))
+    return compute_stats(fetch_values(db, entity, start_year, end_year))
+
+
+def filter_entities_and_years(query, entities=None, start_year: int = None, end_year: int = None):
+    # Restrict a query to some entities (all entities if None) and a year range (including both years)
+    if entities is not None:
+        query = query.where(AirPollutionData.entity.in_(list(entities)))
+    if start_year is not None:
+        query = query.where(AirPollutionData.year >= start_year)
+    if end_year is not None:
+        query = query.where(AirPollutionData.year <= end_year)
+    return query
+
+
+def fetch_grouped_values(db: Session, entities=None, start_year: int = None, end_year: int = None):
+    # Select the parameter columns of many entities (all entities if None) with one query, ordered by entity,
+    # optionally restricted to a year range (including both years)
+    query = select(AirPollutionData.entity, *[getattr(AirPollutionData, param) for param in PARAMETERS])
+    query = filter_entities_and_years(query, entities, start_year, end_year)
+    rows = db.execute(query.order_by(AirPollutionData.entity)).fetchall()
+
+    # Split the rows into the entity names and the (rows x parameters) matrix, NULL becomes NaN
+    names = np.array([row[0] for row in rows], dtype=object)
+    values = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), len(PARAMETERS))
+
+    # The rows of an entity are contiguous, every group starts where the entity name changes
+    starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]]) if len(rows) else np.empty(0, dtype=int)
+    return list(names[starts]), starts, values
+
+
+def compute_grouped_stats(starts, values):
+    # Compute mean, median and sample standard deviation (n - 1) for all groups and parameters at once.
+    # Returns three (groups x parameters) matrices, undefined results are NaN.
+    if not len(starts):
+        empty = np.empty((0, values.shape[1]))
+        return empty, empty, empty
+    sizes = np.diff(np.r_[starts, len(values)])
+    group = np.repeat(np.arange(len(starts)), sizes)
+    missing = np.isnan(values)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        # Counts and sums of the values per group, missing values are ignored
+        counts = np.add.reduceat(~missing, starts, axis=0)
+        means = np.add.reduceat(np.where(missing, 0.0, values), starts, axis=0) / counts
+
+        # Second pass over the deviations from the group mean: the sum of the deviations corrects the rounding error
+        # of the mean, the sum of their squares gives the variance without the cancellation of the sum of squares
+        deviations = np.where(missing, 0.0, values - means[group])
+        corrections = np.add.reduceat(deviations, starts, axis=0)
+        squares = np.add.reduceat(deviations * deviations, starts, axis=0)
+        means = means + corrections / counts
+        stddevs = np.sqrt(np.maximum(squares - corrections * corrections / counts, 0.0) / (counts - 1))
+        stddevs[counts < 2] = np.nan
+
+        # Medians: sort every column by group and value, missing values sort to the end of their group,
+        # then average the two middle values of every group (the same value for odd counts)
+        medians = np.empty_like(means)
+        lower, upper = starts[:, None] + (counts - 1) // 2, starts[:, None] + counts // 2
+        for i in range(values.shape[1]):
+            column = values[np.lexsort((values[:, i], group)), i]
+            medians[:, i] = np.where(counts[:, i] > 0, (column[lower[:, i]] + column[upper[:, i]]) / 2, np.nan)
+
+    return means, medians, stddevs
+
+
+def grouped_stats_query(entities=None, start_year: int = None, end_year: int = None):
+    # Grouped query of mean, median (continuous 50th percentile) and sample standard deviation of every parameter per entity
+    aggregates = []
+    for param in PARAMETERS:
+        column = getattr(AirPollutionData, param)
+        aggregates += [func.avg(column), func.percentile_cont(0.5).within_group(column), func.stddev_samp(column)]
+    query = filter_entities_and_years(select(AirPollutionData.entity, *aggregates), entities, start_year, end_year)
+    return query.group_by(AirPollutionData.entity).order_by(AirPollutionData.entity)
+
+
+def sql_grouped_stats(db: Session, entities=None, start_year: int = None, end_year: int = None):
+    # Statistics of many entities (all entities if None) aggregated by the database in one grouped query,
+    # on the backends of SQL_STATS_BACKENDS. Entities without data in the year range are left out.
+    rows = db.execute(grouped_stats_query(entities, start_year, end_year)).fetchall()
+
+    # Aggregates of parameters without values are NULL, they stay None
+    return {
+        row[0]: {
+            param: {
+                name: None if value is None else float(value)
+                for name, value in zip(("mean", "median", "stddev"), row[1 + 3 * i:4 + 3 * i])
+            } for i, param in enumerate(PARAMETERS)
+        } for row in rows
+    }
+
+
+def get_grouped_stats(db: Session, entities=None, start_year: int = None, end_year: int = None):
+    # Statistics of many entities (all entities if None) from one grouped query, as {entity: stats}.
+    # Entities without data in the year range are left out.
+    if db.get_bind().dialect.name in SQL_STATS_BACKENDS:
+        return sql_grouped_stats(db, entities, start_year, end_year)
+    names, starts, values = fetch_grouped_values(db, entities, start_year, end_year)
+    return grouped_results(names, *compute_grouped_stats(starts, values))
+
+
+def grouped_results(names, means, medians, stddevs):
+    # Statistics of the groups of compute_grouped_stats as {entity: stats}, NaN becomes None
+    return {
+        name: {
+            param: {
+                "mean": None if np.isnan(means[g, i]) else float(means[g, i]),
+                "median": None if np.isnan(medians[g, i]) else float(medians[g, i]),
+                "stddev": None if np.isnan(stddevs[g, i]) else float(stddevs[g, i]),
+            } for i, param in enumerate(PARAMETERS)
+        } for g, name in enumerate(names)
+    }
+
+
+def rolling_stats(years, values, window: int, step: int = 1, start_year: int = None, end_year: int = None):
+    # Statistics of every window of `window` consecutive years, the windows start every `step` years.
+    # years are the sorted years of one entity and values its (rows x parameters) matrix. Returns the start years of
+    # the windows and four (windows x parameters) matrices: mean, median, sample standard deviation and the change
+    # of the mean against the previous window (the year-over-year delta for window 1 and step 1), undefined results are NaN.
+    # The year range is clamped to the years with data, the grid below has one row per year in the range
+    first = int(years[0]) if start_year is None else max(start_year, int(years[0]))
+    last = int(years[-1]) if end_year is None else min(end_year, int(years[-1]))
+    if last - first + 1 < window:
+        empty = np.empty((0, values.shape[1]))
+        return np.empty(0, dtype=int), empty, empty, empty, empty
+
+    # Rows of every window: the years are sorted, so the rows of [start, start + window) are found by binary search
+    starts = np.arange(first, last - window + 2, step)
+    lower = np.searchsorted(years, starts, side="left")
+    upper = np.searchsorted(years, starts + window, side="left")
+
+    # Gather the rows of all windows into one (windows x rows x parameters) array, padded with NaN up to the rows of
+    # the longest window. Its size depends on the number of rows, not on the span of the years.
+    width = int((upper - lower).max()) if len(starts) else 0
+    rows = lower[:, None] + np.arange(width)
+    padded = np.vstack([values, np.full((1, values.shape[1]), np.nan)])
+    windows = padded[np.where(rows < upper[:, None], rows, len(values))]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        means = np.nanmean(windows, axis=1)
+        medians = np.nanmedian(windows, axis=1)
+        stddevs = np.nanstd(windows, axis=1, ddof=1)
+    deltas = np.vstack([np.full((1, values.shape[1]), np.nan), np.diff(means, axis=0)])
+    return starts, means, medians, stddevs, deltas
+
+
+def sort_stats(results, param: str, statistic: str, descending: bool = True):
+    # Order the statistics of many entities by one statistic of one parameter, entities without it come last
+    def key(item):
+        value = item[1][param][statistic] if item[1] else None
+        return (value is None, -value if descending and value is not None else value)
+    return dict(sorted(results.items(), key=key))
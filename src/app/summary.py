@@ -0,0 +1,244 @@
+# OS module is used to handle file paths and to read the environment variable telling us whether we run within docker.
+import os
+
+# Check if app is running within docker or directly, some imports need to be adressed differently
+SECRET_KEY = os.environ.get("AM_I_IN_A_DOCKER_CONTAINER", "").lower() in ("yes", "y", "on", "true", "1")
+
+# The json module is used to store the sorted values of a parameter as text in the database.
+import json
+
+# The math module is used for the square root and for accurate summation of the sorted values.
+import math
+
+# The bisect module is used to keep the sorted values sorted when single values are added or removed.
+import bisect
+
+# itertools.groupby is used to split the entity-ordered rows into one group per entity during a rebuild.
+from itertools import groupby
+
+# SQLAlchemy core is used to build the select and delete statements.
+from sqlalchemy import select, delete, update
+
+# SQLAlchemy ORM session is used as type hint for the database session.
+from sqlalchemy.orm import Session
+
+# Importing the database models, the list of parameters and the quantile sketches.
+if SECRET_KEY:
+    from app.setup_database.models import AirPollutionData, EntityStatistics, EntitySketch, DataVersion, Base
+    from app.stats import PARAMETERS
+    from app.sketch import QuantileSketch, QUANTILES
+else:
+    from setup_database.models import AirPollutionData, EntityStatistics, EntitySketch, DataVersion, Base #when executing the file directly, without docker
+    from stats import PARAMETERS
+    from sketch import QuantileSketch, QUANTILES
+
+
+def row_values(data):
+    # Extract the parameter values of an AirPollutionData row (or a Pydantic payload) as dictionary
+    return {param: getattr(data, param) for param in PARAMETERS}
+
+
+def _summary_rows(db: Session, entity: str):
+    # Load the summary rows of the entity by primary key and create missing ones
+    rows = {row.parameter: row for row in db.query(EntityStatistics).filter(EntityStatistics.entity == entity).all()}
+    missing = [param for param in PARAMETERS if param not in rows]
+    for param in missing:
+        rows[param] = EntityStatistics(entity=entity, parameter=param, count=0, sorted_values="[]")
+        db.add(rows[param])
+
+    # Flush new rows right away, the sessions do not autoflush and a second lookup must find them
+    if missing:
+        db.flush()
+    return rows
+
+
+def _sketch_rows(db: Session, entity: str):
+    # Load the sketch rows of the entity by primary key and create missing (empty) ones
+    rows = {row.parameter: row for row in db.query(EntitySketch).filter(EntitySketch.entity == entity).all()}
+    missing = [param for param in PARAMETERS if param not in rows]
+    for param in missing:
+        rows[param] = EntitySketch(entity=entity, parameter=param, sketch=QuantileSketch().to_json())
+        db.add(rows[param])
+    if missing:
+        db.flush()
+    return rows
+
+
+def bump_version(db: Session):
+    # Count a change of the data points in the version row, within the transaction of the change
+    db.execute(update(DataVersion).values(version=DataVersion.version + 1))
+
+
+def update_summary(db: Session, entity: str, added=(), removed=()):
+    # Apply the values of added and removed data points (lists of dictionaries) to the summary of the entity,
+    # the sorted values are loaded and stored once per parameter, however many data points change.
+    # All writes go through here, so this also bumps the data version.
+    bump_version(db)
+    sketch_changes = {}
+    for param, row in _summary_rows(db, entity).items():
+        sorted_values = None
+        added_values, any_removed = [], False
+        for values, sign in [(values, -1) for values in removed] + [(values, 1) for values in added]:
+            value = values.get(param)
+            # Missing values are skipped like in SQL aggregates
+            if value is None or math.isnan(value):
+                continue
+            if sorted_values is None:
+                sorted_values = json.loads(row.sorted_values)
+
+            if sign > 0:
+                bisect.insort(sorted_values, value)
+                added_values.append(value)
+            else:
+                index = bisect.bisect_left(sorted_values, value)
+                if index == len(sorted_values) or sorted_values[index] != value:
+                    continue
+                del sorted_values[index]
+                any_removed = True
+            row.count += sign
+
+        if sorted_values is not None:
+            row.sorted_values = json.dumps(sorted_values)
+
+        # Values can be added to a sketch but not removed, after a removal it is rebuilt from the sorted values
+        if any_removed:
+            sketch_changes[param] = (sorted_values, True)
+        elif added_values:
+            sketch_changes[param] = (added_values, False)
+
+    # Apply the changes to the quantile sketches of the entity
+    if sketch_changes:
+        sketch_rows = _sketch_rows(db, entity)
+        for param, (values, rebuild) in sketch_changes.items():
+            sketch = QuantileSketch() if rebuild else QuantileSketch.from_json(sketch_rows[param].sketch)
+            sketch.update(values)
+            sketch_rows[param].sketch = sketch.to_json()
+
+
+def add_values(db: Session, entity: str, values: dict):
+    # Add the values of one new data point to the summary of the entity
+    update_summary(db, entity, added=[values])
+
+
+def remove_values(db: Session, entity: str, values: dict):
+    # Remove the values of one deleted (or outdated) data point from the summary of the entity
+    update_summary(db, entity, removed=[values])
+
+
+def _row_stats(row, stats):
+    # Mean, median and sd of one parameter from its summary row
+    n = row.count
+    sorted_values = json.loads(row.sorted_values)
+
+    # Mean from the exact sum, median from the middle of the sorted values
+    mean = math.fsum(sorted_values) / n
+    stats["mean"] = mean
+    stats["median"] = sorted_values[n // 2] if n % 2 else (sorted_values[n // 2 - 1] + sorted_values[n // 2]) / 2
+
+    # Sample standard deviation (n - 1) from the deviations of the same mean. Unlike a running sum of squares it
+    # does not cancel on large values with a small spread (e.g. 1e8 +- 1), and there is no running sum to drift.
+    if n > 1:
+        stats["stddev"] = math.sqrt(math.fsum((value - mean) ** 2 for value in sorted_values) / (n - 1))
+
+
+def get_summary_stats(db: Session, entity: str):
+    # Initialize a dictionary to store the statistics
+    stats = {param: {"mean": None, "median": None, "stddev": None} for param in PARAMETERS}
+
+    # Read the (at most 7) summary rows of the entity via the primary key, no scan of the data table is needed
+    for row in db.query(EntityStatistics).filter(EntityStatistics.entity == entity).all():
+        if row.parameter in stats and row.count:
+            _row_stats(row, stats[row.parameter])
+
+    return stats
+
+
+def get_all_summary_stats(db: Session):
+    # Statistics across all years of every entity with a summary, read with one query ordered by entity
+    results = {}
+    for row in db.query(EntityStatistics).order_by(EntityStatistics.entity).all():
+        stats = results.setdefault(row.entity, {param: {"mean": None, "median": None, "stddev": None} for param in PARAMETERS})
+        if row.parameter in stats and row.count:
+            _row_stats(row, stats[row.parameter])
+    return results
+
+
+def get_sketch_quantiles(db: Session, entities=None):
+    # Approximate quantiles (p50, p90, p99) of every parameter of many entities (all entities if None) from their sketches,
+    # read with one query. Entities without sketch are left out, quantiles of parameters without values are None.
+    query = db.query(EntitySketch)
+    if entities is not None:
+        query = query.filter(EntitySketch.entity.in_(list(entities)))
+    quantiles = {}
+    for row in query.all():
+        if row.parameter in PARAMETERS:
+            values = QuantileSketch.from_json(row.sketch).quantiles(QUANTILES.values())
+            quantiles.setdefault(row.entity, {})[row.parameter] = dict(zip(QUANTILES, values))
+    return quantiles
+
+
+def rebuild_summary(db: Session):
+    # Remove the existing summary, the data it is rebuilt from may have been changed outside the app
+    db.execute(delete(EntityStatistics))
+    bump_version(db)
+
+    # Scan the data table once, ordered by entity, and summarize every entity
+    query = select(AirPollutionData.entity, *[getattr(AirPollutionData, param) for param in PARAMETERS]).order_by(AirPollutionData.entity)
+    entities = 0
+    for entity, rows in groupby(db.execute(query), key=lambda row: row[0]):
+        rows = list(rows)
+        for i, param in enumerate(PARAMETERS, start=1):
+            values = sorted(row[i] for row in rows if row[i] is not None and not math.isnan(row[i]))
+            db.add(EntityStatistics(
+                entity=entity,
+                parameter=param,
+                count=len(values),
+                sorted_values=json.dumps(values)
+            ))
+        entities += 1
+
+    # Commit the session to save the new summary
+    db.commit()
+    return entities
+
+
+def rebuild_sketches(db: Session):
+    # Remove the existing sketches
+    db.execute(delete(EntitySketch))
+
+    # Scan the data table once, ordered by entity, and sketch every parameter of every entity
+    query = select(AirPollutionData.entity, *[getattr(AirPollutionData, param) for param in PARAMETERS]).order_by(AirPollutionData.entity)
+    entities = 0
+    for entity, rows in groupby(db.execute(query), key=lambda row: row[0]):
+        rows = list(rows)
+        for i, param in enumerate(PARAMETERS, start=1):
+            sketch = QuantileSketch()
+            sketch.update(row[i] for row in rows if row[i] is not None and not math.isnan(row[i]))
+            db.add(EntitySketch(entity=entity, parameter=param, sketch=sketch.to_json()))
+        entities += 1
+
+    # Commit the session to save the new sketches
+    db.commit()
+    return entities
+
+
+def ensure_summary(db: Session):
+    # Build the summary and the sketches if the database was populated (e.g. by load_data) without them
+    if db.query(AirPollutionData).first() is None:
+        return
+    if db.query(EntityStatistics).first() is None:
+        rebuild_summary(db)
+    if db.query(EntitySketch).first() is None:
+        rebuild_sketches(db)
+
+
+if __name__ == "__main__":
+    # Use the database of the app via the shared database layer
+    from setup_database.database import engine, SessionLocal
+    Base.metadata.create_all(bind=engine)
+
+    # Regenerate the summary and the sketches from scratch, e.g. after changing the data outside the app
+    db = SessionLocal()
+    print(f"Summary rebuilt for {rebuild_summary(db)} entities")
+    print(f"Sketches rebuilt for {rebuild_sketches(db)} entities")
+    db.close()
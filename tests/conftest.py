@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import app.main as main
+
+
+@pytest.fixture
+def engine():
+    # Empty in-memory database shared by all sessions
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    main.Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def data_point(entity, year, value):
+    # Data point with the same value for all parameters
+    return {"entity": entity, "year": year, **{param: value for param in main.PARAMETERS}}
+
+
+@pytest.fixture
+def client(engine):
+    # Run the app against the empty in-memory database
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_test_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_test_db
+    main.app.dependency_overrides[main.get_read_db] = get_test_db
+    main.range_index.clear()
+    main.response_cache.clear()
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+    main.range_index.clear()
+    main.response_cache.clear()
+
+
+@pytest.fixture
+def populated(client):
+    # The app with three data points of Testland and one of Otherland
+    client.post("/data/batch", json=[data_point("Testland", 2000, 1.0), data_point("Testland", 2001, 2.0),
+                                     data_point("Testland", 2002, 4.0), data_point("Otherland", 2000, 1 / 3)])
+    return client
@@ -0,0 +1,125 @@
+import io
+
+import pytest
+
+import app.main as main
+from tests.conftest import data_point
+
+
+def test_stats_api_returns_json(populated):
+    response = populated.get("/api/stats/Testland")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    body = response.json()
+    assert (body["entity"], body["start_year"], body["end_year"]) == ("Testland", None, None)
+    assert body["stats"]["ammonia"]["mean"] == pytest.approx(7 / 3)
+    assert body["stats"]["ammonia"]["median"] == 2.0
+
+    # Year ranges, also open ones, are answered by the range index
+    body = populated.get("/api/stats/Testland", params={"start_year": 2001}).json()
+    assert body["stats"]["nmvoc"] == {"mean": 3.0, "median": 3.0, "stddev": pytest.approx(2 ** 0.5)}
+    assert populated.get("/api/stats/Testland", params={"start_year": 1800, "end_year": 1900}).status_code == 404
+    assert populated.get("/api/stats/Nowhere").status_code == 404
+
+
+def test_stats_api_matches_html_pages(populated):
+    stats = populated.get("/api/stats/Testland", params={"start_year": 2000, "end_year": 2002}).json()["stats"]
+    page = populated.get("/data/Testland/2000/2002/stats").text
+    for values in stats.values():
+        assert f"Mean: {values['mean']}" in page
+        assert f"Standard Deviation: {values['stddev']}" in page
+
+
+def test_stats_api_many_entities(populated):
+    response = populated.get("/api/stats", params={"entity": ["Testland", "Otherland", "Nowhere"], "digits": 3})
+    assert response.status_code == 200
+    assert b" " not in response.content
+    entities = response.json()["entities"]
+    assert entities["Otherland"]["ammonia"] == {"mean": 0.333, "median": 0.333, "stddev": None}
+    assert entities["Testland"]["ammonia"]["mean"] == 2.33
+    assert entities["Nowhere"] is None
+    assert populated.get("/api/stats", params={"entity": "Testland", "format": "xml"}).status_code == 400
+
+
+@pytest.mark.parametrize("output", ["arrow", "parquet"])
+def test_stats_api_columnar(populated, output):
+    pa = pytest.importorskip("pyarrow")
+    response = populated.get("/api/stats", params={"entity": ["Testland", "Nowhere"], "format": output})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == main.MEDIA_TYPES[output]
+    if output == "arrow":
+        table = pa.ipc.open_stream(response.content).read_all()
+    else:
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(response.content))
+
+    assert table.column_names == ["entity", "parameter", "mean", "median", "stddev"]
+    assert table.num_rows == 2 * len(main.PARAMETERS)
+    rows = table.to_pylist()
+    assert {"entity": "Testland", "parameter": "ammonia", "mean": pytest.approx(7 / 3), "median": 2.0,
+            "stddev": pytest.approx(1.5275252316519468)} in rows
+    assert {"entity": "Nowhere", "parameter": "ammonia", "mean": None, "median": None, "stddev": None} in rows
+
+
+def test_stats_api_all_entities_ranked(populated):
+    populated.post("/data", json=data_point("Thirdland", 2001, 2.5))
+    body = populated.get("/api/stats", params={"sort": "ammonia.mean"}).json()
+    assert list(body["entities"]) == ["Thirdland", "Testland", "Otherland"]
+
+    # The grouped statistics match the ones of the single entities
+    for name, stats in body["entities"].items():
+        expected = populated.get(f"/api/stats/{name}").json()["stats"]
+        assert all(stats[param] == pytest.approx(expected[param]) for param in main.PARAMETERS)
+
+    # Year range, ascending order and limit; entities without data in the range are left out
+    body = populated.get("/api/stats", params={"start_year": 2001, "sort": "nmvoc.median", "order": "asc", "limit": 1}).json()
+    assert body["entities"] == {"Thirdland": {param: {"mean": 2.5, "median": 2.5, "stddev": None} for param in main.PARAMETERS}}
+    assert populated.get("/api/stats", params={"sort": "ammonia.mode"}).status_code == 400
+
+
+def test_grouped_stats_are_invalidated_by_writes(populated):
+    assert list(populated.get("/api/stats").json()["entities"]) == ["Otherland", "Testland"]
+    populated.delete("/data/Otherland/2000")
+    assert list(populated.get("/api/stats").json()["entities"]) == ["Testland"]
+
+
+def test_trend_api(populated):
+    body = populated.get("/api/trend/Testland", params={"window": 2}).json()
+    assert (body["start_year"], body["end_year"]) == ([2000, 2001], [2001, 2002])
+    assert body["stats"]["ammonia"] == {"mean": [1.5, 3.0], "median": [1.5, 3.0],
+                                        "stddev": [pytest.approx(0.5 ** 0.5), pytest.approx(2 ** 0.5)], "delta": [None, 1.5]}
+
+    # Year-over-year deltas, recomputed after a write
+    populated.put("/data/Testland/2002", json=data_point("Testland", 2002, 8.0))
+    body = populated.get("/api/trend/Testland", params={"window": 1}).json()
+    assert body["stats"]["nmvoc"]["delta"] == [None, 1.0, 6.0]
+    assert populated.get("/api/trend/Nowhere").status_code == 404
+    assert populated.get("/api/trend/Testland", params={"window": 0}).status_code == 422
+    body = populated.get("/api/trend/Testland", params={"window": 1000, "start_year": -2000000}).json()
+    assert body["start_year"] == [] and body["stats"]["ammonia"]["mean"] == []
+
+    # Data points far outside the years of the dataset are rejected, they would stretch the trend of their entity
+    assert populated.post("/data", json=data_point("Testland", 100000, 1.0)).status_code == 422
+    assert populated.put("/data/Testland/2002", json=data_point("Testland", 1, 1.0)).status_code == 422
+
+
+def test_stats_api_approximate_quantiles(populated):
+    body = populated.get("/api/stats/Testland", params={"quantiles": "approx"}).json()
+    assert body["rank_error"] == main.RANK_ERROR
+    assert body["stats"]["ammonia"] == {"mean": pytest.approx(7 / 3), "median": 2.0, "stddev": pytest.approx(1.5275252316519468),
+                                        "p50": 2.0, "p90": 4.0, "p99": 4.0}
+    # Exact statistics stay the default
+    assert "p90" not in populated.get("/api/stats/Testland").json()["stats"]["ammonia"]
+
+    # The sketches follow updates and deletes
+    populated.put("/data/Testland/2002", json=data_point("Testland", 2002, 8.0))
+    populated.delete("/data/Testland/2000")
+    body = populated.get("/api/stats", params={"quantiles": "approx", "sort": "ammonia.p90"}).json()
+    assert list(body["entities"]) == ["Testland", "Otherland"]
+    assert {name: stats["ammonia"]["p50"] for name, stats in body["entities"].items()} == {"Testland": 2.0, "Otherland": pytest.approx(1 / 3)}
+    assert body["entities"]["Testland"]["ammonia"]["p90"] == 8.0
+
+    # The sketches cover all years, year ranges and quantile sort keys without quantiles are rejected
+    assert populated.get("/api/stats/Testland", params={"quantiles": "approx", "start_year": 2001}).status_code == 400
+    assert populated.get("/api/stats", params={"sort": "ammonia.p90"}).status_code == 400
+    assert populated.get("/api/stats", params={"quantiles": "exact"}).status_code == 422
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+import app.main as main
+from app.setup_database.database import create_db_engine
+from app.stats import PARAMETERS, compute_stats, get_entity_stats, get_grouped_stats, grouped_stats_query
+from app.summary import rebuild_summary
+
+# The same data and the same requests run on every backend. DuckDB runs on a local file if duckdb_engine is installed,
+# PostgreSQL on the database given by TEST_POSTGRESQL_URL, e.g. postgresql+psycopg2://postgres@localhost/airpollution_test
+BACKENDS = ["sqlite", "duckdb", "postgresql"]
+
+# Three entities with 40 years of values spanning several orders of magnitude, some values are missing
+rng = np.random.default_rng(42)
+DATA = {
+    (entity, year): [None if rng.random() < 0.1 else float(rng.lognormal(10, 3)) for _ in PARAMETERS]
+    for entity in ("Testland", "Otherland", "Thirdland") for year in range(1980, 2020)
+}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path):
+    # Engine of an empty database on the backend
+    if request.param == "sqlite":
+        url = f"sqlite:///{tmp_path / 'test.db'}"
+    elif request.param == "duckdb":
+        pytest.importorskip("duckdb_engine")
+        url = f"duckdb:///{tmp_path / 'test.duckdb'}"
+    else:
+        url = os.environ.get("TEST_POSTGRESQL_URL") or pytest.skip("TEST_POSTGRESQL_URL is not set")
+    engine = create_db_engine(url)
+    main.Base.metadata.drop_all(bind=engine)
+    main.Base.metadata.create_all(bind=engine)
+    yield engine
+    main.Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def backend_client(backend):
+    # Run the app on the backend and add the data through the batch endpoint
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=backend)
+
+    def get_test_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_test_db
+    main.app.dependency_overrides[main.get_read_db] = get_test_db
+    main.range_index.clear()
+    main.response_cache.clear()
+    client = TestClient(main.app)
+    client.post("/data/batch", json=[{"entity": entity, "year": year, **dict(zip(PARAMETERS, [0.0 if value is None else value for value in values]))}
+                                     for (entity, year), values in DATA.items()])
+    yield client, Session
+    main.app.dependency_overrides.clear()
+    main.range_index.clear()
+    main.response_cache.clear()
+
+
+def expected_stats(entity, start_year=None, end_year=None):
+    # Reference statistics of the test data computed with NumPy
+    rows = [values for (name, year), values in DATA.items() if name == entity
+            and (start_year is None or year >= start_year) and (end_year is None or year <= end_year)]
+    return compute_stats(np.array(rows, dtype=float).reshape(len(rows), len(PARAMETERS)))
+
+
+def assert_same_stats(stats, expected):
+    for param in PARAMETERS:
+        for name in ("mean", "median", "stddev"):
+            assert stats[param][name] == pytest.approx(expected[param][name], rel=1e-12), (param, name)
+
+
+def test_stats_are_identical_on_every_backend(backend_client):
+    client, Session = backend_client
+
+    # The batch endpoint cannot send missing values, set them to NULL in the database
+    with Session() as db:
+        for (entity, year), values in DATA.items():
+            missing = {param: None for param, value in zip(PARAMETERS, values) if value is None}
+            if missing:
+                db.query(main.AirPollutionData).filter_by(entity=entity, year=year).update(missing)
+        db.commit()
+
+        # Statistics engine, on PostgreSQL and DuckDB aggregated in SQL
+        grouped = get_grouped_stats(db, None, 1990, 2009)
+        assert list(grouped) == ["Otherland", "Testland", "Thirdland"]
+        for entity, stats in grouped.items():
+            assert_same_stats(stats, expected_stats(entity, 1990, 2009))
+        assert_same_stats(get_entity_stats(db, "Testland"), expected_stats("Testland"))
+
+        # Rebuild the precomputed statistics after the direct update, like after a bulk load
+        rebuild_summary(db)
+    main.range_index.clear()
+    main.response_cache.clear()
+
+    # Endpoints: precomputed statistics, year-range index and grouped statistics
+    assert_same_stats(client.get("/api/stats/Thirdland").json()["stats"], expected_stats("Thirdland"))
+    assert_same_stats(client.get("/api/stats/Otherland", params={"start_year": 2000}).json()["stats"], expected_stats("Otherland", 2000))
+    entities = client.get("/api/stats", params={"sort": "ammonia.median"}).json()["entities"]
+    medians = [expected_stats(entity)["ammonia"]["median"] for entity in ("Testland", "Otherland", "Thirdland")]
+    assert [stats["ammonia"]["median"] for stats in entities.values()] == pytest.approx(sorted(medians, reverse=True), rel=1e-12)
+
+
+def test_writes_work_on_every_backend(backend_client):
+    client, _ = backend_client
+    data_point = {"entity": "Newland", "year": 2000, **{param: 1.0 for param in PARAMETERS}}
+    assert client.post("/data", json=data_point).status_code == 200
+    assert client.post("/data", json=data_point).status_code == 409
+    assert client.put("/data/Newland/2000", json=dict(data_point, ammonia=3.0)).status_code == 200
+    client.post("/data/batch", json=[dict(data_point, year=2001, ammonia=5.0)])
+    assert client.get("/api/stats/Newland").json()["stats"]["ammonia"] == {"mean": 4.0, "median": 4.0, "stddev": pytest.approx(2 ** 0.5)}
+    assert client.delete("/data/Newland/2001").status_code == 200
+    assert client.get("/api/stats/Newland").json()["stats"]["ammonia"] == {"mean": 3.0, "median": 3.0, "stddev": None}
+
+
+def test_postgresql_statistics_sql():
+    # Checked without a server: the aggregates PostgreSQL computes the statistics with
+    sql = str(grouped_stats_query(["Testland"], 1990).compile(dialect=postgresql.dialect()))
+    assert "avg(air_pollution_data.ammonia)" in sql
+    assert "WITHIN GROUP (ORDER BY air_pollution_data.ammonia)" in sql and "percentile_cont(" in sql
+    assert "stddev_samp(air_pollution_data.ammonia)" in sql
+    assert "GROUP BY air_pollution_data.entity" in sql
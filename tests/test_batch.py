@@ -0,0 +1,44 @@
+import json
+
+from tests.conftest import data_point
+
+
+def test_batch_upsert_and_delete(client):
+    # Create three data points, one item is invalid
+    response = client.post("/data/batch", json=[data_point("Testland", 2000, 1.0), data_point("Testland", 2001, 2.0),
+                                                {"entity": "Testland"}, data_point("Otherland", 2000, 5.0)])
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["total"], body["created"], body["invalid"]) == (4, 3, 1)
+    assert [result["status"] for result in body["results"]] == ["created", "created", "invalid", "created"]
+    assert "Mean: 1.5" in client.get("/data/Testland/all/stats").text
+    assert "Mean: 1.5" in client.get("/data/Testland/2000/2001/stats").text
+
+    # Update one data point and create another one, streamed as NDJSON
+    lines = "\n".join(json.dumps(item) for item in [data_point("Testland", 2001, 4.0), data_point("Testland", 2002, 7.0)])
+    response = client.post("/data/batch", content=lines, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == ["updated", "created"]
+    assert "Mean: 4.0" in client.get("/data/Testland/all/stats").text
+    assert "Mean: 4.0" in client.get("/data/Testland/2000/2002/stats").text
+
+    # Delete two data points, one of them does not exist
+    response = client.post("/data/batch/delete", json=[{"entity": "Testland", "year": 2002}, {"entity": "Testland", "year": 1999}])
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == ["deleted", "not_found"]
+    assert "Mean: 2.5" in client.get("/data/Testland/all/stats").text
+    assert "Mean: 2.5" in client.get("/data/Testland/2000/2002/stats").text
+
+
+def test_batch_repeated_key_is_applied_in_order(client):
+    # The second item updates the data point the first one created
+    response = client.post("/data/batch", json=[data_point("Testland", 2000, 1.0), data_point("Testland", 2000, 3.0)])
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == ["created", "updated"]
+    assert (body["created"], body["updated"]) == (1, 1)
+    assert "Mean: 3.0" in client.get("/data/Testland/all/stats").text
+    assert "Standard Deviation: None" in client.get("/data/Testland/all/stats").text
+
+
+def test_batch_rejects_non_array_body(client):
+    assert client.post("/data/batch", json={"entity": "Testland"}).status_code == 400
@@ -0,0 +1,59 @@
+import time
+
+from app.cache import ResponseCache
+from tests.conftest import data_point
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(maxsize=2, ttl=60)
+    for key in [("A", 1), ("B", 1)]:
+        cache.set(key, f"content {key[0]}", cache.get(key)[1])
+    cache.get(("A", 1))
+    cache.set(("C", 1), "content C", cache.get(("C", 1))[1])
+    assert cache.get(("A", 1))[0].content == "content A"
+    assert cache.get(("B", 1))[0] is None
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_cache_entries_expire():
+    cache = ResponseCache(maxsize=10, ttl=0.01)
+    cache.set(("A", 1), "content", cache.get(("A", 1))[1])
+    time.sleep(0.02)
+    assert cache.get(("A", 1))[0] is None
+
+
+def test_cache_invalidation_by_entity():
+    cache = ResponseCache()
+    for key in [("A", 1), ("A", 2), ("B", 1), (None, "main")]:
+        cache.set(key, "content", cache.get(key)[1])
+    cache.invalidate("A")
+    assert [cache.get(key)[0] is None for key in [("A", 1), ("A", 2), ("B", 1), (None, "main")]] == [True, True, False, True]
+
+    # Content rendered before an invalidation of its entity is not stored
+    entry, token = cache.get(("B", 2))
+    cache.invalidate("B")
+    cache.set(("B", 2), "outdated content", token)
+    assert cache.get(("B", 2))[0] is None
+
+
+def test_stats_pages_are_revalidated_and_invalidated_by_writes(client):
+    client.post("/data/batch", json=[data_point("Testland", 2000, 1.0), data_point("Testland", 2001, 2.0)])
+    response = client.get("/data/Testland/all/stats")
+    assert "Mean: 1.5" in response.text
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+
+    # Clients with the current page get 304 Not Modified
+    assert client.get("/data/Testland/all/stats", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/data/Testland/all/stats", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    # After a write the page is rendered again with a new ETag
+    client.put("/data/Testland/2001", json=data_point("Testland", 2001, 5.0))
+    response = client.get("/data/Testland/all/stats", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "Mean: 3.0" in response.text
+    assert response.headers["ETag"] != etag
+
+    # The dropdown lists new entities right after they are added
+    assert "Newland" not in client.get("/").text
+    client.post("/data", json=data_point("Newland", 2000, 1.0))
+    assert "Newland" in client.get("/").text
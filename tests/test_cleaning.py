@@ -0,0 +1,86 @@
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select
+
+# The cleaning pipeline is a script in data/, next to the raw files
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+import check_clean_airpollution as cleaning
+from load_data import COLUMNS, load_frames
+from models import AirPollutionData, EntitySketch, EntityStatistics
+
+HEADER = list(COLUMNS)
+
+
+def raw_frame(rows):
+    # Raw rows with the column names of the downloaded file and its empty last column
+    frame = pd.DataFrame(rows, columns=HEADER)
+    frame[""] = np.nan
+    return frame
+
+
+def write_raw(path, rows):
+    raw_frame(rows).to_csv(path, index=False)
+    return str(path)
+
+
+def test_clean_chunk_fills_codes_and_validates():
+    report = Counter()
+    cleaned = cleaning.clean_chunk(raw_frame([
+        ["World", None, 2000, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+        ["Germany", "DEU", 2000, -1.0, "n/a", np.inf, 4.0, 5.0, 6.0, None],
+        ["Atlantis", None, 2000, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+        ["Germany", "DEU", 1600, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+        ["Germany", "DEU", "2001.5", 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+        [" ", "XXX", 2000, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0],
+    ]), report)
+
+    assert list(cleaned.columns) == list(COLUMNS.values())
+    assert cleaned[["entity", "code", "year"]].values.tolist() == [["World", "WORLD", 2000], ["Germany", "DEU", 2000]]
+    assert cleaned["year"].dtype == np.int64 and cleaned["sulphur_dioxide"].dtype == float
+    assert cleaned.iloc[1, 3:6].isna().all() and cleaned.iloc[1]["organic_carbon"] == 4.0
+    assert report == Counter(rows_read=6, codes_filled=1, invalid_values=3, dropped_no_entity=1,
+                             dropped_invalid_year=2, dropped_no_code=1)
+
+
+def test_clean_files_in_chunks_and_in_parallel(tmp_path):
+    first = write_raw(tmp_path / "first.csv", [["Asia", None, year, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0] for year in range(2000, 2010)])
+    second = write_raw(tmp_path / "second.csv", [["Asia", None, year, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0] for year in range(2005, 2015)])
+
+    for workers in (1, 2):
+        report = Counter()
+        cleaned = pd.concat(cleaning.clean([first, second], chunksize=3, workers=workers, report=report))
+        # Duplicates of (entity, year) are dropped across chunks and files, the first row is kept
+        assert cleaned["year"].tolist() == list(range(2000, 2015))
+        assert cleaned["ammonia"].tolist() == [1.0] * 10 + [2.0] * 5
+        assert report["duplicates"] == 5 and report["codes_filled"] == 20
+
+    # A worker passes its cleaned chunks back through a part file, which is removed once it was read
+    part, report = cleaning.clean_file(first, chunksize=3, directory=str(tmp_path))
+    assert [len(frame) for frame in cleaning.read_part(part)] == [3, 3, 3, 1]
+    assert report["rows_read"] == 10 and not os.path.exists(part)
+
+
+def test_cleaned_data_goes_to_parquet_or_database(tmp_path):
+    raw = write_raw(tmp_path / "raw.csv", [["Europe", None, year, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, float(year)] for year in range(1990, 2000)])
+    pytest.importorskip("pyarrow")
+    assert cleaning.write_parquet(cleaning.clean([raw], chunksize=4), str(tmp_path / "cleaned.parquet")) == 10
+    assert pd.read_parquet(tmp_path / "cleaned.parquet")["code"].unique().tolist() == ["EUROPE"]
+
+    engine = create_engine("sqlite://")
+    assert load_frames(cleaning.clean([raw], chunksize=4), bind=engine) == 10
+    with engine.connect() as connection:
+        assert connection.execute(select(func.sum(AirPollutionData.ammonia))).scalar() == sum(range(1990, 2000))
+        assert connection.execute(select(func.count()).select_from(EntitySketch)).scalar() == 7
+        # The summary is rebuilt by the load, not left empty for the app to rebuild
+        assert connection.execute(select(EntityStatistics.count).where(EntityStatistics.parameter == "ammonia")).scalar() == 10
+
+    # Appending updates the summary of the loaded entities
+    later = write_raw(tmp_path / "later.csv", [["Europe", None, year, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 1.0] for year in range(2000, 2005)])
+    load_frames(cleaning.clean([later]), mode="append", bind=engine)
+    with engine.connect() as connection:
+        assert connection.execute(select(EntityStatistics.count).where(EntityStatistics.parameter == "ammonia")).scalar() == 15
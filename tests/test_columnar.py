@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import app.main as main
+from app.columnar import ColumnarStore
+from app.stats import PARAMETERS, get_entity_stats, get_grouped_stats
+
+
+def data(entity, year, factor):
+    return {"entity": entity, "year": year, **{param: factor * (i + 1) for i, param in enumerate(PARAMETERS)}}
+
+
+@pytest.fixture
+def with_factors(client):
+    for year, factor in [(2000, 1.0), (2001, 3.0), (2002, 2.5), (2003, 8.0)]:
+        client.post("/data", json=data("Testland", year, factor))
+    client.post("/data", json=data("Otherland", 1990, 5.0))
+    return client
+
+
+def assert_stats_equal(actual, expected):
+    for param in PARAMETERS:
+        for key in ("mean", "median", "stddev"):
+            assert actual[param][key] == pytest.approx(expected[param][key])
+
+
+def assert_json_close(actual, expected):
+    # Equal up to rounding: the store computes all statistics from the values, the database paths partly from sums
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected)
+        for key in expected:
+            assert_json_close(actual[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected)
+        for item, expected_item in zip(actual, expected):
+            assert_json_close(item, expected_item)
+    elif isinstance(expected, float):
+        assert actual == pytest.approx(expected)
+    else:
+        assert actual == expected
+
+
+def test_store_matches_database(tmp_path, engine, with_factors):
+    store = ColumnarStore(str(tmp_path / "columns.bin"))
+    with sessionmaker(bind=engine)() as db:
+        assert store.entities(db) == ["Otherland", "Testland"]
+        for start_year, end_year in [(None, None), (2001, 2002), (2002, None), (1800, 1900)]:
+            rows, stats = store.stats(db, "Testland", start_year, end_year)
+            assert rows == len([year for year in range(2000, 2004) if (start_year or 0) <= year <= (end_year or 9999)])
+            assert_stats_equal(stats, get_entity_stats(db, "Testland", start_year, end_year))
+        grouped, expected = store.grouped_stats(db, ["Testland", "Nowhere"], 2001), get_grouped_stats(db, ["Testland", "Nowhere"], 2001)
+        assert list(grouped) == list(expected) == ["Testland"]
+        assert_stats_equal(grouped["Testland"], expected["Testland"])
+        assert list(store.grouped_stats(db)) == ["Otherland", "Testland"]
+
+
+def test_snapshot_is_mapped_and_refreshed_after_writes(tmp_path, engine, with_factors):
+    path = str(tmp_path / "columns.bin")
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        ColumnarStore(path).columns(db)
+
+        # A new store maps the snapshot instead of querying the data points
+        store = ColumnarStore(path)
+        assert isinstance(store.columns(db).values, np.memmap)
+        years, values = store.slice(db, "Testland")
+        assert years.tolist() == [2000, 2001, 2002, 2003] and values.shape == (4, len(PARAMETERS))
+
+    # Writes are spliced into the columns by the next read
+    with_factors.delete("/data/Otherland/1990")
+    with_factors.put("/data/Testland/2001", json=data("Testland", 2001, 4.0))
+    with_factors.post("/data", json=data("Newland", 2010, 1.0))
+    for entity in ("Otherland", "Testland", "Newland"):
+        store.changed(entity)
+    with Session() as db:
+        assert store.entities(db) == ["Newland", "Testland"]
+        assert_stats_equal(store.stats(db, "Testland")[1], get_entity_stats(db, "Testland"))
+
+        # The snapshot is outdated after the writes, a new store (e.g. after a restart) rebuilds it
+        restarted = ColumnarStore(path)
+        assert restarted.entities(db) == ["Newland", "Testland"]
+        assert ColumnarStore(path).read_snapshot().fingerprint == restarted.columns(db).fingerprint
+
+    # An update keeps the number of data points and their ids, the data version still tells the snapshot is outdated,
+    # both to another process reloading its store and after a restart
+    with_factors.put("/data/Testland/2002", json=data("Testland", 2002, 9.0))
+    restarted.reload()
+    with Session() as db:
+        assert restarted.stats(db, "Testland", 2002, 2002)[1]["ammonia"]["mean"] == 9.0 * 7
+        with_factors.put("/data/Testland/2002", json=data("Testland", 2002, 10.0))
+        assert ColumnarStore(path).stats(db, "Testland", 2002, 2002)[1]["ammonia"]["mean"] == 10.0 * 7
+
+
+def test_api_answers_from_store(tmp_path, with_factors, monkeypatch):
+    paths = ["/api/stats/Testland", "/api/stats/Testland?start_year=2001&end_year=2003", "/api/stats?sort=ammonia.mean",
+             "/api/stats?entity=Testland&start_year=2002", "/api/trend/Testland?window=2"]
+    expected = [with_factors.get(path).json() for path in paths]
+
+    monkeypatch.setattr(main, "columnar_store", ColumnarStore(str(tmp_path / "columns.bin")))
+    main.response_cache.clear()
+    for path, content in zip(paths, expected):
+        assert_json_close(with_factors.get(path).json(), content)
+    assert "Otherland" in with_factors.get("/").text
+
+    # Writes through the API refresh the store
+    with_factors.put("/data/Testland/2003", json=data("Testland", 2003, 1.0))
+    assert with_factors.get("/api/stats/Testland?start_year=2003&end_year=2003").json()["stats"]["ammonia"]["mean"] == 7.0
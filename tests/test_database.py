@@ -0,0 +1,74 @@
+import multiprocessing
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import app.main as main
+import app.summary as summary
+from app.setup_database.database import create_db_engine
+from tests.conftest import data_point
+
+
+def test_sqlite_connections_are_tuned(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = create_db_engine(url, pool_size=1, max_overflow=0)
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert connection.execute(text("PRAGMA cache_size")).scalar() == -65536
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    assert engine.pool.size() == 1
+
+
+def test_writer_commits_while_a_reader_streams(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = create_db_engine(url)
+    read_engine = create_db_engine(url, readonly=True)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE data (value INTEGER)"))
+        connection.execute(text("INSERT INTO data VALUES (1), (2), (3)"))
+
+    with read_engine.connect() as reader:
+        # Read connections refuse to write
+        with pytest.raises(OperationalError):
+            reader.execute(text("INSERT INTO data VALUES (4)"))
+
+        # With WAL a commit does not wait for a reader in the middle of a result
+        result = reader.execute(text("SELECT value FROM data"))
+        assert result.fetchone() == (1,)
+        with engine.begin() as connection:
+            connection.execute(text("INSERT INTO data VALUES (4)"))
+        assert result.fetchall() == [(2,), (3,)]
+
+
+def post_data_points(url, years):
+    # One worker process: the app with its own writer engine on the shared database file
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=create_db_engine(url, pool_size=1, max_overflow=0))
+
+    def get_worker_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_worker_db
+    client = TestClient(main.app)
+    return [client.post("/data", json=data_point("Raceland", year, 1.0)).status_code for year in years]
+
+
+def test_writes_are_serialized_across_processes(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    main.Base.metadata.create_all(bind=create_db_engine(url))
+
+    # Two processes add data points of the same new entity at the same time, both create and update its summary
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        statuses = pool.starmap(post_data_points, [(url, range(1800, 1900)), (url, range(1900, 2000))])
+    assert set(statuses[0] + statuses[1]) == {200}
+
+    with sessionmaker(bind=create_db_engine(url, readonly=True))() as db:
+        assert db.query(main.AirPollutionData).count() == 200
+        assert {row.count for row in db.query(summary.EntityStatistics).filter_by(entity="Raceland")} == {200}
@@ -0,0 +1,61 @@
+import csv
+import gzip
+import io
+import json
+
+import httpx
+import pytest
+from sqlalchemy.orm import Session
+
+import app.main as main
+from app.export import COLUMNS, export_query, iter_chunks
+from tests.conftest import data_point
+
+
+@pytest.fixture
+def with_codes(engine, client):
+    # The write endpoints do not set the code, the data points are added to the database directly
+    with Session(engine) as db:
+        db.add_all([main.AirPollutionData(**data_point(entity, year, float(year)), code=code)
+                    for entity, code in (("Testland", "TST"), ("Otherland", "OTH")) for year in range(2000, 2005)])
+        db.commit()
+    return client
+
+
+def test_export_csv_with_filters(with_codes):
+    client = with_codes
+    response = client.get("/api/export", params={"entity": "Testland", "start_year": 2001, "end_year": 2003})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert list(rows[0]) == COLUMNS
+    assert [(row["entity"], row["code"], row["year"], row["ammonia"]) for row in rows] == [
+        ("Testland", "TST", "2001", "2001.0"), ("Testland", "TST", "2002", "2002.0"), ("Testland", "TST", "2003", "2003.0")]
+
+    # Filter by code, all years
+    response = client.get("/api/export", params={"code": "OTH"})
+    assert [row["year"] for row in csv.DictReader(io.StringIO(response.text))] == [str(year) for year in range(2000, 2005)]
+
+
+def test_export_ndjson_compressed(with_codes):
+    client = with_codes
+    response = client.get("/api/export", params={"format": "ndjson"}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row["entity"], row["year"]) for row in rows] == [(entity, year) for entity in ("Otherland", "Testland") for year in range(2000, 2005)]
+    assert rows[0]["nmvoc"] == 2000.0
+
+    # The raw body is one gzip stream
+    with httpx.Client(transport=client._transport, base_url="http://testserver") as http:
+        with http.stream("GET", "/api/export", params={"format": "ndjson"}, headers={"Accept-Encoding": "gzip"}) as raw:
+            assert gzip.decompress(b"".join(raw.iter_raw())).decode() == response.text
+
+    # Without gzip in Accept-Encoding the stream is not compressed
+    response = client.get("/api/export", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert client.get("/api/export", params={"format": "xml"}).status_code == 400
+
+
+def test_export_reads_in_chunks(engine, with_codes):
+    chunks = list(iter_chunks(engine, export_query(entities=["Testland"]), chunk_size=2))
+    assert [len(rows) for rows in chunks] == [2, 2, 1]
@@ -0,0 +1,60 @@
+import logging
+import random
+import threading
+import time
+
+from app.logging_setup import PayloadSampler, file_handler, queue_logging
+
+
+class SlowHandler(logging.Handler):
+    # Handler taking as long as a slow disk
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.thread = None
+
+    def emit(self, record):
+        time.sleep(0.05)
+        self.thread = threading.current_thread()
+        self.messages.append(record.getMessage())
+
+
+def test_records_are_written_by_the_listener_thread():
+    logger = logging.getLogger("test_queue_logging")
+    logger.propagate = False
+    handler = SlowHandler()
+    listener = queue_logging(logger, handler)
+    try:
+        start = time.perf_counter()
+        for i in range(10):
+            logger.warning("message %d", i)
+        # Logging does not wait for the handler
+        assert time.perf_counter() - start < 0.05
+    finally:
+        listener.stop()
+        logger.handlers.clear()
+
+    # Stopping the listener writes the queued records
+    assert handler.messages == [f"message {i}" for i in range(10)]
+    assert handler.thread is not threading.current_thread()
+
+
+def test_file_handler_rotates_at_max_bytes(tmp_path):
+    logger = logging.getLogger("test_file_logging")
+    logger.propagate = False
+    listener = queue_logging(logger, file_handler(str(tmp_path / "app.log"), max_bytes=1000, backup_count=2))
+    try:
+        for i in range(100):
+            logger.warning("message %d", i)
+    finally:
+        listener.stop()
+        logger.handlers.clear()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["app.log", "app.log.1", "app.log.2"]
+    assert "message 99" in (tmp_path / "app.log").read_text()
+
+
+def test_payload_sampling():
+    assert not any(PayloadSampler(0)() for _ in range(100))
+    assert all(PayloadSampler(1)() for _ in range(100))
+    sampler = PayloadSampler(0.1, random.Random(1))
+    assert 50 < sum(sampler() for _ in range(1000)) < 150
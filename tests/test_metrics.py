@@ -0,0 +1,53 @@
+import logging
+import re
+
+import pytest
+
+import app.main as main
+from app.metrics import Histogram
+from tests.conftest import data_point
+
+
+def sample(text, name, **labels):
+    # Value of one sample of the metrics page
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf"^{re.escape(name)}{{{re.escape(label_text)}}} (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Test.", ("route",), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(("/",), value)
+    text = "\n".join(histogram.samples())
+    assert [sample(text, "test_seconds_bucket", route="/", le=le) for le in ("0.1", "1.0", "+Inf")] == [1, 3, 4]
+    assert sample(text, "test_seconds_sum", route="/") == 6.05
+    assert sample(text, "test_seconds_count", route="/") == 4
+
+
+def test_metrics_endpoint(client):
+    client.post("/data/batch", json=[data_point("Testland", 2000, 1.0), data_point("Testland", 2001, 2.0)])
+    before = client.get("/metrics").text
+    count = sample(before, "http_request_duration_seconds_count", method="GET", route="/data/{entity}/all/stats", status="200") or 0
+    queries = sample(before, "http_request_sql_queries_sum", method="GET", route="/data/{entity}/all/stats") or 0
+    hits = sample(before, "cache_hits_total", cache="response")
+
+    # The second request is answered from the response cache without SQL queries
+    client.get("/data/Testland/all/stats")
+    client.get("/data/Testland/all/stats")
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert sample(text, "http_request_duration_seconds_count", method="GET", route="/data/{entity}/all/stats", status="200") == count + 2
+    assert sample(text, "http_request_sql_queries_sum", method="GET", route="/data/{entity}/all/stats") == queries + 1
+    assert sample(text, "cache_hits_total", cache="response") == hits + 1
+    assert sample(text, "sql_query_duration_seconds_count", route="/data/batch") >= 1
+
+
+def test_slow_request_log(client, caplog, monkeypatch):
+    monkeypatch.setattr(main.metrics, "slow_request_ms", 0)
+    with caplog.at_level(logging.WARNING, logger=main.logger.name):
+        client.get("/api/stats/Nowhere")
+    message = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Slow request")][-1]
+    assert "GET /api/stats/Nowhere (/api/stats/{entity}): status 404" in message
+    assert "1 SQL queries" in message and "FROM entity_statistics" in message
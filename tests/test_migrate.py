@@ -0,0 +1,36 @@
+from sqlalchemy import create_engine, func, select, text
+
+from app.setup_database.migrate import migrate
+from app.setup_database.models import AirPollutionData, Base, EntitySketch, EntityStatistics
+from tests.conftest import data_point
+
+
+def old_database(tmp_path):
+    # Database from before the unique (entity, year) index, with a duplicate data point and its summary and sketch
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_air_pollution_data_entity_year"))
+        connection.execute(AirPollutionData.__table__.insert(), [data_point("Testland", 2000, 1.0), data_point("Testland", 2000, 2.0)])
+        connection.execute(EntityStatistics.__table__.insert(), [{"entity": "Testland", "parameter": "ammonia", "count": 2,
+                                                                       "sorted_values": "[1.0, 2.0]"}])
+        connection.execute(EntitySketch.__table__.insert(), [{"entity": "Testland", "parameter": "ammonia", "sketch": "{}"}])
+    return engine
+
+
+def test_dedupe_clears_summary_and_sketches(tmp_path):
+    engine = old_database(tmp_path)
+    assert not migrate(bind=engine)
+    assert migrate(dedupe=True, bind=engine)
+    with engine.connect() as connection:
+        assert connection.execute(select(AirPollutionData.ammonia)).scalars().all() == [2.0]
+        for model in (EntityStatistics, EntitySketch):
+            assert connection.execute(select(func.count()).select_from(model)).scalar() == 0
+
+
+def test_dedupe_without_summary_tables(tmp_path):
+    engine = old_database(tmp_path)
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE entity_statistics"))
+        connection.execute(text("DROP TABLE entity_sketches"))
+    assert migrate(dedupe=True, bind=engine)
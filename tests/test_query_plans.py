@@ -0,0 +1,76 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import app.main as main
+
+
+@pytest.fixture
+def recorded():
+    # Run the app against an in-memory database and record every statement it executes
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    main.Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    statements = []
+
+    def get_test_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and "air_pollution_data" in statement and not statement.lstrip().upper().startswith("EXPLAIN"):
+            statements.append((statement, parameters))
+
+    main.app.dependency_overrides[main.get_db] = get_test_db
+    main.app.dependency_overrides[main.get_read_db] = get_test_db
+    main.range_index.clear()
+    main.response_cache.clear()
+    client = TestClient(main.app)
+    client.post("/data/batch", json=[{"entity": entity, "year": year, **{param: float(year) for param in main.PARAMETERS}}
+                                     for entity in ("Testland", "Otherland") for year in range(1990, 2010)])
+
+    # Exercise every endpoint filtering on entity and year
+    event.listen(engine, "before_cursor_execute", record)
+    data_point = {"entity": "Testland", "year": 2000, **{param: 1.0 for param in main.PARAMETERS}}
+    client.get("/data/Testland/1995/2005/stats")
+    client.get("/data/Testland/all/stats")
+    client.get("/api/stats", params={"entity": ["Testland", "Otherland"], "start_year": 1995, "sort": "ammonia.mean"})
+    client.put("/data/Testland/2000", json=data_point)
+    client.delete("/data/Testland/2001")
+    client.post("/data/batch", json=[data_point, dict(data_point, year=2020)])
+    client.post("/data/batch/delete", json=[{"entity": "Testland", "year": 2002}])
+    event.remove(engine, "before_cursor_execute", record)
+
+    yield engine, statements
+    main.app.dependency_overrides.clear()
+    main.range_index.clear()
+    main.response_cache.clear()
+
+
+def test_hot_queries_use_indexes(recorded):
+    engine, statements = recorded
+    queries = [(statement, parameters) for statement, parameters in statements if not statement.lstrip().upper().startswith("INSERT")]
+    assert len(queries) >= 6
+
+    with engine.connect() as connection:
+        for statement, parameters in queries:
+            plan = [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            # A plan line "SCAN air_pollution_data" without an index means a full table scan
+            scans = [line for line in plan if line.startswith("SCAN air_pollution_data")]
+            assert not scans, f"Full scan in query plan {plan} of:\n{statement}"
+
+            # Filters on entity (and year) must go through the composite index
+            if "air_pollution_data.entity = ?" in statement:
+                assert any("ix_air_pollution_data_entity_year" in line for line in plan), f"Composite index not used in {plan} of:\n{statement}"
+
+
+def test_entity_year_is_unique(recorded):
+    client = TestClient(main.app)
+    data_point = {"entity": "Otherland", "year": 1990, **{param: 1.0 for param in main.PARAMETERS}}
+    assert client.post("/data", json=data_point).status_code == 409
+    assert client.put("/data/Otherland/1991", json=data_point).status_code == 409
+    assert client.put("/data/Otherland/1800", json=data_point).status_code == 404
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import app.range_index as range_index
+from app.stats import PARAMETERS, compute_stats
+
+
+# Define a year-ordered series with large values early on and nearly constant small values later,
+# the case where subtracting cumulative floating point sums would lose all precision
+years = np.arange(1750, 2023)
+rng = np.random.default_rng(0)
+values = np.column_stack([rng.uniform(0, 1e9, len(years)) for _ in PARAMETERS])
+values[-20:] = 0.001 + rng.uniform(0, 1e-9, (20, len(PARAMETERS)))
+
+
+@pytest.mark.parametrize("start_year, end_year", [(1750, 2022), (1800, 1850), (2003, 2022), (2010, 2012), (1700, 1760)])
+def test_entity_index_matches_stats_engine(start_year, end_year):
+    # Shuffle the rows, the index must sort them by year itself
+    order = rng.permutation(len(years))
+    index = range_index.EntityIndex(years[order], values[order])
+
+    selected = (years >= start_year) & (years <= end_year)
+    expected = compute_stats(values[selected])
+    rows, actual = index.stats(start_year, end_year)
+    assert rows == selected.sum()
+    for param in PARAMETERS:
+        for key in ("mean", "median", "stddev"):
+            assert actual[param][key] == pytest.approx(expected[param][key], rel=1e-12)
+
+
+def test_entity_index_empty_and_single_year():
+    index = range_index.EntityIndex(years, values)
+    assert index.stats(1600, 1700) == (0, {param: {"mean": None, "median": None, "stddev": None} for param in PARAMETERS})
+
+    rows, stats = index.stats(1900, 1900)
+    assert rows == 1
+    assert stats["ammonia"] == {"mean": values[150, -1], "median": values[150, -1], "stddev": None}
+
+
+def test_range_index_is_invalidated_by_writes():
+    # Create an in-memory database with two data points
+    engine = create_engine("sqlite://")
+    range_index.AirPollutionData.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    for year in (2000, 2001):
+        db.add(range_index.AirPollutionData(entity="Testland", code="TST", year=year, **{param: float(year - 1999) for param in PARAMETERS}))
+    db.commit()
+
+    index = range_index.RangeIndex()
+    assert index.stats(db, "Testland", 2000, 2010)[1]["nmvoc"]["mean"] == 1.5
+
+    # Without invalidation the index keeps answering from the old data
+    db.add(range_index.AirPollutionData(entity="Testland", code="TST", year=2002, **{param: 6.0 for param in PARAMETERS}))
+    db.commit()
+    assert index.stats(db, "Testland", 2000, 2010)[0] == 2
+
+    index.invalidate("Testland")
+    rows, stats = index.stats(db, "Testland", 2000, 2010)
+    assert rows == 3
+    assert stats["nmvoc"] == {"mean": 3.0, "median": 2.0, "stddev": pytest.approx(np.std([1.0, 2.0, 6.0], ddof=1))}
+    db.close()
@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import app.main as main
+from app.shared_state import SharedGenerations, SharedState, entity_slot
+from app.stats import PARAMETERS
+from app.summary import get_summary_stats, rebuild_summary
+
+DATA = {"entity": "Testland", "year": 2000, **{param: 1.0 for param in PARAMETERS}}
+
+
+def test_generations_are_shared_between_mappings(tmp_path):
+    # Two mappings of the same file behave like two workers
+    first = SharedGenerations(str(tmp_path / "generations.bin"))
+    second = SharedGenerations(str(tmp_path / "generations.bin"))
+    assert first.bump("Testland") == 1
+    assert second.total() == 1
+    assert second.generation("Testland") == 1
+    assert second.generation(None) == 1
+    assert entity_slot("Testland") == entity_slot("Testland") != entity_slot(None)
+    first.close()
+    second.close()
+
+
+def test_snapshot_is_built_once_and_dropped_on_writes(tmp_path, engine, client):
+    client.post("/data", json=DATA)
+    client.post("/data", json={**DATA, "year": 2001, "ammonia": 3.0})
+    client.post("/data", json={**DATA, "entity": "Otherland"})
+    Session = sessionmaker(bind=engine)
+
+    # The first worker builds the snapshot, the second one maps it
+    first, second = SharedState(str(tmp_path)), SharedState(str(tmp_path))
+    first.open(Session)
+    second.open(lambda: pytest.fail("the snapshot is built only once"))
+    with Session() as db:
+        expected = get_summary_stats(db, "Testland")
+    for param in PARAMETERS:
+        for statistic in ("mean", "median", "stddev"):
+            assert second.stats("Testland")[param][statistic] == pytest.approx(expected[param][statistic])
+    assert second.stats("Otherland")["ammonia"]["stddev"] is None
+    assert second.stats("Nowhere") is None
+    assert sorted(second.all_stats()) == ["Otherland", "Testland"]
+    assert list(second.all_stats(["Otherland", "Nowhere"])) == ["Otherland"]
+
+    # A write of the first worker makes the snapshot of the entity and of all entities outdated in both workers
+    first.changed("Testland")
+    assert not second.current("Testland") and not first.current("Testland")
+    assert second.current("Otherland") and second.all_stats(["Otherland"]) is not None
+    assert second.all_stats() is None
+    assert not first.changed_elsewhere()
+    assert second.changed_elsewhere()
+    assert not second.changed_elsewhere()
+
+
+def test_writes_of_other_workers_drop_local_caches(tmp_path, engine, client, monkeypatch):
+    client.post("/data", json=DATA)
+    state = SharedState(str(tmp_path))
+    state.open(sessionmaker(bind=engine))
+    other = SharedState(str(tmp_path))
+    other.open(sessionmaker(bind=engine))
+    monkeypatch.setattr(main, "shared_state", state)
+
+    # Served from the snapshot and cached
+    assert client.get("/api/stats/Testland").json()["stats"]["ammonia"]["mean"] == 1.0
+    assert len(main.response_cache) == 1
+
+    # Another worker changes the entity: this worker drops its cache and reads the summary table
+    with sessionmaker(bind=engine)() as db:
+        db.query(main.AirPollutionData).filter_by(entity="Testland").update({"ammonia": 5.0})
+        db.commit()
+        rebuild_summary(db)
+    other.changed("Testland")
+    assert client.get("/api/stats/Testland").json()["stats"]["ammonia"]["mean"] == 5.0
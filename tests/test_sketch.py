@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.sketch import QUANTILES, RANK_ERROR, QuantileSketch
+
+FRACTIONS = [i / 100 for i in range(1, 100)]
+
+
+def rank_errors(sketch, values):
+    # Largest distance between the requested and the actual rank of the returned values, as a fraction of the values
+    values = np.sort(values)
+    return max(abs(np.searchsorted(values, value, side="right") / len(values) - fraction)
+               for fraction, value in zip(FRACTIONS, sketch.quantiles(FRACTIONS)))
+
+
+def test_small_sketches_are_exact():
+    values = [5.0, 1.0, 4.0, 2.0, 3.0]
+    sketch = QuantileSketch()
+    sketch.update(values)
+    assert sketch.quantiles(QUANTILES.values()) == [3.0, 5.0, 5.0]
+    assert sketch.quantiles([0.2, 0.4]) == [1.0, 2.0]
+    assert QuantileSketch().quantiles([0.5]) == [None]
+
+
+def test_rank_error_is_bounded():
+    values = np.random.default_rng(1).lognormal(10, 3, 100_000)
+    sketch = QuantileSketch(rng=random.Random(1))
+    sketch.update(values.tolist())
+    assert sketch.n == len(values)
+    # The sketch keeps a few hundred values instead of 100000
+    assert sum(len(level) for level in sketch.levels) < 1000
+    assert rank_errors(sketch, values) <= RANK_ERROR
+
+
+def test_merged_sketches_and_json_roundtrip():
+    values = np.random.default_rng(2).normal(0, 1, 50_000)
+    sketches = [QuantileSketch(rng=random.Random(i)) for i in range(5)]
+    for sketch, part in zip(sketches, np.array_split(values, 5)):
+        sketch.update(part.tolist())
+
+    merged = QuantileSketch.from_json(sketches[0].to_json())
+    for sketch in sketches[1:]:
+        merged.merge(QuantileSketch.from_json(sketch.to_json()))
+    assert merged.n == len(values)
+    assert rank_errors(merged, values) <= RANK_ERROR
+    assert QuantileSketch.from_json(merged.to_json()).quantiles(FRACTIONS) == merged.quantiles(FRACTIONS)
@@ -0,0 +1,70 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.main as main
+from app.setup_database.schema import create_schema, missing_tables
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import time of the modules of the app in milliseconds, measured at about 120 ms. FastAPI, SQLAlchemy and NumPy are
+# imported before, their import time (about 0.8 s) depends on the installed versions and is not part of the budget.
+IMPORT_TIME_BUDGET_MS = float(os.environ.get("IMPORT_TIME_BUDGET_MS", "300"))
+
+# Modules which must not be imported with the app, they are only needed by scripts, optional formats or several workers
+# (shared_state, which uses the POSIX-only fcntl)
+LAZY_MODULES = ["pandas", "pyarrow", "uvicorn", "shared_state"]
+
+
+def test_import_time_budget(tmp_path):
+    database = tmp_path / "startup.db"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, "src"), os.path.join(ROOT, "src", "app")]),
+               DATABASE_URL=f"sqlite:///{database}")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import fastapi, fastapi.responses, sqlalchemy.orm, numpy, pydantic, starlette.concurrency; import app.main"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+    # Lines of -X importtime: "import time: <self us> | <cumulative us> | <indented module name>"
+    imports = {match.group(2).strip(): int(match.group(1))
+               for match in re.finditer(r"^import time:\s+\d+ \|\s+(\d+) \| (.+)$", result.stderr, re.MULTILINE)}
+    assert imports["app.main"] / 1000 <= IMPORT_TIME_BUDGET_MS
+    assert not [name for name in imports if name.split(".")[0] in LAZY_MODULES]
+
+    # Importing the app does not touch the database
+    assert not database.exists()
+
+
+@pytest.fixture
+def startup_engine(monkeypatch):
+    # Empty in-memory database used by the startup of the app
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    monkeypatch.setattr(main, "engine", engine)
+    monkeypatch.setattr(main, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    return engine
+
+
+def test_startup_requires_schema(startup_engine):
+    assert missing_tables(startup_engine) == list(main.Base.metadata.tables)
+    with pytest.raises(RuntimeError, match="schema.py"):
+        with TestClient(main.app):
+            pass
+
+
+def test_startup_builds_missing_summary(startup_engine):
+    create_schema(startup_engine)
+    with startup_engine.begin() as connection:
+        connection.execute(main.AirPollutionData.__table__.insert(), [
+            {"entity": "Testland", "year": 2000, **{param: 2.0 for param in main.PARAMETERS}}
+        ])
+    with TestClient(main.app):
+        with main.SessionLocal() as db:
+            assert main.get_summary_stats(db, "Testland")["ammonia"] == {"mean": 2.0, "median": 2.0, "stddev": None}
@@ -0,0 +1,78 @@
+import statistics
+
+import numpy as np
+import pytest
+from app.stats import PARAMETERS, compute_stats, compute_grouped_stats, rolling_stats
+
+
+# Define a matrix with one column per parameter, the last parameter contains a missing value
+values = np.array([
+    [1.0, 10.0, 3.5, 7.0, 0.5, 2.0, 4.0],
+    [2.0, 20.0, 1.5, 8.0, 0.25, 6.0, np.nan],
+    [4.0, 40.0, 2.5, 9.0, 0.75, 4.0, 8.0],
+    [8.0, 30.0, 9.5, 1.0, 0.5, 8.0, 2.0],
+])
+
+
+@pytest.mark.parametrize("index, param", list(enumerate(PARAMETERS)))
+def test_compute_stats_matches_statistics_module(index, param):
+    column = [v for v in values[:, index] if not np.isnan(v)]
+    stats = compute_stats(values)
+    assert stats[param]["mean"] == pytest.approx(statistics.mean(column))
+    assert stats[param]["median"] == pytest.approx(statistics.median(column))
+    assert stats[param]["stddev"] == pytest.approx(statistics.stdev(column))
+
+
+def test_compute_stats_undefined_values_are_none():
+    # No rows at all: nothing can be calculated
+    empty = compute_stats(np.empty((0, len(PARAMETERS))))
+    assert all(value is None for stats in empty.values() for value in stats.values())
+
+    # A single row: mean and median are defined, the sample standard deviation is not
+    single = compute_stats(values[:1])
+    assert single["nitrogen_oxide"] == {"mean": 1.0, "median": 1.0, "stddev": None}
+
+
+def test_compute_grouped_stats_matches_compute_stats():
+    # Three groups of rows: all rows, a single row and the rows with a missing value
+    grouped = np.vstack([values, values[:1], values[1:3]])
+    starts = np.array([0, 4, 5])
+    means, medians, stddevs = compute_grouped_stats(starts, grouped)
+    for g, (start, end) in enumerate([(0, 4), (4, 5), (5, 7)]):
+        expected = compute_stats(grouped[start:end])
+        for i, param in enumerate(PARAMETERS):
+            for name, result in (("mean", means), ("median", medians), ("stddev", stddevs)):
+                value = None if np.isnan(result[g, i]) else result[g, i]
+                assert value == pytest.approx(expected[param][name])
+
+
+def test_rolling_stats_match_compute_stats():
+    # Years with a gap (2003 is missing), windows of three years every two years
+    years = np.array([2000, 2001, 2002, 2004, 2005, 2006])
+    rows = np.vstack([values, values[:2]])
+    starts, means, medians, stddevs, deltas = rolling_stats(years, rows, window=3, step=2)
+    assert starts.tolist() == [2000, 2002, 2004]
+    for w, start in enumerate(starts):
+        expected = compute_stats(rows[(years >= start) & (years < start + 3)])
+        for i, param in enumerate(PARAMETERS):
+            assert means[w, i] == pytest.approx(expected[param]["mean"])
+            assert medians[w, i] == pytest.approx(expected[param]["median"])
+            assert (None if np.isnan(stddevs[w, i]) else stddevs[w, i]) == pytest.approx(expected[param]["stddev"])
+    assert np.isnan(deltas[0]).all()
+    assert deltas[1:] == pytest.approx(means[1:] - means[:-1])
+
+    # Windows of one year every year give the year-over-year deltas, years without data are NaN
+    starts, means, _, _, deltas = rolling_stats(years, rows, window=1, start_year=2001, end_year=2004)
+    assert starts.tolist() == [2001, 2002, 2003, 2004]
+    assert deltas[1, 0] == rows[2, 0] - rows[1, 0]
+    assert np.isnan(means[2]).all() and np.isnan(deltas[2:, 0]).all()
+    assert rolling_stats(years, rows, window=10)[0].size == 0
+
+    # Ranges beyond the data are clamped to its years instead of allocating a grid for every year of the range
+    starts = rolling_stats(years, rows, window=3, start_year=-2000000, end_year=10 ** 9)[0]
+    assert starts.tolist() == [2000, 2001, 2002, 2003, 2004]
+    assert rolling_stats(years, rows, window=1000, start_year=-2000000)[0].size == 0
+
+    # The windows are gathered from the rows, a single year far away only adds empty windows
+    starts, means, _, _, _ = rolling_stats(np.r_[years, 3000], np.vstack([rows, rows[:1]]), window=3, step=100)
+    assert starts.tolist() == list(range(2000, 2999, 100)) and np.isnan(means[1:]).all()
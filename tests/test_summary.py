@@ -0,0 +1,99 @@
+import statistics
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import app.summary as summary
+from app.stats import PARAMETERS, compute_stats, fetch_values
+
+
+@pytest.fixture
+def db():
+    # Create an in-memory database with a few data points of two entities
+    engine = create_engine("sqlite://")
+    summary.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    for year, factor in [(2000, 1.0), (2001, 3.0), (2002, 2.5), (2003, 8.0)]:
+        session.add(summary.AirPollutionData(entity="Testland", code="TST", year=year, **{param: factor * (i + 1) for i, param in enumerate(PARAMETERS)}))
+    session.add(summary.AirPollutionData(entity="Otherland", code="OTH", year=2000, **{param: 5.0 for param in PARAMETERS}))
+    session.commit()
+    yield session
+    session.close()
+
+
+def assert_summary_matches_data(db, entity):
+    # The precomputed statistics must equal the statistics computed from the raw rows
+    expected = compute_stats(fetch_values(db, entity))
+    actual = summary.get_summary_stats(db, entity)
+    for param in PARAMETERS:
+        for key in ("mean", "median", "stddev"):
+            assert actual[param][key] == pytest.approx(expected[param][key])
+
+
+def test_rebuild_summary(db):
+    assert summary.rebuild_summary(db) == 2
+    assert_summary_matches_data(db, "Testland")
+    assert_summary_matches_data(db, "Otherland")
+
+
+def test_summary_is_maintained_incrementally(db):
+    summary.rebuild_summary(db)
+
+    # Add a data point
+    data = summary.AirPollutionData(entity="Testland", code="TST", year=2004, **{param: 0.5 for param in PARAMETERS})
+    db.add(data)
+    summary.add_values(db, data.entity, summary.row_values(data))
+    db.commit()
+    assert_summary_matches_data(db, "Testland")
+
+    # Move the data point to the other entity
+    summary.remove_values(db, data.entity, summary.row_values(data))
+    data.entity = "Otherland"
+    data.nitrogen_oxide = 42.0
+    summary.add_values(db, data.entity, summary.row_values(data))
+    db.commit()
+    assert_summary_matches_data(db, "Testland")
+    assert_summary_matches_data(db, "Otherland")
+
+    # Delete the data point again
+    summary.remove_values(db, data.entity, summary.row_values(data))
+    db.delete(data)
+    db.commit()
+    assert_summary_matches_data(db, "Otherland")
+    assert summary.get_summary_stats(db, "Otherland")["ammonia"] == {"mean": 5.0, "median": 5.0, "stddev": None}
+
+
+def test_summary_of_new_entity(db):
+    # An entity without summary rows gets them created on the first write
+    data = summary.AirPollutionData(entity="Newland", code="NEW", year=2000, **{param: 1.0 for param in PARAMETERS})
+    db.add(data)
+    summary.add_values(db, data.entity, summary.row_values(data))
+    db.commit()
+    assert summary.get_summary_stats(db, "Newland")["nmvoc"] == {"mean": 1.0, "median": 1.0, "stddev": None}
+
+
+def test_stddev_of_large_values_with_small_spread(db):
+    # The sum of squares of 1e8 + N(0, 1) loses the whole spread to rounding
+    rng = np.random.default_rng(0)
+    for year, value in enumerate(1e8 + rng.normal(0.0, 1.0, 100), start=1900):
+        db.add(summary.AirPollutionData(entity="Flatland", code="FLT", year=year, **{param: float(value) for param in PARAMETERS}))
+    db.commit()
+    summary.rebuild_summary(db)
+    assert summary.get_summary_stats(db, "Flatland")["ammonia"]["stddev"] == pytest.approx(
+        compute_stats(fetch_values(db, "Flatland"))["ammonia"]["stddev"], rel=1e-6)
+
+
+def test_mean_and_stddev_do_not_drift(db):
+    # Add and remove large values one by one: mean and sd come from the same exact sum of the remaining values
+    rng = np.random.default_rng(1)
+    values = [float(value) for value in 1e8 + rng.normal(0.0, 1.0, 60)]
+    for value in values:
+        summary.add_values(db, "Driftland", {param: value for param in PARAMETERS})
+    for value in values[::2]:
+        summary.remove_values(db, "Driftland", {param: value for param in PARAMETERS})
+    db.commit()
+    stats = summary.get_summary_stats(db, "Driftland")["ammonia"]
+    remaining = values[1::2]
+    assert stats["mean"] == statistics.fmean(remaining)
+    assert stats["stddev"] == pytest.approx(statistics.stdev(remaining), rel=1e-9)